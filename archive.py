@@ -0,0 +1,270 @@
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import zlib
+
+from storage import BUSY_TIMEOUT, PRAGMAS
+
+ARCHIVE_PATH = os.getenv("WALMART_ARCHIVE_PATH", "walmart_archive.db")
+
+# Set WALMART_ARCHIVE=0 to stop archiving fetched pages
+ARCHIVE_ENABLED = os.getenv("WALMART_ARCHIVE", "1") != "0"
+
+COMPRESSION_LEVEL = 6
+
+# cursor is '' for the first page of a window; date_filter is walmart_orders.CREATED
+# or LAST_MODIFIED, so a change-feed window never replaces a created-date window
+PAGES_TABLE = '''
+    CREATE TABLE IF NOT EXISTS {name} (
+        ship_node TEXT NOT NULL,
+        date_filter TEXT NOT NULL DEFAULT 'created',
+        window_start TEXT NOT NULL,
+        window_end TEXT NOT NULL,
+        cursor TEXT NOT NULL,
+        content_hash TEXT NOT NULL,
+        fetched_at TIMESTAMP,
+        PRIMARY KEY (ship_node, date_filter, window_start, window_end, cursor)
+    )
+'''
+
+logger = logging.getLogger(__name__)
+
+
+def encode_page(orders):
+    """Canonical JSON bytes of a page's orders and their content hash"""
+    content = json.dumps(orders, sort_keys=True, separators=(",", ":"), default=str).encode()
+    return content, hashlib.blake2b(content, digest_size=16).hexdigest()
+
+
+def _link_orders(conn, page_id, orders, previous):
+    """Point a page's orders at it and delete the pages (and payloads) left without a latest order.
+
+    previous is the (rowid, content_hash) of the row the page replaced, if any.
+    """
+    order_ids = list({order.get("purchaseOrderId") for order in orders if order.get("purchaseOrderId")})
+    stale = {previous[0]} if previous else set()
+    for offset in range(0, len(order_ids), 500):
+        chunk = order_ids[offset:offset + 500]
+        rows = conn.execute(f'''
+            SELECT DISTINCT page_id FROM page_orders WHERE purchase_order_id IN ({", ".join("?" for _ in chunk)})
+        ''', chunk).fetchall()
+        stale.update(row[0] for row in rows)
+    if previous:
+        # Orders only the replaced content held are no longer archived anywhere
+        conn.execute('DELETE FROM page_orders WHERE page_id = ?', (previous[0],))
+    conn.executemany('''
+        INSERT INTO page_orders (purchase_order_id, page_id) VALUES (?, ?)
+        ON CONFLICT(purchase_order_id) DO UPDATE SET page_id = excluded.page_id
+    ''', [(order_id, page_id) for order_id in order_ids])
+    stale.discard(page_id)
+
+    hashes = {previous[1]} if previous else set()
+    for stale_id in stale:
+        if conn.execute('SELECT 1 FROM page_orders WHERE page_id = ? LIMIT 1', (stale_id,)).fetchone():
+            continue
+        row = conn.execute('DELETE FROM pages WHERE rowid = ? RETURNING content_hash', (stale_id,)).fetchone()
+        if row:
+            hashes.add(row[0])
+    for content_hash in hashes:
+        conn.execute('''
+            DELETE FROM blobs WHERE content_hash = ?
+            AND NOT EXISTS (SELECT 1 FROM pages WHERE content_hash = blobs.content_hash)
+        ''', (content_hash,))
+
+
+class PageArchive:
+    """Compressed store of every raw page fetched from the orders endpoint.
+
+    Lives in its own SQLite file next to the order database. Page payloads
+    are zlib-compressed and stored once per content hash in `blobs`; `pages`
+    maps each (ship node, date filter, window, cursor) to the payload it
+    returned the last time it was fetched. `page_orders` points every purchase order at
+    the latest page holding it; once a page holds no latest copy of any
+    order (the overlap re-fetched by each incremental sync, whose windows
+    never repeat exactly) it is deleted, so the archive grows with the
+    number of orders rather than the number of syncs. A payload no page
+    points to any more is dropped with it.
+    """
+
+    def __init__(self, path=ARCHIVE_PATH):
+        self.path = path
+        self._lock = threading.RLock()
+        self.conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT, check_same_thread=False, isolation_level=None)
+        for pragma in PRAGMAS:
+            self.conn.execute(pragma)
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS blobs (
+                content_hash TEXT PRIMARY KEY,
+                payload BLOB NOT NULL,
+                raw_size INTEGER NOT NULL,
+                order_count INTEGER NOT NULL
+            )
+        ''')
+        self.conn.execute(PAGES_TABLE.format(name="pages"))
+        columns = {row[1] for row in self.conn.execute('PRAGMA table_info(pages)')}
+        if "date_filter" not in columns:
+            self._add_date_filter()
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_pages_content_hash ON pages (content_hash)')
+        indexed = self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'page_orders'"
+        ).fetchone()
+        # page_id is the rowid of the latest page holding the order
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS page_orders (
+                purchase_order_id TEXT PRIMARY KEY,
+                page_id INTEGER NOT NULL
+            )
+        ''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_page_orders_page_id ON page_orders (page_id)')
+        if not indexed:
+            self._index_pages()
+
+    def _add_date_filter(self):
+        """Rebuild a pages table written before pages were keyed by date filter.
+
+        Rowids are kept, as page_orders and fetch order depend on them. The
+        older pages cannot be told apart, so they are all taken as created-date pages.
+        """
+        with self.transaction() as conn:
+            conn.execute(PAGES_TABLE.format(name="pages_keyed"))
+            conn.execute('''
+                INSERT INTO pages_keyed (rowid, ship_node, window_start, window_end, cursor, content_hash, fetched_at)
+                SELECT rowid, ship_node, window_start, window_end, cursor, content_hash, fetched_at FROM pages
+            ''')
+            conn.execute('DROP TABLE pages')
+            conn.execute('ALTER TABLE pages_keyed RENAME TO pages')
+
+    def _index_pages(self):
+        """Fill page_orders for an archive written before it existed, pruning superseded pages"""
+        with self._lock:
+            page_ids = [row[0] for row in self.conn.execute('SELECT rowid FROM pages ORDER BY rowid')]
+        for page_id in page_ids:
+            with self.transaction() as conn:
+                row = conn.execute('''
+                    SELECT payload FROM pages JOIN blobs USING (content_hash) WHERE pages.rowid = ?
+                ''', (page_id,)).fetchone()
+                if row is not None:
+                    _link_orders(conn, page_id, json.loads(zlib.decompress(row[0])), None)
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+    @contextlib.contextmanager
+    def transaction(self):
+        with self._lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield self.conn
+            except BaseException:
+                self.conn.execute('ROLLBACK')
+                raise
+            self.conn.execute('COMMIT')
+
+    def put_page(self, page, fetched_at):
+        """Archive one walmart_orders.Page; returns True if its payload was not stored yet"""
+        content, content_hash = encode_page(page.orders)
+        key = (
+            page.ship_node,
+            page.date_filter,
+            page.window_start.isoformat(sep=" "),
+            page.window_end.isoformat(sep=" "),
+            page.cursor or "",
+        )
+        with self.transaction() as conn:
+            previous = conn.execute('''
+                SELECT rowid, content_hash FROM pages
+                WHERE ship_node = ? AND date_filter = ? AND window_start = ? AND window_end = ? AND cursor = ?
+            ''', key).fetchone()
+            is_new = conn.execute('SELECT 1 FROM blobs WHERE content_hash = ?', (content_hash,)).fetchone() is None
+            if is_new:
+                conn.execute(
+                    'INSERT INTO blobs (content_hash, payload, raw_size, order_count) VALUES (?, ?, ?, ?)',
+                    (content_hash, zlib.compress(content, COMPRESSION_LEVEL), len(content), len(page.orders))
+                )
+            # REPLACE deletes and re-inserts, so a re-fetched page moves to the end of rowid order
+            page_id = conn.execute('''
+                INSERT OR REPLACE INTO pages (
+                    ship_node, date_filter, window_start, window_end, cursor, content_hash, fetched_at
+                ) VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', key + (content_hash, fetched_at)).lastrowid
+            _link_orders(conn, page_id, page.orders, previous)
+        return is_new
+
+    def iter_pages(self, ship_node=None, start=None, end=None, chunk_size=100, newest_first=False,
+                   date_filter=None):
+        """Yield (ship node, orders) for archived pages, oldest fetch first unless newest_first.
+
+        date_filter keeps only pages fetched with that filter. start/end
+        (naive UTC datetimes) keep only pages that can hold orders created
+        in [start, end): created-date windows overlapping it, and change-feed
+        windows ending after start, whose orders may have been created at
+        any earlier time. Pages are read in chunks, so only one chunk of
+        decompressed payloads is held at a time.
+        """
+        clauses = [f"pages.rowid {'<' if newest_first else '>'} ?"]
+        params = []
+        if ship_node:
+            clauses.append("ship_node = ?")
+            params.append(ship_node)
+        if date_filter:
+            clauses.append("date_filter = ?")
+            params.append(date_filter)
+        if start is not None:
+            clauses.append("window_end > ?")
+            params.append(start.isoformat(sep=" "))
+        if end is not None:
+            clauses.append("(date_filter != 'created' OR window_start < ?)")
+            params.append(end.isoformat(sep=" "))
+
+        last_rowid = 2 ** 63 - 1 if newest_first else 0
+        while True:
+            with self._lock:
+                # Pages are in fetch order by rowid (see put_page)
+                rows = self.conn.execute(f'''
+                    SELECT pages.rowid, ship_node, payload FROM pages
+                    JOIN blobs USING (content_hash)
+                    WHERE {" AND ".join(clauses)}
+                    ORDER BY pages.rowid {'DESC' if newest_first else 'ASC'}
+                    LIMIT ?
+                ''', [last_rowid] + params + [chunk_size]).fetchall()
+            if not rows:
+                return
+            for rowid, page_ship_node, payload in rows:
+                yield page_ship_node, json.loads(zlib.decompress(payload))
+            last_rowid = rows[-1][0]
+
+    def stats(self):
+        with self._lock:
+            pages = self.conn.execute('SELECT COUNT(*) FROM pages').fetchone()[0]
+            blobs, orders, raw_size, stored_size = self.conn.execute('''
+                SELECT COUNT(*), COALESCE(SUM(order_count), 0), COALESCE(SUM(raw_size), 0),
+                       COALESCE(SUM(LENGTH(payload)), 0)
+                FROM blobs
+            ''').fetchone()
+        return {
+            "pages": pages,
+            "payloads": blobs,
+            "orders": orders,
+            "raw_bytes": raw_size,
+            "stored_bytes": stored_size,
+        }
+
+
+_archives = {}
+_archives_lock = threading.Lock()
+
+
+def get_archive(path=None):
+    """Return the process-wide PageArchive for an archive file, opening it once"""
+    path = path or ARCHIVE_PATH
+    with _archives_lock:
+        archive = _archives.get(path)
+        if archive is None:
+            archive = PageArchive(path)
+            _archives[path] = archive
+        return archive
@@ -0,0 +1,228 @@
+"""End-to-end benchmark of token, fetch, normalize, store, ingest and query against the mock API.
+
+    python benchmarks/bench_e2e.py --lines 1000,100000,1000000 --json results.json
+
+For each data set size a mock Walmart server (benchmarks/mock_server.py) is
+started in-process and every stage is measured on its own:
+
+  token      minting a token, and get_token() served from the cache
+  fetch      walking every cursor chain of the range with OrderFetcher
+  normalize  normalize_orders() over JSON round-tripped ingest batches
+  store      OrderStore.upsert_order_lines() of those batches
+  ingest     ingest.backfill(): fetch, normalize, store and archive together
+  query      the dashboard queries against the stored lines, bypassing the cache
+
+Pass --latency-ms, --burst-every, --rate-limit or --token-ttl to measure
+under network delay, throttling, a rate quota or token expiry. Save results with --json and compare
+runs before and after a change.
+"""
+import argparse
+import datetime
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from archive import PageArchive  # noqa: E402
+from ingest import INGEST_BATCH_ORDERS, backfill  # noqa: E402
+from mock_server import MockWalmartServer, SyntheticOrders  # noqa: E402
+from normalize import normalize_orders  # noqa: E402
+from queries import order_summary, query_orders, sales_trend, search_skus  # noqa: E402
+from rate_limit import RateLimitGovernor  # noqa: E402
+from storage import OrderStore  # noqa: E402
+from walmart_auth import TokenManager  # noqa: E402
+from walmart_http import WalmartHttpClient  # noqa: E402
+from walmart_orders import OrderFetcher  # noqa: E402
+
+START = datetime.datetime(2024, 1, 1)
+QUERY_RUNS = 50
+
+
+def summarize(samples):
+    """p50/p95/max of latency samples in seconds, as milliseconds"""
+    ordered = sorted(samples)
+    return {
+        "p50_ms": statistics.median(ordered) * 1000,
+        "p95_ms": ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)] * 1000,
+        "max_ms": ordered[-1] * 1000,
+    }
+
+
+def timed(function, runs):
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def bench_token(base_url):
+    token_manager = TokenManager("bench-client", "bench-secret", f"{base_url}/v3/token",
+                                 http_client=WalmartHttpClient())
+    mint = timed(lambda: token_manager.get_token(force_refresh=True), 20)
+    cached = timed(token_manager.get_token, 10000)
+    return [
+        dict(stage="token mint", ops=len(mint), seconds=sum(mint), **summarize(mint)),
+        dict(stage="token cached", ops=len(cached), seconds=sum(cached), **summarize(cached)),
+    ]
+
+
+def _fetcher(base_url, governor=None):
+    http_client = WalmartHttpClient(governor=governor, account="bench-client")
+    token_manager = TokenManager("bench-client", "bench-secret", f"{base_url}/v3/token", http_client=http_client)
+    return OrderFetcher(token_manager, f"{base_url}/v3/orders", "mock", http_client=http_client)
+
+
+def bench_fetch(base_url, start, end, governor=None):
+    fetcher = _fetcher(base_url, governor)
+    orders = pages = 0
+    page_samples = []
+    started = last = time.perf_counter()
+    for page in fetcher.iter_pages(start, end):
+        now = time.perf_counter()
+        page_samples.append(now - last)
+        last = now
+        pages += 1
+        orders += len(page.orders)
+    seconds = time.perf_counter() - started
+    stats = fetcher.http_client.stats()
+    return [dict(stage="fetch", ops=orders, pages=pages, seconds=seconds, requests=stats["requests"],
+                 retries=stats["retries"], throttled=stats["throttled"],
+                 rate_limited_seconds=stats["rate_limited_seconds"], **summarize(page_samples or [0.0]))]
+
+
+def bench_normalize_store(synthetic, path):
+    """Normalize and store every order in ingest-sized batches; returns the results and the store"""
+    store = OrderStore(path)
+    normalize_samples = []
+    store_samples = []
+    lines = 0
+    for offset in range(0, synthetic.count, INGEST_BATCH_ORDERS):
+        indexes = range(offset, min(offset + INGEST_BATCH_ORDERS, synthetic.count))
+        # Round-trip through JSON so the dicts are laid out the way response.json() leaves them
+        batch = json.loads(json.dumps([synthetic.order(index) for index in indexes]))
+
+        started = time.perf_counter()
+        order_lines = normalize_orders(batch)
+        normalized = time.perf_counter()
+        store.upsert_order_lines(order_lines, ship_node="mock")
+        stored = time.perf_counter()
+
+        normalize_samples.append(normalized - started)
+        store_samples.append(stored - normalized)
+        lines += len(order_lines)
+    return [
+        dict(stage="normalize", ops=lines, seconds=sum(normalize_samples), **summarize(normalize_samples)),
+        dict(stage="store", ops=lines, seconds=sum(store_samples), **summarize(store_samples)),
+    ], store
+
+
+def bench_ingest(base_url, start, end, directory, governor=None):
+    store = OrderStore(os.path.join(directory, "ingest.db"))
+    archive = PageArchive(os.path.join(directory, "archive.db"))
+    started = time.perf_counter()
+    result = backfill(_fetcher(base_url, governor), start, end, store=store, archive=archive)
+    seconds = time.perf_counter() - started
+    store.close()
+    archive.close()
+    return [dict(stage="ingest", ops=result.row_count, seconds=seconds, pages=result.pages,
+                 complete=result.complete)]
+
+
+def bench_queries(store, start, end):
+    start_date, end_date = start.date(), (end - datetime.timedelta(days=1)).date()
+    busiest = search_skus(store, "", limit=1)
+    sku = busiest[0] if busiest else None
+    line_count = order_summary(store, None, start_date, end_date)["line_count"]
+    middle = store.query_one('''
+        SELECT order_date, purchase_order_id, line_number FROM orders
+        ORDER BY order_date DESC, purchase_order_id DESC, line_number DESC LIMIT 1 OFFSET ?
+    ''', (line_count // 2,))
+    middle = tuple(middle) if middle else None
+
+    cases = {
+        "query summary": lambda: order_summary(store, None, start_date, end_date),
+        "query summary sku": lambda: order_summary(store, sku, start_date, end_date),
+        "query first page": lambda: query_orders(store, None, start_date, end_date),
+        "query deep page": lambda: query_orders(store, None, start_date, end_date, after=middle),
+        "query sku page": lambda: query_orders(store, sku, start_date, end_date),
+        "query trend": lambda: sales_trend(store, None, start_date, end_date, "Monthly"),
+        "query sku prefix": lambda: search_skus(store, "SKU-01"),
+        "query sku substring": lambda: search_skus(store, "Product SKU-019"),
+    }
+    results = []
+    for stage, function in cases.items():
+        samples = timed(function, QUERY_RUNS)
+        results.append(dict(stage=stage, ops=len(samples), seconds=sum(samples), **summarize(samples)))
+    return results
+
+
+def run_size(line_count, args):
+    synthetic = SyntheticOrders(line_count, START, args.days, args.seed)
+    start, end = START, START + datetime.timedelta(days=args.days)
+    results = []
+    with MockWalmartServer(synthetic, latency_ms=args.latency_ms, token_ttl=args.token_ttl,
+                           burst_every=args.burst_every, burst_length=args.burst_length,
+                           retry_after=args.retry_after, rate_limit=args.rate_limit,
+                           rate_window=args.rate_window) as server:
+        with tempfile.TemporaryDirectory() as directory:
+            governor = None if args.no_governor else RateLimitGovernor(os.path.join(directory, "ratelimit.db"))
+            results += bench_token(server.base_url)
+            results += bench_fetch(server.base_url, start, end, governor)
+            stage_results, store = bench_normalize_store(synthetic, os.path.join(directory, "orders.db"))
+            results += stage_results
+            results += bench_queries(store, start, end)
+            store.close()
+            results += bench_ingest(server.base_url, start, end, directory, governor)
+            if governor is not None:
+                governor.close()
+    for result in results:
+        result["lines"] = line_count
+    return results
+
+
+def print_results(results):
+    print(f"{'lines':>9}  {'stage':<20} {'ops':>10} {'seconds':>9} {'ops/s':>12} {'p50 ms':>9} {'p95 ms':>9}")
+    for result in results:
+        rate = result["ops"] / result["seconds"] if result["seconds"] else 0.0
+        p50 = f"{result['p50_ms']:9.3f}" if "p50_ms" in result else f"{'':>9}"
+        p95 = f"{result['p95_ms']:9.3f}" if "p95_ms" in result else f"{'':>9}"
+        print(f"{result['lines']:>9,}  {result['stage']:<20} {result['ops']:>10,} {result['seconds']:>9.3f} "
+              f"{rate:>12,.0f} {p50} {p95}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--lines", default="1000,100000,1000000", help="Comma-separated data set sizes")
+    parser.add_argument("--days", type=int, default=30, help="Days the orders are spread over")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Mean mock response delay")
+    parser.add_argument("--token-ttl", type=int, default=900, help="Mock access token lifetime in seconds")
+    parser.add_argument("--burst-every", type=int, default=0, help="Mock 429 burst every N requests (0: never)")
+    parser.add_argument("--burst-length", type=int, default=3, help="Requests throttled per burst")
+    parser.add_argument("--retry-after", type=float, default=0.1, help="Retry-After seconds sent with 429s")
+    parser.add_argument("--rate-limit", type=int, default=0, help="Mock orders calls per window (0: no limit)")
+    parser.add_argument("--rate-window", type=float, default=1.0, help="Mock rate-limit window in seconds")
+    parser.add_argument("--no-governor", action="store_true", help="Fetch without the rate-limit governor")
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    results = []
+    for line_count in (int(value) for value in args.lines.split(",")):
+        size_results = run_size(line_count, args)
+        print_results(size_results)
+        print()
+        results += size_results
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Compare the vectorized normalizer with the per-line dict loop it replaced.
+
+    python benchmarks/bench_normalize.py --lines 100000 --batch 1000
+
+Orders are round-tripped through JSON first so they are laid out in memory
+the way response.json() leaves them. Each implementation is timed over the
+whole set in one call and in ingest-sized batches.
+"""
+import argparse
+import datetime
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from normalize import normalize_orders  # noqa: E402
+from synthetic import make_orders  # noqa: E402
+
+
+def flatten_orders_loop(orders):
+    """The original per-line processing loop from dashboard.py, kept as the baseline"""
+    processed_order = []
+    for order in orders:
+        if isinstance(order, dict):
+            order_lines = order.get("orderLines", {}).get("orderLine", [])
+            for line in order_lines:
+                if isinstance(line, dict):
+                    item = line.get("item", {})
+                    charges = line.get("charges", {})
+                    charge_list = charges.get("charge", [])
+                    unit_price = 0
+                    if charge_list and isinstance(charge_list, list):
+                        first_charge = charge_list[0]
+                        if isinstance(first_charge, dict):
+                            charge_amount = first_charge.get("chargeAmount", {})
+                            unit_price = float(charge_amount.get("amount", 0))
+                    quantity = float(line.get("orderLineQuantity", {}).get("amount", 1))
+                    quantity = quantity if quantity > 0 else 1
+                    processed_order.append({
+                        "SKU": item.get("sku", "N/A"),
+                        "Item Name": item.get("productName", "N/A"),
+                        "Quantity": quantity,
+                        "Unit Price ($)": unit_price,
+                        "Purchase Order ID": order.get("purchaseOrderId", "N/A"),
+                        "Order Date": datetime.datetime.fromtimestamp(
+                            int(str(order.get("orderDate", 0))[:10])
+                        ).strftime('%Y-%m-%d %H:%M:%S')
+                    })
+    return processed_order
+
+
+def best_of(function, batches, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        rows = sum(len(function(batch)) for batch in batches)
+        timings.append(time.perf_counter() - started)
+    return min(timings), rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--lines", type=int, default=100_000, help="Synthetic order lines to normalize")
+    parser.add_argument("--batch", type=int, default=1000, help="Orders per batch for the batched run")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    orders = json.loads(json.dumps(make_orders(args.lines)))
+    runs = [
+        ("single batch", [orders]),
+        (f"batches of {args.batch}", [orders[i:i + args.batch] for i in range(0, len(orders), args.batch)]),
+    ]
+
+    print(f"{len(orders):,} orders / {args.lines:,} order lines")
+    for label, batches in runs:
+        loop_seconds, loop_rows = best_of(flatten_orders_loop, batches, args.repeat)
+        vector_seconds, vector_rows = best_of(normalize_orders, batches, args.repeat)
+        assert loop_rows == vector_rows, (loop_rows, vector_rows)
+        print(f"{label}:")
+        print(f"  per-line loop   {loop_seconds:8.3f}s  {loop_rows / loop_seconds:12,.0f} lines/s")
+        print(f"  vectorized      {vector_seconds:8.3f}s  {vector_rows / vector_seconds:12,.0f} lines/s")
+        print(f"  speedup         {loop_seconds / vector_seconds:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Measure order-line ingest throughput into SQLite, old path vs OrderStore.
+
+    python benchmarks/bench_storage.py --lines 100000 --batch 1000
+
+The old path is the original save_orders_to_db(): a fresh connection per
+call and one INSERT OR IGNORE per row on the purchase_order_id-keyed table.
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from normalize import normalize_orders  # noqa: E402
+from storage import OrderStore  # noqa: E402
+from synthetic import make_orders  # noqa: E402
+
+
+def save_orders_row_by_row(path, order_lines):
+    """The original storage path, kept as the baseline"""
+    conn = sqlite3.connect(path)
+    c = conn.cursor()
+    rows = zip(
+        order_lines["purchase_order_id"], order_lines["sku"], order_lines["item_name"],
+        order_lines["quantity"], order_lines["unit_price"], order_lines["order_date"].dt.strftime('%Y-%m-%d %H:%M:%S')
+    )
+    for row in rows:
+        try:
+            c.execute('''
+                INSERT OR IGNORE INTO orders
+                (purchase_order_id, sku, item_name, quantity, unit_price, order_date)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', row)
+        except sqlite3.Error as e:
+            print(f"Database error: {e}")
+    conn.commit()
+    conn.close()
+
+
+def bench_row_by_row(directory, batches):
+    path = os.path.join(directory, "old.db")
+    conn = sqlite3.connect(path)
+    conn.execute('''
+        CREATE TABLE orders (
+            purchase_order_id TEXT PRIMARY KEY, sku TEXT, item_name TEXT,
+            quantity REAL, unit_price REAL, order_date TIMESTAMP
+        )
+    ''')
+    conn.close()
+    started = time.perf_counter()
+    for batch in batches:
+        save_orders_row_by_row(path, batch)
+    return time.perf_counter() - started
+
+
+def bench_store(directory, batches):
+    store = OrderStore(os.path.join(directory, "new.db"))
+    started = time.perf_counter()
+    for batch in batches:
+        store.upsert_order_lines(batch)
+    elapsed = time.perf_counter() - started
+    store.close()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--lines", type=int, default=100_000, help="Synthetic order lines to store")
+    parser.add_argument("--batch", type=int, default=1000, help="Orders per write call")
+    args = parser.parse_args()
+
+    orders = make_orders(args.lines)
+    batches = [normalize_orders(orders[i:i + args.batch]) for i in range(0, len(orders), args.batch)]
+    rows = sum(len(batch) for batch in batches)
+
+    with tempfile.TemporaryDirectory() as directory:
+        old_seconds = bench_row_by_row(directory, batches)
+        new_seconds = bench_store(directory, batches)
+
+    print(f"{rows:,} order lines in {len(batches)} write calls")
+    print(f"row-by-row insert   {old_seconds:8.3f}s  {rows / old_seconds:12,.0f} rows/s")
+    print(f"OrderStore upsert   {new_seconds:8.3f}s  {rows / new_seconds:12,.0f} rows/s")
+    print(f"speedup             {old_seconds / new_seconds:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,328 @@
+"""Local stand-in for the Walmart Marketplace token and orders endpoints.
+
+    python benchmarks/mock_server.py --lines 100000 --port 8099 --latency-ms 50
+    WALMART_API_BASE_URL=http://127.0.0.1:8099 streamlit run dashboard.py
+
+Orders are generated on demand from their index, so the server holds no
+data set in memory however many order lines it serves: order i always has
+the same content, and order dates are spread evenly over --days. Every
+shipNode gets its own orders on the same dates. Tokens
+expire after --token-ttl seconds and are then rejected with 401, every
+--burst-every requests the next --burst-length ones are throttled with 429
+and Retry-After, and every response can be delayed by --latency-ms.
+
+With --rate-limit, each client id may make that many orders calls per
+--rate-window seconds. Responses carry the x-current-token-count and
+x-next-replenish-time headers, and calls over the quota get a 429.
+"""
+import argparse
+import base64
+import bisect
+import datetime
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic import make_order  # noqa: E402
+
+# Mean order lines per synthetic order (line counts are drawn from 1, 1, 1, 2, 3)
+LINES_PER_ORDER = 1.6
+
+API_TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%fZ'
+
+
+class SyntheticOrders:
+    """Deterministic orders spread evenly over [start, start + days), generated from their index"""
+
+    def __init__(self, line_count, start=None, days=30, seed=0):
+        self.count = max(int(line_count / LINES_PER_ORDER), 1)
+        self.seed = seed
+        start = start or datetime.datetime(2024, 1, 1)
+        self.start_ms = int(start.replace(tzinfo=datetime.timezone.utc).timestamp() * 1000)
+        self.span_ms = days * 24 * 3600 * 1000
+
+    def order_date(self, index):
+        return self.start_ms + index * self.span_ms // self.count
+
+    def index_at(self, epoch_ms):
+        """Index of the first order created at or after epoch_ms"""
+        return bisect.bisect_left(range(self.count), epoch_ms, key=self.order_date)
+
+    def order(self, index, seed=None):
+        """Order number `index`; another seed gives different orders with the same dates"""
+        seed = self.seed if seed is None else seed
+        rng = random.Random(seed * 1_000_003 + index)
+        order = make_order(rng, self.order_date(index), rng.choice([1, 1, 1, 2, 3]))
+        # Index-derived ids are unique, unlike random ones
+        order["purchaseOrderId"] = f"{seed:03d}{index:010d}"
+        return order
+
+
+def parse_api_time(value):
+    """Epoch ms of a createdStartDate/lastModifiedEndDate/... value"""
+    value = value.replace("Z", "")
+    for fmt in ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S'):
+        try:
+            moment = datetime.datetime.strptime(value, fmt)
+            return int(moment.replace(tzinfo=datetime.timezone.utc).timestamp() * 1000)
+        except ValueError:
+            continue
+    raise ValueError(f"Unrecognized date: {value}")
+
+
+class MockWalmartServer:
+    """Threaded HTTP server for /v3/token and /v3/orders; start() runs it on a background thread"""
+
+    def __init__(self, orders, host="127.0.0.1", port=0, latency_ms=0.0, token_ttl=900,
+                 burst_every=0, burst_length=0, retry_after=1.0, rate_limit=0, rate_window=60.0):
+        self.orders = orders
+        self.latency_ms = latency_ms
+        self.token_ttl = token_ttl
+        self.burst_every = burst_every
+        self.burst_length = burst_length
+        self.retry_after = retry_after
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+
+        self._lock = threading.Lock()
+        self._tokens = {}
+        self._quotas = {}
+        self._requests = 0
+        self.status_counts = {}
+
+        handler = type("Handler", (_Handler,), {"mock": self})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="mock-walmart", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def stats(self):
+        with self._lock:
+            return {"requests": self._requests, "status_counts": dict(self.status_counts),
+                    "live_tokens": len(self._tokens)}
+
+    # Request handling, called from the handler threads
+
+    def delay(self):
+        if self.latency_ms:
+            time.sleep(random.uniform(0.5, 1.5) * self.latency_ms / 1000)
+
+    def throttled(self):
+        """Count a request; True while inside a 429 burst"""
+        with self._lock:
+            self._requests += 1
+            if not self.burst_every:
+                return False
+            return self._requests % self.burst_every < self.burst_length
+
+    def count_status(self, status):
+        with self._lock:
+            self.status_counts[status] = self.status_counts.get(status, 0) + 1
+
+    def issue_token(self, client_id):
+        token = uuid.uuid4().hex
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = {key: value for key, value in self._tokens.items() if value[0] > now}
+            self._tokens[token] = (now + self.token_ttl, client_id)
+        return token
+
+    def token_client(self, token):
+        """Client id a live token was issued to, or None"""
+        with self._lock:
+            expiry, client_id = self._tokens.get(token, (0, None))
+        return client_id if expiry > time.monotonic() else None
+
+    def take_quota(self, client_id):
+        """Spend one call of a client's fixed-window quota; returns (allowed, tokens left, window end epoch s)"""
+        now = time.time()
+        with self._lock:
+            window_end, used = self._quotas.get(client_id, (0.0, 0))
+            if now >= window_end:
+                window_end, used = now + self.rate_window, 0
+            allowed = used < self.rate_limit
+            if allowed:
+                used += 1
+            self._quotas[client_id] = (window_end, used)
+        return allowed, self.rate_limit - used, window_end
+
+    def orders_page(self, params):
+        # Synthetic orders are never modified after creation, so the change feed selects by creation too
+        date_filter = "lastModified" if "lastModifiedStartDate" in params else "created"
+        start_ms = parse_api_time(params[f"{date_filter}StartDate"])
+        end_ms = parse_api_time(params[f"{date_filter}EndDate"])
+        limit = min(int(params.get("limit", 100)), 200)
+        low = self.orders.index_at(start_ms)
+        # createdEndDate is inclusive
+        high = self.orders.index_at(end_ms + 1)
+        offset = int(params.get("nextCursor") or low)
+        page_end = min(offset + limit, high)
+        # Each ship node gets its own orders, so several sources can be ingested side by side
+        seed = (self.orders.seed + zlib.crc32(params.get("shipNode", "").encode())) % 1000
+        return {
+            "list": {
+                "meta": {
+                    "totalCount": high - low,
+                    "limit": limit,
+                    "nextCursor": str(page_end) if page_end < high else None,
+                },
+                "elements": {"order": [self.orders.order(index, seed) for index in range(offset, page_end)]},
+            }
+        }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately; with Nagle on, keep-alive clients stall on delayed ACKs
+    disable_nagle_algorithm = True
+    mock = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, payload, headers=None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+        self.mock.count_status(status)
+
+    def _error(self, status, code, description, headers=None):
+        self._send(status, {"errors": {"error": [{"code": code, "description": description}]}}, headers)
+
+    def _common(self):
+        """Latency and 429 bursts shared by both endpoints; returns False if the request was answered"""
+        self.mock.delay()
+        if self.mock.throttled():
+            self._error(429, "REQUEST_THRESHOLD_VIOLATED.GMP_GATEWAY_API", "Too many requests",
+                        {"Retry-After": f"{self.mock.retry_after:g}"})
+            return False
+        return True
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length).decode()
+        if urlparse(self.path).path != "/v3/token":
+            self._error(404, "NOT_FOUND", "Unknown endpoint")
+            return
+        if not self._common():
+            return
+        authorization = self.headers.get("Authorization", "")
+        try:
+            client_id, _, client_secret = base64.b64decode(authorization.split(" ", 1)[1]).decode().partition(":")
+        except (IndexError, ValueError):
+            client_id = client_secret = ""
+        if not authorization.startswith("Basic ") or not client_id or not client_secret:
+            self._error(401, "UNAUTHORIZED.GMP_GATEWAY_API", "Invalid client credentials")
+            return
+        if "grant_type=client_credentials" not in body:
+            self._error(400, "INVALID_REQUEST", "grant_type must be client_credentials")
+            return
+        self._send(200, {
+            "access_token": self.mock.issue_token(client_id),
+            "token_type": "Bearer",
+            "expires_in": self.mock.token_ttl,
+        })
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/stats":
+            self._send(200, self.mock.stats())
+            return
+        if url.path != "/v3/orders":
+            self._error(404, "NOT_FOUND", "Unknown endpoint")
+            return
+        if not self._common():
+            return
+        client_id = self.mock.token_client(self.headers.get("WM_SEC.ACCESS_TOKEN", ""))
+        if client_id is None:
+            self._error(401, "UNAUTHORIZED.GMP_GATEWAY_API", "Access token is invalid or expired")
+            return
+        headers = {}
+        if self.mock.rate_limit:
+            allowed, remaining, window_end = self.mock.take_quota(client_id)
+            headers = {"x-current-token-count": str(remaining), "x-next-replenish-time": str(int(window_end * 1000))}
+            if not allowed:
+                headers["Retry-After"] = f"{max(window_end - time.time(), 0):.3f}"
+                self._error(429, "REQUEST_THRESHOLD_VIOLATED.GMP_GATEWAY_API", "Too many requests", headers)
+                return
+        params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        try:
+            payload = self.mock.orders_page(params)
+        except (KeyError, ValueError) as e:
+            self._error(400, "INVALID_REQUEST", f"Bad query parameters: {e}")
+            return
+        if not payload["list"]["elements"]["order"]:
+            # Like the real endpoint, an empty window answers 404
+            self._error(404, "CONTENT_NOT_FOUND.GMP_ORDER_API", "No orders found", headers)
+            return
+        self._send(200, payload, headers)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--lines", type=int, default=100000, help="Order lines to serve")
+    parser.add_argument("--days", type=int, default=30, help="Days the orders are spread over, ending today")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Mean delay added to every response")
+    parser.add_argument("--token-ttl", type=int, default=900, help="Seconds before an access token expires")
+    parser.add_argument("--burst-every", type=int, default=0, help="Start a 429 burst every N requests (0: never)")
+    parser.add_argument("--burst-length", type=int, default=3, help="Requests throttled per burst")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds sent with 429s")
+    parser.add_argument("--rate-limit", type=int, default=0, help="Orders calls per client per window (0: no limit)")
+    parser.add_argument("--rate-window", type=float, default=60.0, help="Rate-limit window in seconds")
+    args = parser.parse_args(argv)
+
+    today = datetime.datetime.combine(datetime.date.today(), datetime.time.min)
+    orders = SyntheticOrders(args.lines, today - datetime.timedelta(days=args.days - 1), args.days, args.seed)
+    server = MockWalmartServer(
+        orders, args.host, args.port, latency_ms=args.latency_ms, token_ttl=args.token_ttl,
+        burst_every=args.burst_every, burst_length=args.burst_length, retry_after=args.retry_after,
+        rate_limit=args.rate_limit, rate_window=args.rate_window
+    )
+    print(f"Serving {orders.count} orders on {server.base_url} (Ctrl+C to stop)")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,57 @@
+import datetime
+import random
+
+SKUS = [f"SKU-{n:05d}" for n in range(2000)]
+
+
+def make_order_line(rng, line_number):
+    sku = rng.choice(SKUS)
+    quantity = rng.randint(1, 4)
+    price = round(rng.uniform(3, 250), 2)
+    charges = [{
+        "chargeType": "PRODUCT",
+        "chargeName": "ItemPrice",
+        "chargeAmount": {"currency": "USD", "amount": price},
+        "tax": {"taxName": "Tax1", "taxAmount": {"currency": "USD", "amount": round(price * 0.07, 2)}}
+    }]
+    if rng.random() < 0.3:
+        charges.append({
+            "chargeType": "SHIPPING",
+            "chargeName": "Shipping",
+            "chargeAmount": {"currency": "USD", "amount": 5.99},
+            "tax": None
+        })
+    return {
+        "lineNumber": str(line_number),
+        "item": {"productName": f"Product {sku}", "sku": sku},
+        "charges": {"charge": charges},
+        "orderLineQuantity": {"unitOfMeasurement": "EACH", "amount": str(quantity)},
+        "statusDate": None,
+        "orderLineStatuses": {"orderLineStatus": [{"status": "Created", "statusQuantity": {
+            "unitOfMeasurement": "EACH", "amount": str(quantity)}}]},
+    }
+
+
+def make_order(rng, order_date_ms, lines):
+    return {
+        "purchaseOrderId": str(rng.randrange(10 ** 12, 10 ** 13)),
+        "customerOrderId": str(rng.randrange(10 ** 12, 10 ** 13)),
+        "orderDate": order_date_ms,
+        "shippingInfo": {"methodCode": rng.choice(["Standard", "Express", "Value"])},
+        "orderLines": {"orderLine": [make_order_line(rng, n) for n in range(1, lines + 1)]},
+    }
+
+
+def make_orders(line_count, start=None, days=30, seed=0):
+    """Synthetic raw orders shaped like the orders API, holding about line_count order lines"""
+    rng = random.Random(seed)
+    start = start or datetime.datetime(2024, 1, 1)
+    start_ms = int(start.replace(tzinfo=datetime.timezone.utc).timestamp() * 1000)
+    span_ms = days * 24 * 3600 * 1000
+    orders = []
+    lines = 0
+    while lines < line_count:
+        count = min(rng.choice([1, 1, 1, 2, 3]), line_count - lines)
+        orders.append(make_order(rng, start_ms + rng.randrange(span_ms), count))
+        lines += count
+    return orders
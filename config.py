@@ -0,0 +1,66 @@
+import json
+import os
+from collections import namedtuple
+
+# Walmart DSV API Credentials
+# Try to get credentials from environment variables first, fall back to hardcoded values
+CLIENT_ID = os.getenv("WALMART_CLIENT_ID", "f657e76c-6e19-4459-8fda-ecf3ee17db44")
+CLIENT_SECRET = os.getenv("WALMART_CLIENT_SECRET", "ALsE88YTxPZ4dd7XKcF00FNKDlfjh9iIig7M5Z4AUabxn_KcJ6uKFcGtAdvfke5fgiDUqbXfXITzMg5U_ieEnKc")
+
+# Walmart API endpoints - try both production and sandbox
+# WALMART_API_BASE_URL points the app at another host, e.g. the mock server in benchmarks/
+API_BASE_URL = os.getenv("WALMART_API_BASE_URL", "https://marketplace.walmartapis.com").rstrip("/")
+TOKEN_URL = f"{API_BASE_URL}/v3/token"
+ORDERS_URL = f"{API_BASE_URL}/v3/orders"
+DEFAULT_SHIP_NODE = "39931104"
+
+# Alternative endpoints for troubleshooting
+SANDBOX_TOKEN_URL = "https://sandbox.walmartapis.com/v3/token"
+SANDBOX_ORDERS_URL = "https://sandbox.walmartapis.com/v3/orders"
+
+# How often the background worker runs an incremental sync, in seconds
+SYNC_INTERVAL = int(os.getenv("WALMART_SYNC_INTERVAL", "300"))
+
+# Also apply orders modified since the last sync (status changes, cancellations, refunds)
+# after every scheduled sync; set WALMART_CHANGE_FEED=0 to only fetch newly created orders
+CHANGE_FEED = os.getenv("WALMART_CHANGE_FEED", "1") != "0"
+
+# One seller account and ship node to ingest; ship nodes identify sources in the database
+Source = namedtuple("Source", ["name", "client_id", "client_secret", "ship_node", "max_workers"])
+
+
+def load_sources(value=None):
+    """Parse WALMART_SOURCES: a JSON list, or the path of a JSON file holding one, of
+    {"name", "client_id", "client_secret", "ship_node", "max_workers"} objects.
+
+    client_id and client_secret default to the account above, name to the
+    ship node and max_workers (concurrent window fetches) to
+    WALMART_FETCH_WORKERS. Without WALMART_SOURCES the single default
+    account and ship node are used.
+    """
+    value = (value if value is not None else os.getenv("WALMART_SOURCES", "")).strip()
+    if not value:
+        return [Source(DEFAULT_SHIP_NODE, CLIENT_ID, CLIENT_SECRET, DEFAULT_SHIP_NODE, None)]
+    if not value.startswith("["):
+        with open(value) as f:
+            value = f.read()
+    sources = []
+    for entry in json.loads(value):
+        ship_node = str(entry["ship_node"])
+        sources.append(Source(
+            str(entry.get("name") or ship_node),
+            entry.get("client_id") or CLIENT_ID,
+            entry.get("client_secret") or CLIENT_SECRET,
+            ship_node,
+            int(entry["max_workers"]) if entry.get("max_workers") else None,
+        ))
+    for field in ("name", "ship_node"):
+        values = [getattr(source, field) for source in sources]
+        if len(set(values)) != len(values):
+            raise ValueError(f"WALMART_SOURCES has duplicate {field} values")
+    if not sources:
+        raise ValueError("WALMART_SOURCES lists no sources")
+    return sources
+
+
+SOURCES = load_sources()
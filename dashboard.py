@@ -1,15 +1,29 @@
-import requests
 import pandas as pd
 import streamlit as st
 import datetime
 import uuid
 import base64
-import sqlite3
-import time
+
+import metrics
+from config import (
+    CHANGE_FEED, CLIENT_ID, CLIENT_SECRET, SANDBOX_TOKEN_URL, SOURCES, SYNC_INTERVAL, TOKEN_URL
+)
+from walmart_auth import TokenError, get_token_manager
+from walmart_http import WalmartHttpClient
+from walmart_orders import date_range_bounds
+from ingest import (
+    TIMESTAMP_FORMAT, sync_lock, sync_sources, utc_now, worker_alive
+)
+from queries import (
+    PAGE_SIZE, SKU_SEARCH_LIMIT, SORT_ORDERS, TREND_PERIODS, order_summary, query_orders, sales_trend,
+    search_skus
+)
+from query_cache import cached_query, get_query_cache
+from rate_limit import get_governor
+from storage import get_store
 
 # Ensure required modules are installed
 try:
-    import requests
     import pandas as pd
     import streamlit as st
 except ModuleNotFoundError as e:
@@ -24,22 +38,6 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# Walmart DSV API Credentials
-# Try to get credentials from environment variables first, fall back to hardcoded values
-import os
-
-CLIENT_ID = os.getenv("WALMART_CLIENT_ID", "f657e76c-6e19-4459-8fda-ecf3ee17db44")
-CLIENT_SECRET = os.getenv("WALMART_CLIENT_SECRET", "ALsE88YTxPZ4dd7XKcF00FNKDlfjh9iIig7M5Z4AUabxn_KcJ6uKFcGtAdvfke5fgiDUqbXfXITzMg5U_ieEnKc")
-
-# Walmart API endpoints - try both production and sandbox
-TOKEN_URL = "https://marketplace.walmartapis.com/v3/token"
-ORDERS_URL = "https://marketplace.walmartapis.com/v3/orders"
-DEFAULT_SHIP_NODE = "39931104"
-
-# Alternative endpoints for troubleshooting
-SANDBOX_TOKEN_URL = "https://sandbox.walmartapis.com/v3/token"
-SANDBOX_ORDERS_URL = "https://sandbox.walmartapis.com/v3/orders"
-
 # Validate credentials format
 if not CLIENT_ID or not CLIENT_SECRET:
     st.error("Missing Walmart API credentials. Please set WALMART_CLIENT_ID and WALMART_CLIENT_SECRET environment variables.")
@@ -87,7 +85,7 @@ def test_api_endpoints():
             }
             data = "grant_type=client_credentials"
             
-            response = requests.post(url, headers=headers, data=data, timeout=10)
+            response = diagnostic_http_client().post(url, headers=headers, data=data, timeout=10)
             results.append((name, url, response.status_code, response.text))
         except Exception as e:
             results.append((name, url, "ERROR", str(e)))
@@ -116,186 +114,177 @@ def decode_credentials():
     except Exception as e:
         return {"error": str(e)}
 
+# Long-lived resources, created once per server process and shared by every session and rerun
+@st.cache_resource
+def order_store():
+    return get_store()
+
+@st.cache_resource
+def token_manager(client_id=CLIENT_ID, client_secret=CLIENT_SECRET):
+    return get_token_manager(client_id, client_secret, TOKEN_URL)
+
+@st.cache_resource
+def diagnostic_http_client():
+    # One attempt per call, without retries or rate-limit waits, so a throttled endpoint reports at once
+    return WalmartHttpClient(max_retries=0)
+
 # Function to get Walmart API token
-def get_walmart_token():
-    credentials = f"{CLIENT_ID}:{CLIENT_SECRET}"
-    encoded_credentials = base64.b64encode(credentials.encode()).decode()
-    headers = {
-        "Accept": "application/json",
-        "Content-Type": "application/x-www-form-urlencoded",
-        "Authorization": f"Basic {encoded_credentials}",
-        "WM_QOS.CORRELATION_ID": str(uuid.uuid4()),
-        "WM_SVC.NAME": "Walmart Marketplace"
-    }
-    data = "grant_type=client_credentials"
+def get_walmart_token(source=None):
+    """Return an access token from the process-wide token cache, minting one only when it is missing or about to expire"""
+    manager = token_manager(source.client_id, source.client_secret) if source else token_manager()
     try:
-        response = requests.post(TOKEN_URL, headers=headers, data=data)
-        
-        # Debug information
-        st.write(f"Token request status: {response.status_code}")
-        st.write(f"Token request headers: {dict(headers)}")
-        st.write(f"Request URL: {TOKEN_URL}")
-        st.write(f"Request data: {data}")
-        
-        if response.status_code != 200:
-            st.error(f"Token request failed with status {response.status_code}")
-            st.error(f"Response text: {response.text}")
-            
-            # Additional debugging for common error codes
-            if response.status_code == 401:
-                st.error("🔍 401 Unauthorized - This usually means:")
-                st.error("   • Your credentials are expired or invalid")
-                st.error("   • You're using the wrong environment (prod vs sandbox)")
-                st.error("   • Your account doesn't have API access")
-            elif response.status_code == 403:
-                st.error("🔍 403 Forbidden - This usually means:")
-                st.error("   • Your account doesn't have permission for this API")
-                st.error("   • Your API subscription has expired")
-            elif response.status_code == 429:
-                st.error("🔍 429 Too Many Requests - Rate limiting")
-                st.error("   • Wait a few minutes and try again")
-            
+        return manager.get_token()
+    except TokenError as e:
+        if source is not None and len(SOURCES) > 1:
+            st.error(f"Source {source.name}:")
+        st.error(str(e))
+        if e.response_text:
+            st.error(f"Response text: {e.response_text}")
+
+        # Additional debugging for common error codes
+        if e.status_code == 401:
+            st.error("🔍 401 Unauthorized - This usually means:")
+            st.error("   • Your credentials are expired or invalid")
+            st.error("   • You're using the wrong environment (prod vs sandbox)")
+            st.error("   • Your account doesn't have API access")
+        elif e.status_code == 403:
+            st.error("🔍 403 Forbidden - This usually means:")
+            st.error("   • Your account doesn't have permission for this API")
+            st.error("   • Your API subscription has expired")
+        elif e.status_code == 429:
+            st.error("🔍 429 Too Many Requests - Rate limiting")
+            st.error("   • Wait a few minutes and try again")
+
+        return None
+
+# Function to fetch orders from Walmart API and store them
+def sync_orders(mode, start_date=None, end_date=None):
+    """Run an incremental sync (orders since the stored high-water mark) or an explicit backfill of a date range"""
+    if mode == "backfill":
+        # Validate dates
+        today = datetime.date.today()
+        if start_date > today or end_date > today:
+            st.error("Cannot fetch orders for future dates.")
             return None
-            
-        response.raise_for_status()
-        token_data = response.json()
-        access_token = token_data.get("access_token")
-        if not access_token:
-            st.error(f"Error: No access token received. Full response: {token_data}")
+        
+        if (end_date - start_date).days > 180:
+            st.error("Please select a date range of 180 days or less.")
             return None
-        return access_token
-    except requests.RequestException as e:
-        st.error(f"Failed to get Walmart API token: {str(e)}")
-        if hasattr(e, 'response') and e.response is not None:
-            st.error(f"Response status: {e.response.status_code}")
-            st.error(f"Response text: {e.response.text}")
+    
+    now = utc_now()
+    store = order_store()
+    if worker_alive(store.latest_heartbeat(), now):
+        # Leave the fetch to the background worker so N viewers cost one fetch
+        store.request_sync(
+            mode,
+            start_date.isoformat() if start_date else None,
+            end_date.isoformat() if end_date else None,
+            now.strftime(TIMESTAMP_FORMAT)
+        )
+        st.info("Sync requested - the ingestion worker will pick it up within a few seconds.")
         return None
-
-# Function to fetch latest order from Walmart API
-def fetch_latest_order(token, start_date, end_date):
-    if not token:
-        st.error("Error: No valid token provided for fetching orders.")
-        return []
     
-    # Validate dates
-    today = datetime.date.today()
-    if start_date > today or end_date > today:
-        st.error("Cannot fetch orders for future dates.")
-        return []
+    # No worker running: sync inline, but only one session per process at a time
+    if not sync_lock.acquire(blocking=False):
+        st.info("Another session is already syncing - the new orders will show up once it finishes.")
+        return None
+    try:
+        return _sync_inline(mode, start_date, end_date)
+    finally:
+        sync_lock.release()
+
+def _sync_inline(mode, start_date, end_date):
+    # Surface token problems before any order call goes out; sources that cannot authenticate are skipped
+    sources = [source for source in SOURCES if get_walmart_token(source)]
+    if not sources:
+        return None
     
-    if (end_date - start_date).days > 180:
-        st.error("Please select a date range of 180 days or less.")
-        return []
+    progress_bar = st.progress(0)
+    stored_status = st.empty()
     
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Accept": "application/json",
-        "WM_QOS.CORRELATION_ID": str(uuid.uuid4()),
-        "WM_SVC.NAME": "Walmart Marketplace",
-        "WM_SEC.ACCESS_TOKEN": token
-    }
-    params = {
-        "shipNode": DEFAULT_SHIP_NODE,
-        "limit": 100,
-        "createdStartDate": start_date.strftime('%Y-%m-%dT00:00:00.000Z'),
-        "createdEndDate": end_date.strftime('%Y-%m-%dT23:59:59.999Z')
-    }
+    def update_progress(done, known):
+        progress_bar.progress(min(done / known, 1.0))
     
-    all_orders = []
-    progress_bar = st.progress(0)
-    page_count = 0
-    max_pages = 5
+    def update_stored(order_count, row_count):
+        # Each page is committed as it arrives, so these rows are already queryable
+        stored_status.caption(f"Stored {order_count} orders ({row_count} order lines) so far...")
     
+    # All sources are fetched concurrently; the callbacks get the totals across them
+    start, end = date_range_bounds(start_date, end_date) if mode == "backfill" else (None, None)
+    # An incremental sync also applies orders modified since the last one, like the worker does
+    modes = [mode] + (["changes"] if mode == "incremental" and CHANGE_FEED else [])
     try:
-        while page_count < max_pages:
-            page_count += 1
-            
-            try:
-                response = requests.get(ORDERS_URL, headers=headers, params=params)
-                
-                if response.status_code == 429:
-                    time.sleep(1)
-                    continue
-                    
-                response.raise_for_status()
-                orders = response.json()
-                
-            except Exception as e:
-                st.error(f"Error fetching orders: {str(e)}")
-                break
-            
-            order_list = orders.get("list", {}).get("elements", {}).get("order", [])
-            if not order_list:
-                break
-            
-            all_orders.extend(order_list)
-            progress_bar.progress(page_count / max_pages)
-            
-            next_cursor = orders.get("list", {}).get("meta", {}).get("nextCursor")
-            if not next_cursor:
-                break
-                
-            params["nextCursor"] = next_cursor
-            time.sleep(0.2)
-
-        progress_bar.empty()
-        
-        # Remove any duplicates based on purchaseOrderId
-        unique_orders = {order.get("purchaseOrderId"): order for order in all_orders if isinstance(order, dict)}.values()
-        final_orders = list(unique_orders)
-        
-        if final_orders:
-            st.success(f"Successfully fetched {len(final_orders)} orders")
-            
-        return sorted(final_orders, key=lambda x: x.get("orderDate", ""), reverse=True)
-
+        results = []
+        for run_mode in modes:
+            results += sync_sources(run_mode, start, end, sources, progress=update_progress, on_batch=update_stored)
     except Exception as e:
         st.error(f"Unexpected error: {str(e)}")
-        return []
+        return None
+    finally:
+        progress_bar.empty()
+        stored_status.empty()
+    
+    verbs = {"backfill": "Backfilled", "changes": "Checked for changes in"}
+    for result in results:
+        label = f"Ship node {ship_node_label(result.ship_node)}: " if len(sources) > 1 else ""
+        for error in result.errors:
+            st.error(f"{label}Error fetching orders: {error}")
+        if not result.complete:
+            st.warning(f"{label}Some date windows could not be fetched - the results below are incomplete.")
+        
+        st.success(
+            f"{label}{verbs.get(result.mode, 'Synced')} {result.order_count} orders, "
+            f"{result.unchanged_count} unchanged, {result.row_count} order lines updated "
+            f"({result.start:%Y-%m-%d %H:%M} to {result.end:%Y-%m-%d %H:%M} UTC, {result.pages} pages)"
+        )
+        if result.call_stats.get("retries"):
+            st.info(
+                f"{label}{result.call_stats.get('retries', 0)} retries "
+                f"({result.call_stats.get('throttled', 0)} throttled, "
+                f"{result.call_stats.get('throttled_seconds', 0):.1f}s waiting)"
+            )
+    
+    return results
 
-# Add these functions after the existing imports and before the page config
+# Function to summarize this process's metrics for the diagnostics panel
+def diagnostics_tables():
+    """Latency histograms and counters from metrics.snapshot() as two display frames"""
+    snapshot = metrics.get_metrics().snapshot()
+    timings = pd.DataFrame([
+        {
+            "Metric": histogram["name"].removeprefix("walmart_").removesuffix("_seconds"),
+            "Label": ", ".join(str(value) for value in histogram["labels"].values()),
+            "Count": histogram["count"],
+            "Total (s)": histogram["sum"],
+            "p50 (ms)": histogram["p50"] * 1000,
+            "p95 (ms)": histogram["p95"] * 1000,
+        }
+        for histogram in snapshot["histograms"]
+    ])
+    counters = pd.DataFrame([
+        {
+            "Counter": counter["name"].removeprefix("walmart_").removesuffix("_total"),
+            "Label": ", ".join(f"{name}={value}" for name, value in counter["labels"].items()),
+            "Value": counter["value"],
+        }
+        for counter in snapshot["counters"]
+    ])
+    return timings, counters
 
-def init_database():
-    """Initialize SQLite database and create tables if they don't exist"""
-    conn = sqlite3.connect('walmart_orders.db')
-    c = conn.cursor()
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS orders (
-            purchase_order_id TEXT PRIMARY KEY,
-            sku TEXT,
-            item_name TEXT,
-            quantity REAL,
-            unit_price REAL,
-            order_date TIMESTAMP
-        )
-    ''')
-    conn.commit()
-    conn.close()
+# Function to label a ship node with the name of its configured source
+def ship_node_label(ship_node):
+    """The ship node id, prefixed by its source name when that differs"""
+    names = {source.ship_node: source.name for source in SOURCES}
+    name = names.get(ship_node, ship_node)
+    return ship_node if name == ship_node else f"{name} ({ship_node})"
 
-def save_orders_to_db(processed_orders):
-    """Save orders to SQLite database, skipping duplicates"""
-    conn = sqlite3.connect('walmart_orders.db')
-    c = conn.cursor()
-    
-    for order in processed_orders:
-        try:
-            c.execute('''
-                INSERT OR IGNORE INTO orders 
-                (purchase_order_id, sku, item_name, quantity, unit_price, order_date)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (
-                order['Purchase Order ID'],
-                order['SKU'],
-                order['Item Name'],
-                order['Quantity'],
-                order['Unit Price ($)'],
-                order['Order Date']
-            ))
-        except sqlite3.Error as e:
-            st.error(f"Database error: {e}")
-    
-    conn.commit()
-    conn.close()
+def sync_is_stale(states):
+    """Whether no ship node has been synced within the sync interval"""
+    last_syncs = [state["last_sync_at"] for state in states if state["last_sync_at"]]
+    if not last_syncs:
+        return True
+    age = utc_now() - datetime.datetime.strptime(max(last_syncs), TIMESTAMP_FORMAT)
+    return age.total_seconds() > SYNC_INTERVAL
 
 # Streamlit Dashboard Setup
 st.title("Walmart DSV Dashboard")
@@ -379,6 +368,9 @@ with st.sidebar:
                     if token:
                         st.success("✅ Authentication successful!")
                         st.write(f"Token: {token[:20]}...{token[-20:] if len(token) > 40 else token}")
+                        token_stats = token_manager().stats()
+                        st.write(f"Token cache: {token_stats['hits']} hits, {token_stats['misses']} misses, "
+                                 f"{token_stats['refreshes']} refreshes, expires in {token_stats['expires_in']:.0f}s")
                     else:
                         st.error("❌ Authentication failed")
                 else:
@@ -397,16 +389,27 @@ with st.sidebar:
                         st.error(f"❌ Error: {response[:200]}...")
                     st.write("---")
     
+    # Add ship node filter when more than one source is configured
+    if len(SOURCES) > 1:
+        selected_ship_node = st.selectbox(
+            "Ship Node", ["All"] + [source.ship_node for source in SOURCES],
+            format_func=lambda node: "All ship nodes" if node == "All" else ship_node_label(node)
+        )
+    else:
+        selected_ship_node = "All"
+    
     # Add SKU filter
-    if 'latest_order' in st.session_state and st.session_state['latest_order']:
-        all_skus = sorted(list(set(
-            item.get("item", {}).get("sku", "N/A") 
-            for order in st.session_state['latest_order'] 
-            for item in order.get("orderLines", {}).get("orderLine", [])
-            if isinstance(item, dict)
-        )))
-        selected_sku = st.selectbox("Filter by SKU", ["All"] + all_skus)
+    store = order_store()
+    sku_search = st.text_input("Search SKU", placeholder="SKU prefix or product name")
+    matching_skus = cached_query(search_skus, store, sku_search)
+    if matching_skus:
+        selected_sku = st.selectbox(
+            "Filter by SKU", ["All"] + matching_skus,
+            help=f"Busiest {SKU_SEARCH_LIMIT} SKUs matching the search"
+        )
     else:
+        if sku_search.strip():
+            st.caption("No SKUs match the search")
         selected_sku = "All"
     
     # Modify date range selector with validation
@@ -419,146 +422,177 @@ with st.sidebar:
         help="Select a date range up to 180 days"
     )
     
-    refresh = st.button("Refresh Data")
+    refresh = st.button("Refresh Data", help="Fetch only orders created since the last sync")
+    run_backfill = st.button("Backfill Date Range", help="Re-fetch every order in the selected date range")
+    
+    # Show sync status and data freshness
+    st.subheader("Sync Status")
+    heartbeat = store.latest_heartbeat()
+    if worker_alive(heartbeat):
+        st.caption(f"🟢 Ingestion worker running ({heartbeat['state']})")
+    else:
+        st.caption("⚪ No ingestion worker running - syncs run in this app")
+    pending = store.pending_sync_requests()
+    if pending:
+        st.caption(f"{pending} sync request(s) pending")
+    sync_states = store.list_sync_state()
+    for state in sync_states:
+        if state["last_sync_at"]:
+            age = utc_now() - datetime.datetime.strptime(state["last_sync_at"], TIMESTAMP_FORMAT)
+            st.caption(
+                f"Ship node {ship_node_label(state['ship_node'])}: last {state['last_sync_mode']} sync "
+                f"{age.total_seconds() / 60:.0f} min ago ({state['last_sync_status']}), "
+                f"orders through {state['high_water_mark'] or 'n/a'} UTC"
+            )
+    if not sync_states:
+        st.caption("No data synced yet")
+    cache_stats = get_query_cache().stats()
+    st.caption(
+        f"Query cache: {cache_stats['hit_rate']:.0%} hit rate ({cache_stats['hits']} hits, "
+        f"{cache_stats['misses']} misses), {cache_stats['entries']} entries, "
+        f"{cache_stats['bytes'] / 1024 / 1024:.1f} of {cache_stats['max_bytes'] / 1024 / 1024:.0f} MB"
+    )
+    
+    # Stage timings and counters recorded by this app process (the worker serves its own on /metrics)
+    with st.expander("📈 Diagnostics"):
+        timings, counters = diagnostics_tables()
+        if timings.empty and counters.empty:
+            st.caption("Nothing recorded yet")
+        if not timings.empty:
+            st.dataframe(timings, hide_index=True, use_container_width=True,
+                         column_config={column: st.column_config.NumberColumn(format="%.1f")
+                                        for column in ("Total (s)", "p50 (ms)", "p95 (ms)")})
+        if not counters.empty:
+            st.dataframe(counters, hide_index=True, use_container_width=True)
+        writer = order_store().writer_stats()
+        st.caption(
+            f"Writer: {writer['queue_depth']} queued (max {writer['max_queue_depth']}), {writer['commits']} commits, "
+            f"{writer['avg_commit_ms']:.1f} ms average, {writer['last_commit_ms']:.1f} ms last, "
+            f"{writer['coalesced_batches']} batches coalesced"
+        )
+        governor = get_governor()
+        for bucket in governor.snapshot() if governor else []:
+            replenish = f", refills in {bucket['replenish_in']:.0f}s" if bucket['replenish_in'] else ""
+            st.caption(f"Rate limit {bucket['key']}: {bucket['tokens']:.0f} of {bucket['capacity']:.0f} tokens{replenish}")
+        st.download_button(
+            "Download metrics", metrics.get_metrics().render_prometheus(), file_name="metrics.txt",
+            mime="text/plain", help="Prometheus text format"
+        )
 
 # Update the data fetching logic with validation
-if refresh or 'latest_order' not in st.session_state:
+if run_backfill:
     if len(selected_date_range) == 2:
         start_date, end_date = selected_date_range
         if start_date <= end_date and end_date <= today:
-            token = get_walmart_token()
-            if token:
-                with st.spinner('Fetching orders...'):  # Add loading indicator
-                    latest_order = fetch_latest_order(token, start_date, end_date)
-                    st.session_state['latest_order'] = latest_order
+            with st.spinner('Backfilling orders...'):  # Add loading indicator
+                st.session_state['last_sync'] = sync_orders("backfill", start_date, end_date)
         else:
             st.error("Invalid date range selected. End date must not be in the future.")
+elif refresh or ('last_sync' not in st.session_state and not worker_alive(heartbeat) and sync_is_stale(sync_states)):
+    with st.spinner('Fetching new orders...'):  # Add loading indicator
+        st.session_state['last_sync'] = sync_orders("incremental")
 
-# Process Latest Order Data
-processed_order = []
-if 'latest_order' in st.session_state:
-    latest_order = st.session_state['latest_order']
-    if latest_order:
-        # Initialize database
-        init_database()
-        
-        # Process orders as before
-        for order in latest_order:
-            if isinstance(order, dict):
-                order_lines = order.get("orderLines", {}).get("orderLine", [])
-                
-                # Process each order line
-                for line in order_lines:
-                    if isinstance(line, dict):
-                        item = line.get("item", {})
-                        
-                        # Get amount from the specific path in charges
-                        charges = line.get("charges", {})
-                        charge_list = charges.get("charge", [])
-                        unit_price = 0
-                        if charge_list and isinstance(charge_list, list):
-                            first_charge = charge_list[0]
-                            if isinstance(first_charge, dict):
-                                charge_amount = first_charge.get("chargeAmount", {})
-                                unit_price = float(charge_amount.get("amount", 0))
-                        
-                        quantity = float(line.get("orderLineQuantity", {}).get("amount", 1))
-                        quantity = quantity if quantity > 0 else 1
-                        
-                        processed_order.append({
-                            "SKU": item.get("sku", "N/A"),
-                            "Item Name": item.get("productName", "N/A"),
-                            "Quantity": quantity,
-                            "Unit Price ($)": unit_price,
-                            "Purchase Order ID": order.get("purchaseOrderId", "N/A"),
-                            "Order Date": datetime.datetime.fromtimestamp(
-                                int(str(order.get("orderDate", 0))[:10])
-                            ).strftime('%Y-%m-%d %H:%M:%S')
-                        })
-        
-        # After creating processed_order list, save to database
-        save_orders_to_db(processed_order)
-        
-        # Create DataFrame from database instead of processed_order
-        conn = sqlite3.connect('walmart_orders.db')
-        df = pd.read_sql_query('''
-            SELECT 
-                sku as "SKU",
-                item_name as "Item Name",
-                quantity as "Quantity",
-                unit_price as "Unit Price ($)",
-                purchase_order_id as "Purchase Order ID",
-                order_date as "Order Date"
-            FROM orders
-        ''', conn)
-        conn.close()
-        
-        # Convert orderDate to datetime
-        if "Order Date" in df.columns:
-            df["Order Date"] = pd.to_datetime(df["Order Date"])
-        
-        # Format numeric columns
-        if "Unit Price ($)" in df.columns:
-            df["Unit Price ($)"] = df["Unit Price ($)"].round(2)
-        
-        # Apply filters
-        if selected_sku != "All":
-            df = df[df["SKU"] == selected_sku]
-            
-        if len(selected_date_range) == 2:
-            start_date, end_date = selected_date_range
-            df = df[
-                (df["Order Date"].dt.date >= start_date) & 
-                (df["Order Date"].dt.date <= end_date)
-            ]
-        
-        # Display Data
-        if not df.empty:
-            # Style the dataframe
-            st.dataframe(
-                df,
-                hide_index=True,
-                height=450,
-                use_container_width=True,
-                column_config={
-                    "SKU": st.column_config.TextColumn(
-                        "SKU",
-                        width=120  # Increased width for SKU column
-                    ),
-                    "Item Name": st.column_config.TextColumn(
-                        "Item Name",
-                        width="large"
-                    ),
-                    "Quantity": st.column_config.NumberColumn(
-                        "Quantity",
-                        width="small",
-                        format="%d"
-                    ),
-                    "Unit Price ($)": st.column_config.NumberColumn(
-                        "Unit Price ($)",
-                        width="small",
-                        format="$%.2f"
-                    ),
-                    "Purchase Order ID": st.column_config.TextColumn(
-                        "Purchase Order ID",
-                        width="medium",
-                        help="Walmart Purchase Order ID"
-                    ),
-                    "Order Date": st.column_config.DatetimeColumn(
-                        "Order Date",
-                        width="medium",
-                        format="MM/DD/YYYY HH:mm"
-                    )
-                }
-            )
-            
-            # Display order summary in metrics
-            st.header("Order Summary")
-            col1, col2 = st.columns(2)
-            with col1:
-                total_amount = (df["Quantity"] * df["Unit Price ($)"]).sum()
-                st.metric("Total Order Amount", f"${total_amount:,.2f}")
-            with col2:
-                st.metric("Total Items", f"{df['Quantity'].sum():.0f}")
-        else:
-            st.warning("No orders found for the selected criteria.")
+# Query only the matching rows from the database; filtering and totals run in SQLite
+if len(selected_date_range) == 2:
+    start_date, end_date = selected_date_range
+else:
+    start_date, end_date = selected_date_range[0], None
+
+# Results are cached per data version and shared by every session; treat them as read-only
+summary = cached_query(order_summary, store, selected_sku, start_date, end_date, selected_ship_node)
+sort_order = st.radio("Sort", list(SORT_ORDERS), horizontal=True, label_visibility="collapsed")
+
+# Keyset pagination: grid_cursors holds the key each visited page starts after,
+# and is reset whenever the filters or the sort order change
+grid_filters = (selected_ship_node, selected_sku, start_date, end_date, sort_order)
+if st.session_state.get('grid_filters') != grid_filters:
+    st.session_state['grid_filters'] = grid_filters
+    st.session_state['grid_cursors'] = [None]
+grid_cursors = st.session_state['grid_cursors']
+page = len(grid_cursors)
+df, next_cursor = cached_query(
+    query_orders, store, selected_sku, start_date, end_date, sort=sort_order, after=grid_cursors[-1],
+    limit=PAGE_SIZE, ship_node=selected_ship_node
+)
+
+def next_page(cursor):
+    st.session_state['grid_cursors'].append(cursor)
+
+def previous_page():
+    st.session_state['grid_cursors'].pop()
+
+# Display Data
+if not df.empty:
+    # Style the dataframe
+    with metrics.span("render_grid"):
+        st.dataframe(
+            df,
+            hide_index=True,
+            height=450,
+            use_container_width=True,
+            column_config={
+                "SKU": st.column_config.TextColumn(
+                    "SKU",
+                    width=120  # Increased width for SKU column
+                ),
+                "Item Name": st.column_config.TextColumn(
+                    "Item Name",
+                    width="large"
+                ),
+                "Quantity": st.column_config.NumberColumn(
+                    "Quantity",
+                    width="small",
+                    format="%d"
+                ),
+                "Unit Price ($)": st.column_config.NumberColumn(
+                    "Unit Price ($)",
+                    width="small",
+                    format="$%.2f"
+                ),
+                "Purchase Order ID": st.column_config.TextColumn(
+                    "Purchase Order ID",
+                    width="medium",
+                    help="Walmart Purchase Order ID"
+                ),
+                "Order Date": st.column_config.DatetimeColumn(
+                    "Order Date",
+                    width="medium",
+                    format="MM/DD/YYYY HH:mm"
+                )
+            }
+        )
+    
+    col1, col2, col3 = st.columns([1, 4, 1])
+    with col1:
+        st.button("◀ Previous", on_click=previous_page, disabled=page == 1, use_container_width=True)
+    with col2:
+        st.caption(
+            f"Showing order lines {(page - 1) * PAGE_SIZE + 1:,}-{(page - 1) * PAGE_SIZE + len(df):,} "
+            f"of {summary['line_count']:,}"
+        )
+    with col3:
+        st.button("Next ▶", on_click=next_page, args=(next_cursor,), disabled=next_cursor is None,
+                  use_container_width=True)
+    
+    # Display order summary in metrics
+    st.header("Order Summary")
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("Total Order Amount", f"${summary['total_amount']:,.2f}")
+    with col2:
+        st.metric("Total Items", f"{summary['total_items']:.0f}")
+    with col3:
+        st.metric("Orders", f"{summary['order_count']:,}")
+
+    # Sales trend for the selected SKU and date range, read from the daily rollups
+    st.header("Sales Trend")
+    period = st.radio("Period", list(TREND_PERIODS), horizontal=True)
+    trend = cached_query(sales_trend, store, selected_sku, start_date, end_date, period, selected_ship_node)
+    col1, col2 = st.columns(2)
+    with metrics.span("render_trend"):
+        with col1:
+            st.line_chart(trend, x="Period", y="Revenue ($)")
+        with col2:
+            st.bar_chart(trend, x="Period", y="Units")
+else:
+    st.warning("No orders found for the selected criteria.")
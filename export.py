@@ -0,0 +1,278 @@
+import argparse
+import datetime
+import logging
+import os
+import sqlite3
+import time
+
+import pandas as pd
+
+from archive import get_archive
+from normalize import ORDER_LINE_COLUMNS, normalize_orders
+from storage import get_store, read_only_uri
+
+# pyarrow is only needed for the Parquet history; the dashboard runs without it
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.fs as pafs
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = ds = pafs = pq = None
+
+HISTORY_PATH = os.getenv("WALMART_HISTORY_PATH", "history")
+
+# Rows pulled from SQLite per fetchmany() call while exporting
+EXPORT_CHUNK_ROWS = 50000
+
+# Partition name for lines stored before ship nodes were recorded
+UNKNOWN_SHIP_NODE = "unknown"
+
+logger = logging.getLogger("export")
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise RuntimeError("The Parquet history needs pyarrow; install it with `pip install pyarrow`")
+
+
+def history_schema():
+    """Arrow schema of the order-line columns stored in each Parquet file"""
+    _require_pyarrow()
+    return pa.schema([
+        ("purchase_order_id", pa.string()),
+        ("line_number", pa.int64()),
+        ("sku", pa.string()),
+        ("item_name", pa.string()),
+        ("quantity", pa.float64()),
+        ("unit_price", pa.float64()),
+        ("product_amount", pa.float64()),
+        ("shipping_amount", pa.float64()),
+        ("tax_amount", pa.float64()),
+        ("charge_count", pa.int64()),
+        ("order_date", pa.timestamp("ms")),
+        ("status", pa.string()),
+    ])
+
+
+def history_partitioning():
+    """Hive partitioning on ship node and month; both stay strings so ship node ids are not read as numbers"""
+    _require_pyarrow()
+    return ds.partitioning(pa.schema([("ship_node", pa.string()), ("month", pa.string())]), flavor="hive")
+
+
+class PartitionWriter:
+    """Stream order-line chunks into root/ship_node=<node>/month=<YYYY-MM>/part-0.parquet.
+
+    Each partition is written to a temporary file and moved into place when
+    it is closed, so readers only ever see complete files and an exported
+    month replaces the previous export of that month.
+    """
+
+    def __init__(self, root, compression="zstd"):
+        _require_pyarrow()
+        self.root = root
+        self.compression = compression
+        self.schema = history_schema()
+        self._writers = {}
+        self.rows = 0
+        self.partitions = 0
+
+    def _path(self, ship_node, month):
+        return os.path.join(self.root, f"ship_node={ship_node}", f"month={month}", "part-0.parquet")
+
+    def write(self, ship_node, frame):
+        """Append a normalize_orders()-shaped frame for one ship node"""
+        if frame.empty:
+            return
+        months = frame["order_date"].dt.strftime("%Y-%m")
+        for month, part in frame.groupby(months, sort=False):
+            key = (ship_node or UNKNOWN_SHIP_NODE, month)
+            writer = self._writers.get(key)
+            if writer is None:
+                path = self._path(*key)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                writer = pq.ParquetWriter(path + ".tmp", self.schema, compression=self.compression)
+                self._writers[key] = writer
+            writer.write_table(pa.Table.from_pandas(part[ORDER_LINE_COLUMNS], schema=self.schema,
+                                                    preserve_index=False))
+            self.rows += len(part)
+
+    def close_before(self, month):
+        """Finish every partition of a month earlier than `month` (YYYY-MM)"""
+        for key in [key for key in self._writers if key[1] < month]:
+            self._close(key)
+
+    def close(self):
+        for key in list(self._writers):
+            self._close(key)
+
+    def _close(self, key):
+        self._writers.pop(key).close()
+        path = self._path(*key)
+        os.replace(path + ".tmp", path)
+        self.partitions += 1
+
+
+def _month_bounds(start_month=None, end_month=None):
+    """Half-open 'YYYY-MM-DD HH:MM:SS' bounds covering whole months; either end may be open"""
+    start = f"{start_month}-01 00:00:00" if start_month else None
+    end = None
+    if end_month:
+        year, month = map(int, end_month.split("-"))
+        end = f"{year + month // 12:04d}-{month % 12 + 1:02d}-01 00:00:00"
+    return start, end
+
+
+def export_from_store(root=HISTORY_PATH, start_month=None, end_month=None, store=None,
+                      chunk_rows=EXPORT_CHUNK_ROWS):
+    """Export stored order lines to the Parquet history, whole months at a time.
+
+    Lines are streamed from a separate read-only connection in date order
+    (an index walk, no sort), chunk_rows at a time, and each month's files
+    are finished as soon as the stream has moved past it. Returns
+    (rows, partitions) written.
+    """
+    path = (store or get_store()).path
+    start, end = _month_bounds(start_month, end_month)
+    clauses = ["order_date IS NOT NULL"]
+    params = []
+    if start:
+        clauses.append("order_date >= ?")
+        params.append(start)
+    if end:
+        clauses.append("order_date < ?")
+        params.append(end)
+
+    writer = PartitionWriter(root)
+    conn = sqlite3.connect(read_only_uri(path), uri=True)
+    try:
+        cursor = conn.execute(f'''
+            SELECT ship_node, {", ".join(ORDER_LINE_COLUMNS)}
+            FROM orders
+            WHERE {" AND ".join(clauses)}
+            ORDER BY order_date
+        ''', params)
+        while True:
+            rows = cursor.fetchmany(chunk_rows)
+            if not rows:
+                break
+            frame = pd.DataFrame.from_records(rows, columns=["ship_node"] + ORDER_LINE_COLUMNS)
+            frame["order_date"] = pd.to_datetime(frame["order_date"], format="%Y-%m-%d %H:%M:%S")
+            writer.close_before(frame["order_date"].iloc[0].strftime("%Y-%m"))
+            for ship_node, part in frame.groupby(frame["ship_node"].fillna(UNKNOWN_SHIP_NODE), sort=False):
+                writer.write(ship_node, part)
+        writer.close()
+    finally:
+        conn.close()
+    return writer.rows, writer.partitions
+
+
+def export_from_archive(root=HISTORY_PATH, ship_node=None, archive=None):
+    """Export the raw page archive to the Parquet history without going through SQLite.
+
+    Pages are read newest fetch first and each purchase order is written
+    once, from its latest copy; the ids seen so far are the only state held
+    besides the open partition files. Returns (rows, partitions) written.
+    """
+    archive = archive or get_archive()
+    writer = PartitionWriter(root)
+    seen = set()
+    for page_ship_node, orders in archive.iter_pages(ship_node, newest_first=True):
+        fresh = []
+        for order in orders:
+            po_id = order.get("purchaseOrderId") if isinstance(order, dict) else None
+            if po_id is not None:
+                if po_id in seen:
+                    continue
+                seen.add(po_id)
+            fresh.append(order)
+        writer.write(page_ship_node, normalize_orders(fresh))
+    writer.close()
+    return writer.rows, writer.partitions
+
+
+def _order_date_scalar(value):
+    return pa.scalar(value, type=pa.timestamp("ms"))
+
+
+def history_dataset(root=HISTORY_PATH):
+    """Open the Parquet history as a pyarrow dataset over memory-mapped files"""
+    _require_pyarrow()
+    return ds.dataset(
+        root, format="parquet", partitioning=history_partitioning(),
+        filesystem=pafs.LocalFileSystem(use_mmap=True)
+    )
+
+
+def history_filter(ship_node=None, sku=None, start_date=None, end_date=None):
+    """Dataset filter for the usual dashboard filters; dates are inclusive.
+
+    The ship node and month conditions prune whole partitions before any
+    file is opened; the SKU and order_date conditions are pushed down to
+    Parquet row-group statistics.
+    """
+    _require_pyarrow()
+    expression = None
+
+    def both(condition):
+        return condition if expression is None else expression & condition
+
+    if ship_node:
+        expression = both(ds.field("ship_node") == ship_node)
+    if sku and sku != "All":
+        expression = both(ds.field("sku") == sku)
+    if start_date is not None:
+        expression = both(ds.field("month") >= start_date.strftime("%Y-%m"))
+        expression = both(ds.field("order_date") >= _order_date_scalar(
+            datetime.datetime.combine(start_date, datetime.time.min)))
+    if end_date is not None:
+        expression = both(ds.field("month") <= end_date.strftime("%Y-%m"))
+        expression = both(ds.field("order_date") < _order_date_scalar(
+            datetime.datetime.combine(end_date + datetime.timedelta(days=1), datetime.time.min)))
+    return expression
+
+
+def read_history(root=HISTORY_PATH, columns=None, ship_node=None, sku=None, start_date=None, end_date=None):
+    """Read the matching order lines from the Parquet history into a DataFrame"""
+    table = history_dataset(root).to_table(
+        columns=columns, filter=history_filter(ship_node, sku, start_date, end_date)
+    )
+    return table.to_pandas()
+
+
+def iter_history(root=HISTORY_PATH, columns=None, ship_node=None, sku=None, start_date=None, end_date=None,
+                 batch_size=EXPORT_CHUNK_ROWS):
+    """Yield the matching order lines as DataFrames of at most batch_size rows"""
+    scanner = history_dataset(root).scanner(
+        columns=columns, filter=history_filter(ship_node, sku, start_date, end_date), batch_size=batch_size
+    )
+    for batch in scanner.to_batches():
+        if batch.num_rows:
+            yield batch.to_pandas()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export order lines to the partitioned Parquet history")
+    parser.add_argument("--root", default=HISTORY_PATH, help="History directory (default: %(default)s)")
+    parser.add_argument(
+        "--source", choices=["store", "archive"], default="store",
+        help="Export the order database or re-normalize the raw page archive"
+    )
+    parser.add_argument("--start", help="First month to export, YYYY-MM (store only)")
+    parser.add_argument("--end", help="Last month to export, YYYY-MM (store only)")
+    parser.add_argument("--ship-node", help="Only export this ship node's pages (archive only)")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    began = time.monotonic()
+    if args.source == "archive":
+        rows, partitions = export_from_archive(args.root, args.ship_node)
+    else:
+        rows, partitions = export_from_store(args.root, args.start, args.end)
+    logger.info("Exported %d order lines into %d partitions in %.1fs", rows, partitions, time.monotonic() - began)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,511 @@
+import argparse
+import datetime
+import hashlib
+import json
+import logging
+import os
+import queue
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from archive import ARCHIVE_ENABLED, get_archive
+from config import CHANGE_FEED, ORDERS_URL, SOURCES, SYNC_INTERVAL, TOKEN_URL
+from normalize import normalize_orders
+from storage import get_store
+from walmart_auth import get_token_manager
+from walmart_http import get_http_client
+from walmart_orders import CREATED, LAST_MODIFIED, FetchResult, OrderFetcher, date_range_bounds
+
+logger = logging.getLogger("ingest")
+
+# Re-request this much before the stored mark so late-arriving orders are not missed
+DEFAULT_OVERLAP = datetime.timedelta(hours=2)
+
+# How far back the very first incremental sync of a ship node reaches
+INITIAL_LOOKBACK = datetime.timedelta(days=7)
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Orders normalized and committed together; large enough to amortize the
+# vectorized normalizer's per-call overhead, small enough to stay bounded
+INGEST_BATCH_ORDERS = 1000
+
+# How often the worker checks for sync requests from the dashboard, in seconds
+POLL_INTERVAL = 5
+
+# A worker that has not sent a heartbeat for this long is considered gone
+WORKER_STALE_AFTER = datetime.timedelta(seconds=60)
+
+# Serializes syncs run inside one process, so concurrent sessions share a single fetch
+sync_lock = threading.Lock()
+
+
+class SyncResult:
+    """Outcome of one incremental sync or backfill run"""
+
+    def __init__(self, mode, ship_node, start, end, fetch_result, order_count, row_count, unchanged_count=0):
+        self.mode = mode
+        self.ship_node = ship_node
+        self.start = start
+        self.end = end
+        self.order_count = order_count
+        self.row_count = row_count
+        self.unchanged_count = unchanged_count
+        self.pages = fetch_result.pages
+        self.errors = fetch_result.errors
+        self.call_stats = fetch_result.call_stats
+        self.complete = fetch_result.complete
+
+
+def utc_now():
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+
+def order_fingerprint(order):
+    """Stable content hash of one raw API order"""
+    content = json.dumps(order, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.blake2b(content.encode(), digest_size=16).hexdigest()
+
+
+def _ingest(fetcher, start, end, mode, progress=None, on_batch=None, store=None, archive=None,
+            date_filter=CREATED):
+    """Fetch [start, end) page by page, storing order lines while the fetch is still running.
+
+    Pages are normalized and committed in batches of INGEST_BATCH_ORDERS, so
+    at most one batch of raw orders is held at a time. on_batch, if given, is
+    called as on_batch(orders_so_far, rows_so_far) after every commit. The
+    ship node's marks are advanced once the whole range has been processed;
+    a LAST_MODIFIED range advances modified_through instead of synced_through.
+
+    Orders whose content hash matches the one stored for them (typically the
+    overlap re-fetched by every incremental sync) are skipped entirely: they
+    are not normalized or rewritten and do not bump the data version, so
+    cached query results stay valid when nothing actually changed. Of the
+    orders that did change, only the lines that differ are written, and
+    row_count counts those lines.
+
+    Every page is also kept in the raw page archive (unless WALMART_ARCHIVE=0)
+    so it can be replayed later without calling the API.
+    """
+    began = time.perf_counter()
+    fetch_started = utc_now()
+    store = store or get_store()
+    if archive is None and ARCHIVE_ENABLED:
+        archive = get_archive()
+    fetch_result = FetchResult()
+    order_count = 0
+    row_count = 0
+    unchanged_count = 0
+    newest = None
+    batch = []
+
+    def flush():
+        nonlocal order_count, row_count, unchanged_count, newest
+        with metrics.span("fingerprint"):
+            fingerprints = {
+                order["purchaseOrderId"]: order_fingerprint(order) for order in batch if order.get("purchaseOrderId")
+            }
+            unchanged = store.unchanged_orders(fingerprints)
+        changed = [order for order in batch if order.get("purchaseOrderId") not in unchanged]
+        order_count += len(batch)
+        unchanged_count += len(batch) - len(changed)
+        metrics.inc("walmart_orders_unchanged_total", len(batch) - len(changed))
+        if changed:
+            with metrics.span("normalize"):
+                order_lines = normalize_orders(changed)
+            with metrics.span("store"):
+                changed_lines = store.upsert_order_lines(
+                    order_lines,
+                    {po_id: value for po_id, value in fingerprints.items() if po_id not in unchanged},
+                    ship_node=fetcher.ship_node
+                )
+            row_count += changed_lines
+            metrics.inc("walmart_order_lines_stored_total", changed_lines)
+            if not order_lines.empty:
+                batch_newest = order_lines["order_date"].max().to_pydatetime()
+                if newest is None or batch_newest > newest:
+                    newest = batch_newest
+        batch.clear()
+        if on_batch is not None:
+            on_batch(order_count, row_count)
+
+    for page in fetcher.iter_pages(start, end, fetch_result, progress, date_filter):
+        if archive is not None:
+            with metrics.span("archive"):
+                archive.put_page(page, utc_now().strftime(TIMESTAMP_FORMAT))
+        batch.extend(page.orders)
+        if len(batch) >= INGEST_BATCH_ORDERS:
+            flush()
+    if batch:
+        flush()
+
+    # Only a complete fetch proves there is nothing left to get before `end`, and only
+    # one by creation date says no earlier order is missing, so a window that failed
+    # is fetched again by the next incremental sync. Neither mark may pass the time
+    # the fetch started: a range reaching into the future (a backfill through today)
+    # only covers the orders that existed by then.
+    through = min(end, fetch_started).strftime(TIMESTAMP_FORMAT) if fetch_result.complete else None
+    high_water_mark = (
+        min(newest, fetch_started).strftime(TIMESTAMP_FORMAT)
+        if newest and fetch_result.complete and date_filter == CREATED else None
+    )
+    store.update_sync_state(
+        fetcher.ship_node,
+        high_water_mark,
+        through if date_filter == CREATED else None,
+        mode,
+        "ok" if fetch_result.complete else "incomplete",
+        order_count,
+        utc_now().strftime(TIMESTAMP_FORMAT),
+        modified_through=through if date_filter == LAST_MODIFIED else None
+    )
+    metrics.observe("walmart_stage_seconds", time.perf_counter() - began, stage=f"{mode}_sync")
+    return SyncResult(mode, fetcher.ship_node, start, end, fetch_result, order_count, row_count, unchanged_count)
+
+
+def incremental_start(ship_node, overlap=DEFAULT_OVERLAP, now=None, store=None):
+    """Where the next incremental sync of a ship node should start.
+
+    Both marks are only advanced by complete fetches, so the later of them
+    (minus the overlap) never skips a window that failed.
+    """
+    now = now or utc_now()
+    state = (store or get_store()).get_sync_state(ship_node)
+    marks = [state[key] for key in ("synced_through", "high_water_mark") if state and state[key]]
+    if not marks:
+        return now - INITIAL_LOOKBACK
+    mark = datetime.datetime.strptime(max(marks), TIMESTAMP_FORMAT)
+    return min(mark - overlap, now)
+
+
+def incremental_sync(fetcher, overlap=DEFAULT_OVERLAP, progress=None, on_batch=None, store=None, archive=None):
+    """Fetch only orders created since the stored high-water mark (minus a safety overlap)"""
+    end = utc_now()
+    start = incremental_start(fetcher.ship_node, overlap, now=end, store=store)
+    return _ingest(fetcher, start, end, "incremental", progress, on_batch, store, archive)
+
+
+def changes_start(ship_node, overlap=DEFAULT_OVERLAP, now=None, store=None):
+    """Where the next change-feed sync of a ship node should start"""
+    now = now or utc_now()
+    state = (store or get_store()).get_sync_state(ship_node)
+    if not state or not state.get("modified_through"):
+        return now - INITIAL_LOOKBACK
+    mark = datetime.datetime.strptime(state["modified_through"], TIMESTAMP_FORMAT)
+    return min(mark - overlap, now)
+
+
+def sync_changes(fetcher, overlap=DEFAULT_OVERLAP, progress=None, on_batch=None, store=None, archive=None):
+    """Fetch orders modified since the last change-feed sync and apply the lines that changed.
+
+    This picks up cancellations, refunds, quantity changes and status
+    transitions of orders created long before the incremental window; the
+    work follows the number of modified orders, not the size of the table.
+    """
+    end = utc_now()
+    start = changes_start(fetcher.ship_node, overlap, now=end, store=store)
+    return _ingest(fetcher, start, end, "changes", progress, on_batch, store, archive, LAST_MODIFIED)
+
+
+def backfill(fetcher, start, end, progress=None, on_batch=None, store=None, archive=None):
+    """Explicitly (re)fetch the whole [start, end) range"""
+    return _ingest(fetcher, start, end, "backfill", progress, on_batch, store, archive)
+
+
+def _epoch_ms(value):
+    return value.replace(tzinfo=datetime.timezone.utc).timestamp() * 1000
+
+
+def _created_between(orders, start, end):
+    """The orders whose orderDate falls in [start, end); an unreadable date counts as 0, as in normalize_orders"""
+    low = _epoch_ms(start) if start is not None else float("-inf")
+    high = _epoch_ms(end) if end is not None else float("inf")
+    kept = []
+    for order in orders:
+        try:
+            order_date = float(order.get("orderDate") or 0)
+        except (TypeError, ValueError):
+            order_date = 0
+        if low <= order_date < high:
+            kept.append(order)
+    return kept
+
+
+def replay(ship_node=None, start=None, end=None, rebuild=False, store=None, archive=None):
+    """Re-normalize archived pages into the order database without calling the API.
+
+    Pages are replayed oldest fetch first, so the latest copy of an order
+    wins, and committed in batches of INGEST_BATCH_ORDERS. start/end select
+    orders by creation date, including the ones archived from change-feed
+    windows (which are modification windows). With rebuild, all
+    order lines and derived tables are cleared first (only allowed for the
+    whole archive). Sync marks are left alone. Returns (pages, orders, rows).
+    """
+    if rebuild and (ship_node or start is not None or end is not None):
+        raise ValueError("rebuild replays the whole archive and cannot be combined with filters")
+    store = store or get_store()
+    archive = archive or get_archive()
+    if rebuild:
+        store.clear_order_lines()
+
+    page_count = order_count = row_count = 0
+    batch = []
+    batch_ship_node = None
+
+    def flush():
+        nonlocal row_count
+        row_count += store.upsert_order_lines(normalize_orders(batch), ship_node=batch_ship_node)
+        batch.clear()
+
+    windowed = start is not None or end is not None
+    for page_ship_node, orders in archive.iter_pages(ship_node, start, end):
+        if windowed:
+            orders = _created_between(orders, start, end)
+        if batch and page_ship_node != batch_ship_node:
+            flush()
+        batch_ship_node = page_ship_node
+        page_count += 1
+        order_count += len(orders)
+        batch.extend(orders)
+        if len(batch) >= INGEST_BATCH_ORDERS:
+            flush()
+    if batch:
+        flush()
+    return page_count, order_count, row_count
+
+
+def build_fetcher(source=None):
+    """OrderFetcher for a configured source (the first one by default).
+
+    The token manager and HTTP client are the process-wide ones of the
+    source's seller account, so sources of one account share its token and
+    rate budget while different accounts never wait on each other.
+    """
+    source = source or SOURCES[0]
+    token_manager = get_token_manager(source.client_id, source.client_secret, TOKEN_URL)
+    kwargs = {"max_workers": source.max_workers} if source.max_workers else {}
+    return OrderFetcher(
+        token_manager, ORDERS_URL, source.ship_node, http_client=get_http_client(source.client_id), **kwargs
+    )
+
+
+def sync_sources(mode, start=None, end=None, sources=None, progress=None, on_batch=None, store=None,
+                 archive=None):
+    """Run an incremental sync, a change-feed sync or a backfill of [start, end) of every source concurrently.
+
+    Each source is ingested on its own thread with its own fetcher, so the
+    run takes about as long as the slowest source instead of the sum of all
+    of them. progress(windows_done, windows_known) and on_batch(orders,
+    rows) receive the totals across sources and are called from this
+    thread. A source that fails outright gets an incomplete SyncResult
+    carrying the error; the others are not affected. Returns the
+    SyncResults in source order.
+    """
+    sources = sources or SOURCES
+    events = queue.Queue()
+    windows = {}
+    stored = {}
+
+    def run(source):
+        try:
+            fetcher = build_fetcher(source)
+            report_progress = lambda done, known: events.put(("progress", source.name, (done, known)))
+            report_batch = lambda orders, rows: events.put(("batch", source.name, (orders, rows)))
+            if mode == "backfill":
+                return backfill(fetcher, start, end, report_progress, report_batch, store, archive)
+            if mode == "changes":
+                return sync_changes(
+                    fetcher, progress=report_progress, on_batch=report_batch, store=store, archive=archive
+                )
+            return incremental_sync(
+                fetcher, progress=report_progress, on_batch=report_batch, store=store, archive=archive
+            )
+        except Exception as e:
+            logger.exception("%s sync of source %s failed", mode, source.name)
+            fetch_result = FetchResult()
+            fetch_result.errors.append(e)
+            now = utc_now()
+            return SyncResult(mode, source.ship_node, start or now, end or now, fetch_result, 0, 0)
+        finally:
+            events.put(("finished", source.name, None))
+
+    with ThreadPoolExecutor(max_workers=len(sources), thread_name_prefix="source") as executor:
+        futures = [executor.submit(run, source) for source in sources]
+        running = len(sources)
+        while running:
+            kind, name, value = events.get()
+            if kind == "finished":
+                running -= 1
+            elif kind == "progress":
+                windows[name] = value
+                if progress is not None:
+                    progress(sum(done for done, _ in windows.values()), sum(known for _, known in windows.values()))
+            elif kind == "batch":
+                stored[name] = value
+                if on_batch is not None:
+                    on_batch(sum(orders for orders, _ in stored.values()), sum(rows for _, rows in stored.values()))
+    return [future.result() for future in futures]
+
+
+def worker_alive(heartbeat, now=None):
+    """Whether a heartbeat row from OrderStore.latest_heartbeat() is recent enough"""
+    if not heartbeat or not heartbeat.get("last_heartbeat"):
+        return False
+    last = datetime.datetime.strptime(heartbeat["last_heartbeat"], TIMESTAMP_FORMAT)
+    return (now or utc_now()) - last < WORKER_STALE_AFTER
+
+
+def _run_logged(mode, start=None, end=None):
+    """Sync every source and log the outcome; returns True if every source completed"""
+    began = time.monotonic()
+    with sync_lock:
+        results = sync_sources(mode, start, end)
+    for result in results:
+        logger.info(
+            "%s sync of %s: %d orders (%d unchanged), %d rows, %d pages, %s..%s%s",
+            mode, result.ship_node, result.order_count, result.unchanged_count, result.row_count, result.pages,
+            result.start, result.end, "" if result.complete else " (incomplete)"
+        )
+    if len(results) > 1:
+        logger.info("%s sync of %d sources took %.1fs", mode, len(results), time.monotonic() - began)
+    metrics.log_snapshot()
+    return all(result.complete for result in results)
+
+
+def _run_sync():
+    """An incremental sync followed, unless WALMART_CHANGE_FEED=0, by a change-feed sync"""
+    complete = _run_logged("incremental")
+    if CHANGE_FEED:
+        complete = _run_logged("changes") and complete
+    return complete
+
+
+def _keep_heartbeat(store, worker_id, state, interval):
+    """Re-record the worker's current state[0] every `interval` seconds, so long syncs keep it alive"""
+    while True:
+        time.sleep(interval)
+        try:
+            store.record_heartbeat(worker_id, state[0], utc_now().strftime(TIMESTAMP_FORMAT))
+        except Exception:
+            logger.exception("Could not record the worker heartbeat")
+
+
+def run_worker(interval=SYNC_INTERVAL, poll_interval=POLL_INTERVAL, metrics_port=metrics.METRICS_PORT):
+    """Run incremental and change-feed syncs every `interval` seconds and serve sync requests until killed.
+
+    With a metrics_port, the worker's metrics are served for Prometheus on /metrics.
+    """
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    store = get_store()
+    next_sync = 0.0
+    state = ["idle"]
+
+    def beat(value):
+        state[0] = value
+        store.record_heartbeat(worker_id, value, utc_now().strftime(TIMESTAMP_FORMAT))
+
+    logger.info("Ingestion worker %s started, syncing every %ss", worker_id, interval)
+    if metrics_port:
+        metrics.start_metrics_server(metrics_port)
+        logger.info("Serving metrics on port %d", metrics_port)
+    threading.Thread(
+        target=_keep_heartbeat, args=(store, worker_id, state, poll_interval), name="worker-heartbeat", daemon=True
+    ).start()
+    while True:
+        beat("idle")
+
+        while True:
+            now = utc_now()
+            request = store.claim_sync_request(
+                worker_id, now.strftime(TIMESTAMP_FORMAT), (now - WORKER_STALE_AFTER).strftime(TIMESTAMP_FORMAT)
+            )
+            if request is None:
+                break
+            beat(f"{request['mode']} sync")
+            try:
+                if request["mode"] == "backfill":
+                    start, end = date_range_bounds(
+                        datetime.date.fromisoformat(request["start_date"]),
+                        datetime.date.fromisoformat(request["end_date"])
+                    )
+                    complete = _run_logged("backfill", start, end)
+                else:
+                    complete = _run_sync()
+                    next_sync = time.monotonic() + interval
+                status = "ok" if complete else "incomplete"
+            except Exception:
+                logger.exception("Requested %s sync failed", request["mode"])
+                status = "error"
+            store.finish_sync_request(request["id"], status, utc_now().strftime(TIMESTAMP_FORMAT))
+            beat("idle")
+
+        if time.monotonic() >= next_sync:
+            beat("incremental sync")
+            try:
+                _run_sync()
+            except Exception:
+                logger.exception("Scheduled sync failed")
+            next_sync = time.monotonic() + interval
+
+        time.sleep(poll_interval)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Walmart order ingestion worker")
+    subparsers = parser.add_subparsers(dest="command")
+
+    worker_parser = subparsers.add_parser("worker", help="Sync on a schedule (default)")
+    worker_parser.add_argument("--interval", type=int, default=SYNC_INTERVAL, help="Seconds between syncs")
+    worker_parser.add_argument(
+        "--metrics-port", type=int, default=metrics.METRICS_PORT, help="Prometheus /metrics port (0: off)"
+    )
+
+    subparsers.add_parser("sync", help="Run one incremental and change-feed sync and exit")
+    subparsers.add_parser("changes", help="Apply orders modified since the last change-feed sync and exit")
+
+    backfill_parser = subparsers.add_parser("backfill", help="Fetch a full date range and exit")
+    backfill_parser.add_argument("--start", required=True, type=datetime.date.fromisoformat, help="YYYY-MM-DD")
+    backfill_parser.add_argument("--end", required=True, type=datetime.date.fromisoformat, help="YYYY-MM-DD")
+
+    replay_parser = subparsers.add_parser("replay", help="Rebuild order lines from the raw page archive")
+    replay_parser.add_argument("--ship-node", help="Only replay this ship node's pages")
+    replay_parser.add_argument("--start", type=datetime.date.fromisoformat, help="YYYY-MM-DD")
+    replay_parser.add_argument("--end", type=datetime.date.fromisoformat, help="YYYY-MM-DD")
+    replay_parser.add_argument(
+        "--rebuild", action="store_true", help="Clear all order lines and derived tables first"
+    )
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    if args.command == "sync":
+        return 0 if _run_sync() else 1
+    if args.command == "changes":
+        return 0 if _run_logged("changes") else 1
+    if args.command == "backfill":
+        start, end = date_range_bounds(args.start, args.end)
+        return 0 if _run_logged("backfill", start, end) else 1
+    if args.command == "replay":
+        start = end = None
+        if args.start or args.end:
+            start, end = date_range_bounds(args.start or datetime.date.min, args.end or datetime.date.today())
+        if args.rebuild and (args.ship_node or start is not None):
+            parser.error("--rebuild replays the whole archive and cannot be combined with filters")
+        began = time.monotonic()
+        pages, orders, rows = replay(args.ship_node, start, end, args.rebuild)
+        logger.info(
+            "Replayed %d pages, %d orders, %d rows in %.1fs", pages, orders, rows, time.monotonic() - began
+        )
+        return 0
+    run_worker(
+        interval=getattr(args, "interval", SYNC_INTERVAL),
+        metrics_port=getattr(args, "metrics_port", metrics.METRICS_PORT)
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
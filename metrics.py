@@ -0,0 +1,214 @@
+import bisect
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# Port the ingestion worker serves /metrics on; 0 disables it
+METRICS_PORT = int(os.getenv("WALMART_METRICS_PORT", "0"))
+
+DESCRIPTIONS = {
+    "walmart_stage_seconds": ("histogram", "Time spent in each ingest and dashboard stage"),
+    "walmart_http_request_seconds": ("histogram", "Latency of single Walmart API attempts"),
+    "walmart_http_requests_total": ("counter", "Walmart API attempts by endpoint and status"),
+    "walmart_http_retries_total": ("counter", "Walmart API attempts retried, by reason"),
+    "walmart_http_throttled_seconds_total": ("counter", "Seconds spent waiting out 429 responses"),
+    "walmart_rate_limit_wait_seconds_total": ("counter", "Seconds spent waiting for a rate-limit token"),
+    "walmart_pages_total": ("counter", "Order pages fetched"),
+    "walmart_orders_fetched_total": ("counter", "Orders received from the API"),
+    "walmart_orders_unchanged_total": ("counter", "Fetched orders skipped because their content was unchanged"),
+    "walmart_order_lines_stored_total": ("counter", "Order lines written to the order database"),
+    "walmart_commit_seconds": ("histogram", "Time the order store's writer spends on one commit"),
+    "walmart_write_queue_seconds": ("histogram", "Time a write waited in the writer queue before its commit began"),
+    "walmart_query_seconds": ("histogram", "Dashboard query time on query cache misses"),
+    "walmart_query_cache_lookups_total": ("counter", "Query cache lookups by result"),
+}
+
+logger = logging.getLogger("metrics")
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram in the Prometheus layout"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """Estimate a quantile by interpolating inside its bucket, like histogram_quantile()"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            if seen + bucket_count >= rank and bucket_count:
+                lower = self.buckets[index - 1] if index else 0.0
+                if index == len(self.buckets):
+                    return lower
+                return lower + (self.buckets[index] - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.buckets[-1]
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    escaped = []
+    for name, value in pairs:
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        escaped.append(f'{name}="{value}"')
+    return "{" + ",".join(escaped) + "}"
+
+
+def _series_key(name, labels):
+    """(name, sorted labels) with every label value as a string, so series always sort (e.g. status 200 vs "error")"""
+    return name, tuple(sorted((label, str(value)) for label, value in labels.items()))
+
+
+class Metrics:
+    """Process-wide counters and latency histograms for the hot paths.
+
+    Series are keyed on (name, sorted labels). Recording is one dict update
+    under a lock, cheap enough for per-request and per-batch calls; nothing
+    is recorded per order line. The dashboard shows snapshot(), the worker
+    serves render_prometheus() on /metrics.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        key = _series_key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = _series_key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    @contextlib.contextmanager
+    def span(self, stage, **labels):
+        """Time the block into walmart_stage_seconds{stage=...}, whether or not it raises"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe("walmart_stage_seconds", time.perf_counter() - started, stage=stage, **labels)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def snapshot(self):
+        """Plain-data view of every series, for the dashboard and structured logs"""
+        with self._lock:
+            counters = [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in sorted(self._counters.items())
+            ]
+            histograms = [
+                {
+                    "name": name, "labels": dict(labels), "count": histogram.count, "sum": histogram.sum,
+                    "p50": histogram.quantile(0.5), "p95": histogram.quantile(0.95),
+                }
+                for (name, labels), histogram in sorted(self._histograms.items())
+            ]
+        return {"counters": counters, "histograms": histograms}
+
+    def render_prometheus(self):
+        """All series in the Prometheus text exposition format"""
+        lines = []
+        described = set()
+
+        def describe(name):
+            if name not in described and name in DESCRIPTIONS:
+                kind, text = DESCRIPTIONS[name]
+                lines.append(f"# HELP {name} {text}")
+                lines.append(f"# TYPE {name} {kind}")
+                described.add(name)
+
+        with self._lock:
+            for (name, labels), value in sorted(self._counters.items()):
+                describe(name)
+                lines.append(f"{name}{_format_labels(labels)} {value:g}")
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                describe(name)
+                cumulative = 0
+                for bound, bucket_count in zip(histogram.buckets, histogram.counts):
+                    cumulative += bucket_count
+                    lines.append(f"{name}_bucket{_format_labels(labels, [('le', f'{bound:g}')])} {cumulative}")
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {histogram.count}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum:.6f}")
+                lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+_metrics = Metrics()
+
+
+def get_metrics():
+    """Return the process-wide Metrics"""
+    return _metrics
+
+
+def inc(name, value=1, **labels):
+    _metrics.inc(name, value, **labels)
+
+
+def observe(name, seconds, **labels):
+    _metrics.observe(name, seconds, **labels)
+
+
+def span(stage, **labels):
+    return _metrics.span(stage, **labels)
+
+
+def log_snapshot(level=logging.INFO):
+    """Write the current metrics to the metrics logger as one JSON line"""
+    if logger.isEnabledFor(level):
+        logger.log(level, json.dumps(_metrics.snapshot(), sort_keys=True))
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = _metrics.render_prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_metrics_server(port=METRICS_PORT, host="0.0.0.0"):
+    """Serve /metrics for Prometheus on a daemon thread; returns the server"""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
@@ -0,0 +1,143 @@
+import numpy as np
+import pandas as pd
+
+# Columns produced by normalize_orders, in order
+ORDER_LINE_COLUMNS = [
+    "purchase_order_id",
+    "line_number",
+    "sku",
+    "item_name",
+    "quantity",
+    "unit_price",
+    "product_amount",
+    "shipping_amount",
+    "tax_amount",
+    "charge_count",
+    "order_date",
+    "status",
+]
+
+
+def _empty_frame():
+    """Zero-row frame with the same columns and dtypes as a normal result"""
+    frame = normalize_orders([{"orderLines": {"orderLine": [{}]}}])
+    return frame.iloc[0:0]
+
+
+def _numbers(values):
+    """Convert a list of numbers or numeric strings to float64 in one call; unparseable values become NaN"""
+    try:
+        return np.asarray(values, dtype=np.float64)
+    except (TypeError, ValueError):
+        return pd.to_numeric(pd.Series(values, dtype=object), errors="coerce").to_numpy(dtype=np.float64)
+
+
+def _extract_columns(orders):
+    """Walk raw orders once, collecting the raw values of every line and charge into column lists.
+
+    Orders and lines that are not dicts are skipped, and missing keys or
+    unexpected types give the column's default instead of failing the batch.
+    """
+    columns = {name: [] for name in (
+        "po_ids", "order_dates", "line_numbers", "skus", "item_names", "quantities",
+        "charge_counts", "charge_types", "charge_amounts", "tax_amounts", "statuses"
+    )}
+    # Bound appends keep the per-line work to dict lookups
+    (add_po_id, add_order_date, add_line_number, add_sku, add_item_name, add_quantity, add_charge_count,
+     add_charge_type, add_charge_amount, add_tax_amount, add_status) = (values.append for values in columns.values())
+    for order in orders:
+        if not isinstance(order, dict):
+            continue
+        po_id = order.get("purchaseOrderId", "N/A")
+        order_date = order.get("orderDate")
+        for line in (order.get("orderLines") or {}).get("orderLine") or []:
+            if not isinstance(line, dict):
+                continue
+            item = line.get("item") or {}
+            add_po_id(po_id)
+            add_order_date(order_date)
+            add_line_number(line.get("lineNumber"))
+            add_sku(item.get("sku", "N/A"))
+            add_item_name(item.get("productName", "N/A"))
+            add_quantity((line.get("orderLineQuantity") or {}).get("amount"))
+            statuses = (line.get("orderLineStatuses") or {}).get("orderLineStatus")
+            # A line split across statuses (e.g. partly shipped) reports its last one
+            last = statuses[-1] if isinstance(statuses, list) and statuses else None
+            add_status(last.get("status") if isinstance(last, dict) else None)
+
+            charge_list = (line.get("charges") or {}).get("charge")
+            if not isinstance(charge_list, list):
+                add_charge_count(0)
+                continue
+            count = 0
+            for charge in charge_list:
+                if not isinstance(charge, dict):
+                    continue
+                count += 1
+                add_charge_type(charge.get("chargeType"))
+                add_charge_amount((charge.get("chargeAmount") or {}).get("amount"))
+                add_tax_amount(((charge.get("tax") or {}).get("taxAmount") or {}).get("amount"))
+            add_charge_count(count)
+    return columns
+
+
+# Function to turn raw API orders into one columnar row per order line
+def normalize_orders(orders):
+    """Normalize a batch of raw order JSON into a DataFrame with one row per order line.
+
+    The JSON is walked once to collect raw values into column lists; every
+    conversion (numbers, epoch-ms dates, defaults, charge totals) then runs
+    vectorized over the whole batch. All charges of a line are kept: the
+    PRODUCT charge becomes unit_price (falling back to the first charge, as
+    before) and charges are also totalled per type. status is the line's
+    current orderLineStatus.
+    """
+    columns = _extract_columns(orders)
+    row = len(columns["po_ids"])
+    if not row:
+        return _empty_frame()
+
+    quantity = _numbers(columns["quantities"])
+    quantity[~(quantity > 0)] = 1.0
+
+    # Lines without a lineNumber fall back to their position within the order
+    line_number = _numbers(columns["line_numbers"])
+    missing = np.isnan(line_number)
+    if missing.any():
+        position = pd.Series(columns["po_ids"]).groupby(columns["po_ids"], sort=False).cumcount() + 1
+        line_number[missing] = position.to_numpy()[missing]
+
+    # Charges form a long table; charge_rows maps each charge to its order line
+    charge_counts = np.asarray(columns["charge_counts"], dtype=np.int64)
+    charge_rows = np.repeat(np.arange(row), charge_counts)
+    charge_types = np.asarray(columns["charge_types"], dtype=object)
+    amounts = np.nan_to_num(_numbers(columns["charge_amounts"]))
+    taxes = np.nan_to_num(_numbers(columns["tax_amounts"]))
+
+    is_product = charge_types == "PRODUCT"
+    is_shipping = charge_types == "SHIPPING"
+    product_amount = np.bincount(charge_rows[is_product], weights=amounts[is_product], minlength=row).astype(np.float64)
+    has_product = np.bincount(charge_rows[is_product], minlength=row) > 0
+    first_amount = np.zeros(row)
+    has_charges = charge_counts > 0
+    first_amount[has_charges] = amounts[(np.cumsum(charge_counts) - charge_counts)[has_charges]]
+
+    epoch_ms = np.nan_to_num(_numbers(columns["order_dates"])).astype(np.int64)
+
+    frame = pd.DataFrame({
+        "purchase_order_id": columns["po_ids"],
+        "line_number": line_number.astype(np.int64),
+        "sku": columns["skus"],
+        "item_name": columns["item_names"],
+        "quantity": quantity,
+        "unit_price": np.where(has_product, product_amount, first_amount),
+        "product_amount": product_amount,
+        "shipping_amount": np.bincount(
+            charge_rows[is_shipping], weights=amounts[is_shipping], minlength=row
+        ).astype(np.float64),
+        "tax_amount": np.bincount(charge_rows, weights=taxes, minlength=row).astype(np.float64),
+        "charge_count": charge_counts,
+        "order_date": epoch_ms.astype("datetime64[ms]"),
+        "status": columns["statuses"],
+    })
+    return frame
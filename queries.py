@@ -0,0 +1,194 @@
+import datetime
+
+# Number of order lines fetched for the grid per interaction
+PAGE_SIZE = 500
+
+# Most SKUs offered by the sidebar's SKU search at once
+SKU_SEARCH_LIMIT = 50
+
+# Grid sort orders, all served by the order_date indexes
+SORT_ORDERS = {
+    "Newest first": "DESC",
+    "Oldest first": "ASC",
+}
+
+DISPLAY_COLUMNS = '''
+    sku as "SKU",
+    item_name as "Item Name",
+    quantity as "Quantity",
+    ROUND(unit_price, 2) as "Unit Price ($)",
+    purchase_order_id as "Purchase Order ID",
+    status as "Status",
+    order_date as "Order Date"
+'''
+
+
+def _where(sku=None, start_date=None, end_date=None, ship_node=None):
+    """Build a parameterized WHERE clause for the dashboard filters.
+
+    Dates are inclusive and compared as 'YYYY-MM-DD HH:MM:SS' strings, so the
+    (sku, order_date), (ship_node, order_date) and order_date indexes can
+    serve the range directly. A ship_node of None or "All" combines every node.
+    """
+    clauses = []
+    params = []
+    if sku and sku != "All":
+        clauses.append("sku = ?")
+        params.append(sku)
+    if ship_node and ship_node != "All":
+        clauses.append("ship_node = ?")
+        params.append(ship_node)
+    if start_date is not None:
+        clauses.append("order_date >= ?")
+        params.append(start_date.strftime('%Y-%m-%d 00:00:00'))
+    if end_date is not None:
+        clauses.append("order_date < ?")
+        params.append((end_date + datetime.timedelta(days=1)).strftime('%Y-%m-%d 00:00:00'))
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    return where, params
+
+
+def _page_query(sku, start_date, end_date, sort, after, limit, ship_node):
+    """SQL and parameters of one grid page (limit + 1 rows, to tell whether another page follows).
+
+    With `after`, the key replaces the date bound on the side the grid walks
+    from, so the index seek starts at the key itself; ANDing the row-value
+    comparison onto the date range instead would make SQLite seek to the
+    range start and skip every earlier row, like OFFSET.
+    """
+    direction = SORT_ORDERS[sort]
+    if after is None:
+        where, params = _where(sku, start_date, end_date, ship_node)
+    else:
+        key_date, purchase_order_id, line_number = after
+        if direction == "DESC":
+            where, params = _where(sku, start_date, None, ship_node)
+            keyset = "order_date <= ? AND (order_date < ? OR (purchase_order_id, line_number) < (?, ?))"
+        else:
+            where, params = _where(sku, None, end_date, ship_node)
+            keyset = "order_date >= ? AND (order_date > ? OR (purchase_order_id, line_number) > (?, ?))"
+        where += (" AND " if where else "WHERE ") + keyset
+        params += [key_date, key_date, purchase_order_id, line_number]
+    sql = f'''
+        SELECT {DISPLAY_COLUMNS}, line_number as _line_number, order_date as _order_date
+        FROM orders
+        {where}
+        ORDER BY order_date {direction}, purchase_order_id {direction}, line_number {direction}
+        LIMIT ?
+    '''
+    return sql, params + [limit + 1]
+
+
+def query_orders(store, sku=None, start_date=None, end_date=None, sort="Newest first", after=None,
+                 limit=PAGE_SIZE, ship_node=None):
+    """Return one page of matching order lines with display column names, and the key of the next page.
+
+    Pages are keyset-paginated on (order_date, purchase_order_id, line_number):
+    `after` is the key returned with the previous page (None for the first
+    one), so every page is a single walk of the date indexes no matter how
+    deep it is, and only the page itself is ever read into Python. The next
+    key is None on the last page.
+    """
+    sql, params = _page_query(sku, start_date, end_date, sort, after, limit, ship_node)
+    frame = store.read_frame(sql, params, parse_dates=["Order Date"])
+
+    next_key = None
+    if len(frame) > limit:
+        last = frame.iloc[limit - 1]
+        next_key = (last["_order_date"], last["Purchase Order ID"], int(last["_line_number"]))
+        frame = frame.iloc[:limit]
+    return frame.drop(columns=["_line_number", "_order_date"]), next_key
+
+
+# SQL expressions that map a rollup day to the first day of its period
+TREND_PERIODS = {
+    "Daily": "day",
+    "Weekly": "date(day, 'weekday 0', '-6 days')",
+    "Monthly": "substr(day, 1, 7) || '-01'",
+}
+
+
+def _rollup_where(sku=None, start_date=None, end_date=None, ship_node=None):
+    """Pick the rollup table for the filters and build its WHERE clause; dates are inclusive.
+
+    The rollups hold one row per ship node, so the combined view sums across them.
+    """
+    clauses = []
+    params = []
+    table = "daily_rollup"
+    if sku and sku != "All":
+        table = "daily_sku_rollup"
+        clauses.append("sku = ?")
+        params.append(sku)
+    if ship_node and ship_node != "All":
+        clauses.append("ship_node = ?")
+        params.append(ship_node)
+    if start_date is not None:
+        clauses.append("day >= ?")
+        params.append(start_date.strftime('%Y-%m-%d'))
+    if end_date is not None:
+        clauses.append("day <= ?")
+        params.append(end_date.strftime('%Y-%m-%d'))
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    return table, where, params
+
+
+def order_summary(store, sku=None, start_date=None, end_date=None, ship_node=None):
+    """Totals for the matching order lines, read from the daily rollups"""
+    table, where, params = _rollup_where(sku, start_date, end_date, ship_node)
+    row = store.query_one(f'''
+        SELECT
+            COALESCE(SUM(order_lines), 0),
+            COALESCE(SUM(revenue), 0),
+            COALESCE(SUM(units), 0),
+            COALESCE(SUM(orders), 0)
+        FROM {table}
+        {where}
+    ''', params)
+    return {"line_count": row[0], "total_amount": row[1], "total_items": row[2], "order_count": row[3]}
+
+
+def sales_trend(store, sku=None, start_date=None, end_date=None, period="Daily", ship_node=None):
+    """Units, revenue and orders per day, week or month from the daily rollups, oldest first"""
+    table, where, params = _rollup_where(sku, start_date, end_date, ship_node)
+    return store.read_frame(f'''
+        SELECT
+            {TREND_PERIODS[period]} as "Period",
+            SUM(units) as "Units",
+            ROUND(SUM(revenue), 2) as "Revenue ($)",
+            SUM(orders) as "Orders"
+        FROM {table}
+        {where}
+        GROUP BY 1
+        ORDER BY 1
+    ''', params, parse_dates=["Period"])
+
+
+def search_skus(store, text="", limit=SKU_SEARCH_LIMIT):
+    """SKUs for the sidebar typeahead, busiest first.
+
+    Case-insensitive prefix matches on the SKU come first and use the NOCASE
+    index; if they do not fill the limit, SKUs or product names containing
+    the text anywhere are added. An empty search returns the busiest SKUs.
+    The text is used as a LIKE pattern, so % and _ work as wildcards.
+    """
+    text = text.strip()
+    if not text:
+        rows = store.query('SELECT sku FROM skus ORDER BY line_count DESC, sku LIMIT ?', (limit,))
+        return [row[0] for row in rows]
+
+    rows = store.query('''
+        SELECT sku FROM skus WHERE sku LIKE ?
+        ORDER BY line_count DESC, sku LIMIT ?
+    ''', (text + "%", limit))
+    skus = [row[0] for row in rows]
+    if len(skus) < limit:
+        # A substring match has to look at every SKU; +line_count keeps SQLite from walking the
+        # line_count index row by row, which is several times slower than a plain scan and sort
+        rows = store.query('''
+            SELECT sku FROM skus
+            WHERE (sku LIKE ? OR item_name LIKE ?) AND sku NOT LIKE ?
+            ORDER BY +line_count DESC, sku LIMIT ?
+        ''', ("%" + text + "%", "%" + text + "%", text + "%", limit - len(skus)))
+        skus.extend(row[0] for row in rows)
+    return skus
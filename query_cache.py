@@ -0,0 +1,147 @@
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+
+import metrics
+
+# Memory budget for cached results, shared by every session in the process
+MAX_BYTES = int(float(os.getenv("WALMART_QUERY_CACHE_MB", "64")) * 1024 * 1024)
+
+# Seconds a data version read from the database is trusted before it is read again
+VERSION_TTL = float(os.getenv("WALMART_QUERY_CACHE_VERSION_TTL", "2"))
+
+
+def result_size(value):
+    """Approximate memory held by a cached result, in bytes"""
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(result_size(item) for item in value)
+    return sys.getsizeof(value)
+
+
+class QueryCache:
+    """LRU cache of query results keyed on (query, arguments, data version).
+
+    Entries are never invalidated explicitly: every ingest bumps the store's
+    data version, so lookups after a sync simply miss and stale entries age
+    out of the LRU. The data version itself is re-read from the database at
+    most every `version_ttl` seconds (or after a commit by this process), so
+    a repeat view costs no database or pandas work at all. Cached results
+    are shared between sessions and must be treated as read-only.
+    """
+
+    def __init__(self, max_bytes=MAX_BYTES, version_ttl=VERSION_TTL):
+        self.max_bytes = max_bytes
+        self.version_ttl = version_ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._versions = {}
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def data_version(self, store):
+        """The store's data version, read from the database at most once per TTL.
+
+        It is re-read at once after this process commits to the store, so
+        only writes by other processes can take up to the TTL to show.
+        """
+        now = time.monotonic()
+        commits = store.commits
+        with self._lock:
+            cached = self._versions.get(store.path)
+            if cached and now - cached[1] < self.version_ttl and cached[2] == commits:
+                return cached[0]
+        version = store.data_version()
+        with self._lock:
+            self._versions[store.path] = (version, now, commits)
+        return version
+
+    def get_or_compute(self, key, compute):
+        """Return the cached result for key, computing and storing it on a miss"""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                metrics.inc("walmart_query_cache_lookups_total", result="hit")
+                return self._entries[key][0]
+            self.misses += 1
+        metrics.inc("walmart_query_cache_lookups_total", result="miss")
+
+        # Computed outside the lock; two sessions missing the same key both run it
+        value = compute()
+        size = result_size(value)
+        with self._lock:
+            if key in self._entries:
+                self.bytes -= self._entries.pop(key)[1]
+            if size <= self.max_bytes:
+                self._entries[key] = (value, size)
+                self.bytes += size
+                while self.bytes > self.max_bytes:
+                    _, (_, evicted_size) = self._entries.popitem(last=False)
+                    self.bytes -= evicted_size
+                    self.evictions += 1
+        return value
+
+    def cached_query(self, function, store, *args, **kwargs):
+        """Call function(store, *args, **kwargs) through the cache, keyed on the store's data version"""
+        key = (
+            f"{function.__module__}.{function.__qualname__}",
+            store.path,
+            self.data_version(store),
+            args,
+            tuple(sorted(kwargs.items())),
+        )
+
+        def compute():
+            started = time.perf_counter()
+            value = function(store, *args, **kwargs)
+            metrics.observe("walmart_query_seconds", time.perf_counter() - started, query=function.__name__)
+            return value
+
+        return self.get_or_compute(key, compute)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._versions.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_query_cache():
+    """Return the process-wide QueryCache"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = QueryCache()
+        return _cache
+
+
+def cached_query(function, store, *args, **kwargs):
+    """Run a query function through the process-wide cache"""
+    return get_query_cache().cached_query(function, store, *args, **kwargs)
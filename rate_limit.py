@@ -0,0 +1,197 @@
+import contextlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+RATE_LIMIT_PATH = os.getenv("WALMART_RATE_LIMIT_PATH", "walmart_ratelimit.db")
+
+# Set WALMART_RATE_LIMIT=0 to send requests without waiting on the governor
+RATE_LIMIT_ENABLED = os.getenv("WALMART_RATE_LIMIT", "1") != "0"
+
+# Requests per second and burst size assumed for a bucket until the API reports its real quota
+DEFAULT_RATE = float(os.getenv("WALMART_RATE_LIMIT_RPS", "10"))
+DEFAULT_CAPACITY = float(os.getenv("WALMART_RATE_LIMIT_BURST", "10"))
+
+# Longest single wait, so a bogus replenish time cannot stall a fetch for good
+MAX_WAIT = 60.0
+
+# Seconds a connection waits for another process's lock on the bucket file before failing
+BUSY_TIMEOUT = 30
+
+# Rate-limit headers sent with Walmart Marketplace responses
+TOKEN_COUNT_HEADER = "x-current-token-count"
+REPLENISH_TIME_HEADER = "x-next-replenish-time"
+
+# Durability does not matter for bucket state, and every request commits to it
+PRAGMAS = [
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=OFF",
+]
+
+logger = logging.getLogger(__name__)
+
+
+def parse_rate_limit_headers(headers):
+    """(tokens left, replenish time as epoch seconds) from a response's headers; either may be None"""
+    remaining = replenish_at = None
+    try:
+        value = headers.get(TOKEN_COUNT_HEADER)
+        remaining = float(value) if value not in (None, "") else None
+    except ValueError:
+        pass
+    try:
+        value = headers.get(REPLENISH_TIME_HEADER)
+        if value not in (None, ""):
+            replenish_at = float(value)
+            # The API sends epoch milliseconds
+            if replenish_at > 1e11:
+                replenish_at /= 1000
+    except ValueError:
+        pass
+    return remaining, replenish_at
+
+
+class RateLimitGovernor:
+    """Token buckets shared by every process on the host through a small SQLite file.
+
+    There is one bucket per (seller account, endpoint), since that is how
+    Walmart meters calls. Each request takes a token first and waits when
+    there is none. Until a response carries the rate-limit headers a bucket
+    refills steadily at DEFAULT_RATE; after that it follows the API: the
+    token count is set from x-current-token-count, and an empty bucket waits
+    for x-next-replenish-time and then refills to the largest count the API
+    has reported. A 429 empties the bucket until its Retry-After has passed.
+    """
+
+    def __init__(self, path=RATE_LIMIT_PATH, rate=DEFAULT_RATE, capacity=DEFAULT_CAPACITY):
+        self.path = path
+        self.rate = rate
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT, check_same_thread=False, isolation_level=None)
+        for pragma in PRAGMAS:
+            self.conn.execute(pragma)
+        # replenish_at is NULL while the bucket refills steadily at refill_rate
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS buckets (
+                key TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                capacity REAL NOT NULL,
+                refill_rate REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                replenish_at REAL
+            )
+        ''')
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+    @contextlib.contextmanager
+    def _bucket(self, key, now):
+        """Yield the bucket row for key as a dict, refilled to `now`, inside a write transaction; saves it after"""
+        with self._lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = self.conn.execute(
+                    'SELECT tokens, capacity, refill_rate, updated_at, replenish_at FROM buckets WHERE key = ?', (key,)
+                ).fetchone()
+                if row is None:
+                    bucket = {"tokens": self.capacity, "capacity": self.capacity, "refill_rate": self.rate,
+                              "updated_at": now, "replenish_at": None}
+                else:
+                    bucket = dict(zip(("tokens", "capacity", "refill_rate", "updated_at", "replenish_at"), row))
+                if bucket["replenish_at"] is not None:
+                    if now >= bucket["replenish_at"]:
+                        bucket["tokens"] = bucket["capacity"]
+                        bucket["replenish_at"] = None
+                elif now > bucket["updated_at"]:
+                    elapsed = now - bucket["updated_at"]
+                    bucket["tokens"] = min(bucket["capacity"], bucket["tokens"] + elapsed * bucket["refill_rate"])
+                bucket["updated_at"] = max(now, bucket["updated_at"])
+                yield bucket
+                self.conn.execute('''
+                    INSERT OR REPLACE INTO buckets (key, tokens, capacity, refill_rate, updated_at, replenish_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', (key, bucket["tokens"], bucket["capacity"], bucket["refill_rate"], bucket["updated_at"],
+                      bucket["replenish_at"]))
+            except BaseException:
+                self.conn.execute('ROLLBACK')
+                raise
+            self.conn.execute('COMMIT')
+
+    def acquire(self, key):
+        """Take one token from the bucket, sleeping until one is available; returns the seconds waited"""
+        waited = 0.0
+        while True:
+            now = time.time()
+            with self._bucket(key, now) as bucket:
+                if bucket["tokens"] >= 1:
+                    bucket["tokens"] -= 1
+                    wait = 0.0
+                elif bucket["replenish_at"] is not None:
+                    wait = bucket["replenish_at"] - now
+                else:
+                    wait = (1 - bucket["tokens"]) / bucket["refill_rate"]
+            if wait <= 0:
+                return waited
+            wait = min(wait, MAX_WAIT)
+            time.sleep(wait)
+            waited += wait
+
+    def observe(self, key, headers):
+        """Align the bucket with the rate-limit headers of a response, if it has them"""
+        remaining, replenish_at = parse_rate_limit_headers(headers)
+        if remaining is None:
+            return
+        now = time.time()
+        with self._bucket(key, now) as bucket:
+            stored = bucket["replenish_at"]
+            if stored is not None and replenish_at is not None and stored < replenish_at:
+                # The API has started a window this bucket has not refilled for yet
+                bucket["tokens"] = remaining
+            else:
+                # The count does not reflect requests still in flight, so it may only lower the bucket
+                bucket["tokens"] = min(bucket["tokens"], remaining)
+            # The largest count seen approximates the quota an empty bucket is refilled to
+            bucket["capacity"] = max(bucket["capacity"], remaining)
+            bucket["replenish_at"] = replenish_at if replenish_at is not None and replenish_at > now else None
+
+    def throttled(self, key, retry_after):
+        """Record a 429: no tokens until retry_after seconds from now"""
+        now = time.time()
+        with self._bucket(key, now) as bucket:
+            bucket["tokens"] = 0.0
+            bucket["replenish_at"] = max(bucket["replenish_at"] or 0.0, now + retry_after)
+
+    def snapshot(self):
+        """Current state of every bucket, as stored"""
+        with self._lock:
+            rows = self.conn.execute(
+                'SELECT key, tokens, capacity, refill_rate, replenish_at FROM buckets ORDER BY key'
+            ).fetchall()
+        now = time.time()
+        return [
+            {"key": key, "tokens": tokens, "capacity": capacity, "refill_rate": refill_rate,
+             "replenish_in": max(replenish_at - now, 0.0) if replenish_at else None}
+            for key, tokens, capacity, refill_rate, replenish_at in rows
+        ]
+
+
+_governors = {}
+_governors_lock = threading.Lock()
+
+
+def get_governor(path=None):
+    """Return the process-wide RateLimitGovernor for a bucket file, or None when WALMART_RATE_LIMIT=0"""
+    if not RATE_LIMIT_ENABLED:
+        return None
+    path = path or RATE_LIMIT_PATH
+    with _governors_lock:
+        governor = _governors.get(path)
+        if governor is None:
+            governor = RateLimitGovernor(path)
+            _governors[path] = governor
+        return governor
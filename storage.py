@@ -0,0 +1,983 @@
+import collections
+import contextlib
+import hashlib
+import itertools
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+import urllib.parse
+from collections import namedtuple
+from concurrent.futures import Future
+
+import pandas as pd
+
+import metrics
+
+# The dashboard and the ingestion worker coordinate through this file (heartbeats,
+# sync requests, sync state), so both must open the same one: run them on one host
+# or a shared volume. Where processes get separate filesystems (Procfile
+# platforms), the dashboard never sees the worker and syncs in its own process.
+DB_PATH = os.getenv("WALMART_DB_PATH", "walmart_orders.db")
+
+logger = logging.getLogger(__name__)
+
+# Applied to every connection. WAL lets readers run while a writer commits,
+# and synchronous=NORMAL is durable across application crashes in WAL mode.
+# Checkpointing every 10000 pages (~40 MB) rather than the default 1000
+# copies the index pages a sync keeps rewriting back to the database once
+# per several batches instead of after nearly every one.
+PRAGMAS = [
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA wal_autocheckpoint=10000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-65536",
+    "PRAGMA mmap_size=268435456",
+]
+
+# Read-only connections skip journal_mode, which only the writer may change
+READER_PRAGMAS = [pragma for pragma in PRAGMAS if "journal_mode" not in pragma]
+
+# Seconds a connection waits for another process's write lock before failing
+BUSY_TIMEOUT = 30
+
+# Order lines the writer folds into one transaction when batches queue up behind each other
+WRITE_COALESCE_ROWS = int(os.getenv("WALMART_WRITE_COALESCE_ROWS", "20000"))
+
+# Idle read-only connections kept open per store
+READER_POOL_SIZE = 8
+
+ORDER_LINE_DB_COLUMNS = [
+    "purchase_order_id",
+    "line_number",
+    "sku",
+    "item_name",
+    "quantity",
+    "unit_price",
+    "product_amount",
+    "shipping_amount",
+    "tax_amount",
+    "charge_count",
+    "order_date",
+    "status",
+]
+
+# Rollup measures, in the column order units, revenue, order_lines, orders
+ROLLUP_AGGREGATES = '''
+    COALESCE(SUM(quantity), 0),
+    COALESCE(SUM(quantity * unit_price), 0),
+    COUNT(*),
+    COUNT(DISTINCT purchase_order_id)
+'''
+
+
+def _migrate_v1(conn):
+    """Tables as they existed before schema versioning"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS orders (
+            purchase_order_id TEXT PRIMARY KEY,
+            sku TEXT,
+            item_name TEXT,
+            quantity REAL,
+            unit_price REAL,
+            order_date TIMESTAMP
+        )
+    ''')
+    # One row per ship node recording how far incremental sync has got
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS sync_state (
+            ship_node TEXT PRIMARY KEY,
+            high_water_mark TIMESTAMP,
+            synced_through TIMESTAMP,
+            last_sync_at TIMESTAMP,
+            last_sync_mode TEXT,
+            last_sync_status TEXT,
+            last_sync_orders INTEGER
+        )
+    ''')
+    # Liveness of background ingestion workers (see ingest.py)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS worker_status (
+            worker_id TEXT PRIMARY KEY,
+            state TEXT,
+            last_heartbeat TIMESTAMP
+        )
+    ''')
+    # Syncs asked for from the dashboard and picked up by the worker
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS sync_requests (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            mode TEXT,
+            start_date TEXT,
+            end_date TEXT,
+            requested_at TIMESTAMP,
+            claimed_at TIMESTAMP,
+            finished_at TIMESTAMP,
+            status TEXT
+        )
+    ''')
+
+
+def _migrate_v2(conn):
+    """Key orders on (purchase order, line number) and keep every charge total.
+
+    The old table was keyed on purchase_order_id alone, so only the first
+    line of each order survived; those rows are carried over as line 1.
+    """
+    conn.execute('''
+        CREATE TABLE order_lines (
+            purchase_order_id TEXT NOT NULL,
+            line_number INTEGER NOT NULL,
+            sku TEXT,
+            item_name TEXT,
+            quantity REAL,
+            unit_price REAL,
+            product_amount REAL,
+            shipping_amount REAL,
+            tax_amount REAL,
+            charge_count INTEGER,
+            order_date TIMESTAMP,
+            PRIMARY KEY (purchase_order_id, line_number)
+        )
+    ''')
+    conn.execute('''
+        INSERT INTO order_lines (purchase_order_id, line_number, sku, item_name, quantity, unit_price, order_date)
+        SELECT purchase_order_id, 1, sku, item_name, quantity, unit_price, order_date FROM orders
+    ''')
+    conn.execute('DROP TABLE orders')
+    conn.execute('ALTER TABLE order_lines RENAME TO orders')
+
+
+def _migrate_v3(conn):
+    """Indexes for the dashboard's date-range and SKU filters"""
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_orders_order_date ON orders (order_date)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_orders_sku_order_date ON orders (sku, order_date)')
+
+
+def _migrate_v4(conn):
+    """Daily rollups kept up to date by upsert_order_lines, seeded from the stored lines.
+
+    daily_sku_rollup holds one row per (sku, day), with lines without a SKU
+    under ''; daily_rollup holds the totals of each day across all SKUs, so
+    a summary over a year reads a few hundred rows instead of every order
+    line. Weekly and monthly figures are grouped from the daily rows at
+    query time.
+    """
+    conn.execute('''
+        CREATE TABLE daily_sku_rollup (
+            sku TEXT NOT NULL,
+            day TEXT NOT NULL,
+            units REAL,
+            revenue REAL,
+            order_lines INTEGER,
+            orders INTEGER,
+            PRIMARY KEY (sku, day)
+        )
+    ''')
+    conn.execute('CREATE INDEX idx_daily_sku_rollup_day ON daily_sku_rollup (day)')
+    conn.execute('''
+        CREATE TABLE daily_rollup (
+            day TEXT PRIMARY KEY,
+            units REAL,
+            revenue REAL,
+            order_lines INTEGER,
+            orders INTEGER
+        )
+    ''')
+    conn.execute(f'''
+        INSERT INTO daily_sku_rollup (sku, day, units, revenue, order_lines, orders)
+        SELECT COALESCE(sku, ''), substr(order_date, 1, 10), {ROLLUP_AGGREGATES}
+        FROM orders WHERE order_date IS NOT NULL
+        GROUP BY COALESCE(sku, ''), substr(order_date, 1, 10)
+    ''')
+    conn.execute(f'''
+        INSERT INTO daily_rollup (day, units, revenue, order_lines, orders)
+        SELECT substr(order_date, 1, 10), {ROLLUP_AGGREGATES}
+        FROM orders WHERE order_date IS NOT NULL
+        GROUP BY substr(order_date, 1, 10)
+    ''')
+
+
+def _rollup_deltas(before, after):
+    """Signed changes to the daily rollups and SKU line counts between two versions of some orders.
+
+    before and after map each purchase order the batch touches to all of
+    its lines ({line_number: prepared-row layout}), as stored and as they
+    will be stored.
+    Lines of other orders are untouched, so the differences are exact,
+    distinct order counts included, and the cost follows the batch size
+    rather than the size of the table. Returns ({(sku, day, ship_node):
+    [units, revenue, order_lines, orders]}, {(day, ship_node): [...]},
+    {sku: lines}). Like the rollups built by the migrations, lines without
+    an order date are left out of the daily rollups.
+    """
+    by_sku = {}
+    by_day = {}
+    sku_lines = {}
+    for sign, orders in ((-1, before), (1, after)):
+        for lines in orders.values():
+            counted = set()
+            for row in lines.values():
+                sku = _known(row[_SKU]) or ""
+                if sku:
+                    sku_lines[sku] = sku_lines.get(sku, 0) + sign
+                order_date = _known(row[_ORDER_DATE])
+                if order_date is None:
+                    continue
+                quantity = _known(row[_QUANTITY]) or 0
+                unit_price = _known(row[_UNIT_PRICE])
+                revenue = quantity * unit_price if unit_price is not None else 0
+                day_key = (order_date[:10], _known(row[_SHIP_NODE]) or "")
+                for deltas, key in ((by_sku, (sku,) + day_key), (by_day, day_key)):
+                    delta = deltas.get(key)
+                    if delta is None:
+                        delta = deltas[key] = [0, 0, 0, 0]
+                    delta[0] += sign * quantity
+                    delta[1] += sign * revenue
+                    delta[2] += sign
+                    if key not in counted:
+                        # An order counts once per key however many of its lines fall there
+                        counted.add(key)
+                        delta[3] += sign
+    return by_sku, by_day, sku_lines
+
+
+def _apply_rollup_deltas(conn, by_sku, by_day):
+    """Add the deltas from _rollup_deltas to the rollup tables.
+
+    Only keys that lost lines can drop to zero and need checking for
+    deletion. Rows are written in key order, which keeps the upserts on
+    neighbouring pages.
+    """
+    for table, key, deltas in (
+        ("daily_sku_rollup", ("sku", "day", "ship_node"), by_sku),
+        ("daily_rollup", ("day", "ship_node"), by_day),
+    ):
+        columns = ", ".join(key)
+        conn.executemany(f'''
+            INSERT INTO {table} ({columns}, units, revenue, order_lines, orders)
+            VALUES ({", ".join("?" for _ in range(len(key) + 4))})
+            ON CONFLICT({columns}) DO UPDATE SET
+                units = units + excluded.units,
+                revenue = revenue + excluded.revenue,
+                order_lines = order_lines + excluded.order_lines,
+                orders = orders + excluded.orders
+        ''', [key_values + tuple(delta) for key_values, delta in sorted(deltas.items()) if any(delta)])
+        conn.executemany(
+            f'DELETE FROM {table} WHERE {" AND ".join(f"{column} = ?" for column in key)} AND order_lines <= 0',
+            [key_values for key_values, delta in deltas.items() if delta[2] < 0]
+        )
+
+
+def _migrate_v5(conn):
+    """Counter bumped by every write of order lines, used to version cached query results"""
+    conn.execute('''
+        CREATE TABLE data_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        )
+    ''')
+    conn.execute('INSERT INTO data_version (id, version) VALUES (1, 0)')
+
+
+def _migrate_v6(conn):
+    """Content hash of every stored order, so unchanged re-fetched orders can be skipped"""
+    conn.execute('''
+        CREATE TABLE order_fingerprints (
+            purchase_order_id TEXT PRIMARY KEY,
+            content_hash TEXT NOT NULL
+        )
+    ''')
+
+
+def _migrate_v7(conn):
+    """SKU dimension kept up to date by upsert_order_lines, seeded from the stored lines"""
+    conn.execute('''
+        CREATE TABLE skus (
+            sku TEXT PRIMARY KEY,
+            item_name TEXT,
+            first_seen TIMESTAMP,
+            last_seen TIMESTAMP,
+            line_count INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    # Case-insensitive prefix searches (sku LIKE 'abc%') are served by this index
+    conn.execute('CREATE INDEX idx_skus_sku_nocase ON skus (sku COLLATE NOCASE)')
+    conn.execute('CREATE INDEX idx_skus_line_count ON skus (line_count)')
+    # item_name is taken from the line with the latest order_date (SQLite's bare column rule for MAX)
+    conn.execute('''
+        INSERT INTO skus (sku, item_name, last_seen, line_count)
+        SELECT sku, item_name, MAX(order_date), COUNT(*)
+        FROM orders WHERE sku IS NOT NULL AND sku != ''
+        GROUP BY sku
+    ''')
+    conn.execute('UPDATE skus SET first_seen = (SELECT MIN(order_date) FROM orders WHERE orders.sku = skus.sku)')
+
+
+def _apply_sku_changes(conn, sightings, sku_lines):
+    """Update the SKU dimension for a batch.
+
+    sightings maps each SKU of the written lines to [first order_date,
+    last order_date, item_name on the last one]; first_seen and last_seen
+    only ever widen. sku_lines holds the change in each SKU's line count
+    (see _rollup_deltas), so lines that move to another SKU are taken off
+    the old one, and a SKU left without lines is dropped.
+    """
+    conn.executemany('''
+        INSERT INTO skus (sku, first_seen, last_seen, item_name, line_count) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(sku) DO UPDATE SET
+            item_name = CASE WHEN excluded.last_seen >= last_seen THEN excluded.item_name ELSE item_name END,
+            first_seen = MIN(first_seen, excluded.first_seen),
+            last_seen = MAX(last_seen, excluded.last_seen),
+            line_count = line_count + excluded.line_count
+    ''', [(sku,) + tuple(seen) + (sku_lines.get(sku, 0),) for sku, seen in sorted(sightings.items())])
+    conn.executemany('''
+        INSERT INTO skus (sku, line_count) VALUES (?, ?)
+        ON CONFLICT(sku) DO UPDATE SET line_count = line_count + excluded.line_count
+    ''', [(sku, lines) for sku, lines in sku_lines.items() if lines and sku not in sightings])
+    conn.executemany(
+        'DELETE FROM skus WHERE sku = ? AND line_count <= 0',
+        [(sku,) for sku, lines in sku_lines.items() if lines < 0]
+    )
+
+
+def _migrate_v8(conn):
+    """Extend the date indexes with the rest of the grid's sort key, so keyset pages need no sort"""
+    conn.execute('DROP INDEX IF EXISTS idx_orders_order_date')
+    conn.execute('DROP INDEX IF EXISTS idx_orders_sku_order_date')
+    conn.execute('CREATE INDEX idx_orders_order_date ON orders (order_date, purchase_order_id, line_number)')
+    conn.execute(
+        'CREATE INDEX idx_orders_sku_order_date ON orders (sku, order_date, purchase_order_id, line_number)'
+    )
+
+
+def _migrate_v9(conn):
+    """Record which ship node each order line was fetched for.
+
+    Older lines are attributed to the ship node in sync_state when only one
+    was ever synced, and are left NULL otherwise.
+    """
+    conn.execute('ALTER TABLE orders ADD COLUMN ship_node TEXT')
+    conn.execute('''
+        UPDATE orders SET ship_node = (SELECT ship_node FROM sync_state)
+        WHERE (SELECT COUNT(*) FROM sync_state) = 1
+    ''')
+
+
+def _migrate_v10(conn):
+    """Split the daily rollups by ship node, so each source can be viewed alone or combined.
+
+    Lines without a ship node are rolled up under ''. The rollups are
+    rebuilt from the stored lines.
+    """
+    conn.execute('DROP TABLE daily_sku_rollup')
+    conn.execute('DROP TABLE daily_rollup')
+    conn.execute('''
+        CREATE TABLE daily_sku_rollup (
+            sku TEXT NOT NULL,
+            day TEXT NOT NULL,
+            ship_node TEXT NOT NULL,
+            units REAL,
+            revenue REAL,
+            order_lines INTEGER,
+            orders INTEGER,
+            PRIMARY KEY (sku, day, ship_node)
+        )
+    ''')
+    conn.execute('CREATE INDEX idx_daily_sku_rollup_day ON daily_sku_rollup (day)')
+    conn.execute('''
+        CREATE TABLE daily_rollup (
+            day TEXT NOT NULL,
+            ship_node TEXT NOT NULL,
+            units REAL,
+            revenue REAL,
+            order_lines INTEGER,
+            orders INTEGER,
+            PRIMARY KEY (day, ship_node)
+        )
+    ''')
+    conn.execute(f'''
+        INSERT INTO daily_sku_rollup (sku, day, ship_node, units, revenue, order_lines, orders)
+        SELECT COALESCE(sku, ''), substr(order_date, 1, 10), COALESCE(ship_node, ''), {ROLLUP_AGGREGATES}
+        FROM orders WHERE order_date IS NOT NULL
+        GROUP BY 1, 2, 3
+    ''')
+    conn.execute(f'''
+        INSERT INTO daily_rollup (day, ship_node, units, revenue, order_lines, orders)
+        SELECT substr(order_date, 1, 10), COALESCE(ship_node, ''), {ROLLUP_AGGREGATES}
+        FROM orders WHERE order_date IS NOT NULL
+        GROUP BY 1, 2
+    ''')
+    # Serves the grid when it is filtered to one ship node
+    conn.execute('''
+        CREATE INDEX idx_orders_ship_node_order_date ON orders (ship_node, order_date, purchase_order_id, line_number)
+    ''')
+
+
+def _migrate_v11(conn):
+    """Change-feed upserts: a content hash and the status of every line, a status history and a modified mark.
+
+    Lines stored earlier have no hash yet, so each is rewritten once the
+    next time it is fetched. The history holds transitions only: a line's
+    first known status is on the line itself.
+    """
+    conn.execute('ALTER TABLE orders ADD COLUMN status TEXT')
+    conn.execute('ALTER TABLE orders ADD COLUMN line_hash TEXT')
+    # One row per change of a line's status, appended when a stored status changes
+    conn.execute('''
+        CREATE TABLE order_status_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            purchase_order_id TEXT NOT NULL,
+            line_number INTEGER NOT NULL,
+            ship_node TEXT,
+            previous_status TEXT,
+            status TEXT NOT NULL,
+            observed_at TIMESTAMP NOT NULL
+        )
+    ''')
+    conn.execute('CREATE INDEX idx_order_status_history_line ON order_status_history (purchase_order_id, line_number)')
+    conn.execute('CREATE INDEX idx_order_status_history_observed_at ON order_status_history (observed_at)')
+    # How far the lastModified change feed has got, next to the created-date marks
+    conn.execute('ALTER TABLE sync_state ADD COLUMN modified_through TIMESTAMP')
+
+
+def _migrate_v12(conn):
+    """Record which worker claimed a sync request, so a claim left by a dead worker can be taken over"""
+    conn.execute('ALTER TABLE sync_requests ADD COLUMN claimed_by TEXT')
+
+
+# Schema migrations in order; PRAGMA user_version records how many have run
+MIGRATIONS = [
+    _migrate_v1,
+    _migrate_v2,
+    _migrate_v3,
+    _migrate_v4,
+    _migrate_v5,
+    _migrate_v6,
+    _migrate_v7,
+    _migrate_v8,
+    _migrate_v9,
+    _migrate_v10,
+    _migrate_v11,
+    _migrate_v12,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+# A normalize_orders() frame prepared for writing: executemany rows (with the
+# ship node and line hash appended) and fingerprints
+_OrderBatch = namedtuple("_OrderBatch", ["rows", "fingerprints"])
+
+# Positions in a prepared row: ORDER_LINE_DB_COLUMNS, then ship_node and line_hash
+_SKU, _ITEM_NAME, _QUANTITY, _UNIT_PRICE, _ORDER_DATE, _STATUS = (
+    ORDER_LINE_DB_COLUMNS.index(column)
+    for column in ("sku", "item_name", "quantity", "unit_price", "order_date", "status")
+)
+_SHIP_NODE = len(ORDER_LINE_DB_COLUMNS)
+_LINE_HASH = _SHIP_NODE + 1
+
+
+def _prepare_order_lines(order_lines, ship_node, fingerprints):
+    """Turn a normalize_orders() DataFrame into an _OrderBatch of rows ready for executemany"""
+    if order_lines.empty:
+        return _OrderBatch([], fingerprints or {})
+    # Pull each column out as a plain list once; iterating DataFrame rows is far slower
+    values = {column: order_lines[column].tolist() for column in ORDER_LINE_DB_COLUMNS if column != "order_date"}
+    values["order_date"] = order_lines["order_date"].dt.strftime('%Y-%m-%d %H:%M:%S').tolist()
+    rows = [
+        row + (line_hash(row),)
+        for row in zip(*(values[column] for column in ORDER_LINE_DB_COLUMNS), itertools.repeat(ship_node))
+    ]
+    return _OrderBatch(rows, fingerprints or {})
+
+
+def line_hash(row):
+    """Content hash of an order line row (ORDER_LINE_DB_COLUMNS plus ship_node), key columns excluded"""
+    return hashlib.blake2b(repr(row[2:]).encode(), digest_size=8).hexdigest()
+
+
+def read_only_uri(path):
+    """SQLite URI opening the database at path read-only; ?, # and % in the path are quoted"""
+    return f"file:{urllib.parse.quote(path)}?mode=ro"
+
+
+def _known(value):
+    """value, or None for NULL and for the NaN pandas leaves in missing values"""
+    return None if value is None or value != value else value
+
+
+def _add_sighting(sightings, sku, first_seen, last_seen, item_name):
+    seen = sightings.get(sku)
+    if seen is None:
+        sightings[sku] = [first_seen, last_seen, item_name]
+        return
+    if first_seen < seen[0]:
+        seen[0] = first_seen
+    if last_seen >= seen[1]:
+        seen[1] = last_seen
+        seen[2] = item_name
+
+
+def _stored_lines(conn, order_ids):
+    """Every stored line of the given purchase orders, as {purchase_order_id: {line_number: row}}"""
+    columns = ", ".join(ORDER_LINE_DB_COLUMNS + ["ship_node", "line_hash"])
+    stored = {}
+    for offset in range(0, len(order_ids), 500):
+        chunk = order_ids[offset:offset + 500]
+        rows = conn.execute(f'''
+            SELECT {columns} FROM orders WHERE purchase_order_id IN ({", ".join("?" for _ in chunk)})
+        ''', chunk)
+        for row in rows:
+            stored.setdefault(row[0], {})[row[1]] = tuple(row)
+    return stored
+
+
+def _write_order_batches(conn, batches):
+    """Upsert several prepared batches in the caller's transaction; returns the lines changed per batch.
+
+    The stored lines of the purchase orders in the batches are read first
+    (a key lookup each, and nothing to read for new orders). Only lines
+    that are new or whose line_hash differs from the stored one are
+    written, so re-fetching unchanged lines leaves the rollups, the SKU
+    dimension and the data version alone. For the changed lines the daily
+    rollups and the SKU dimension are adjusted by the difference between
+    the old and new versions of their orders, computed from the prepared
+    rows rather than re-read from the table, every change of a stored
+    status is appended to order_status_history, and the data version is
+    bumped once. Later batches win where they overlap.
+    """
+    incoming = {}
+    for index, batch in enumerate(batches):
+        for row in batch.rows:
+            incoming[row[0], row[1]] = (index, row)
+    changed = [0] * len(batches)
+    if incoming:
+        stored = _stored_lines(conn, list({key[0] for key in incoming}))
+        writes = []
+        before = {}
+        after = {}
+        history = []
+        sightings = {}
+        for (purchase_order_id, line_number), (index, row) in incoming.items():
+            lines = stored.get(purchase_order_id, {})
+            previous = lines.get(line_number)
+            if previous is not None:
+                if previous[_LINE_HASH] == row[_LINE_HASH]:
+                    continue
+                if row[_SHIP_NODE] is None:
+                    # The upsert keeps the stored ship node when the batch has none
+                    row = row[:_SHIP_NODE] + (previous[_SHIP_NODE], row[_LINE_HASH])
+                if _known(previous[_STATUS]) is not None and _known(row[_STATUS]) not in (None, previous[_STATUS]):
+                    history.append((purchase_order_id, line_number, row[_SHIP_NODE], previous[_STATUS], row[_STATUS]))
+            changed[index] += 1
+            writes.append(row)
+            if purchase_order_id not in after:
+                before[purchase_order_id] = lines
+                after[purchase_order_id] = dict(lines)
+            after[purchase_order_id][line_number] = row
+            sku, order_date = _known(row[_SKU]), _known(row[_ORDER_DATE])
+            if sku and order_date is not None:
+                _add_sighting(sightings, sku, order_date, order_date, row[_ITEM_NAME])
+
+    if any(changed):
+        columns = ", ".join(ORDER_LINE_DB_COLUMNS + ["ship_node", "line_hash"])
+        updates = ", ".join(
+            [f"{column} = excluded.{column}" for column in ORDER_LINE_DB_COLUMNS[2:]]
+            + ["ship_node = COALESCE(excluded.ship_node, ship_node)", "line_hash = excluded.line_hash"]
+        )
+        writes.sort(key=lambda row: (row[0], row[1]))
+        conn.executemany(f'''
+            INSERT INTO orders ({columns}) VALUES ({", ".join("?" for _ in range(_LINE_HASH + 1))})
+            ON CONFLICT(purchase_order_id, line_number) DO UPDATE SET {updates}
+        ''', writes)
+        conn.executemany('''
+            INSERT INTO order_status_history
+            (purchase_order_id, line_number, ship_node, previous_status, status, observed_at)
+            VALUES (?, ?, ?, ?, ?, strftime('%Y-%m-%d %H:%M:%S', 'now'))
+        ''', history)
+        by_sku, by_day, sku_lines = _rollup_deltas(before, after)
+        _apply_rollup_deltas(conn, by_sku, by_day)
+        _apply_sku_changes(conn, sightings, sku_lines)
+        conn.execute('UPDATE data_version SET version = version + 1')
+    for batch in batches:
+        if batch.fingerprints:
+            _record_fingerprints(conn, batch.fingerprints)
+    return changed
+
+
+def _record_fingerprints(conn, fingerprints):
+    conn.executemany('''
+        INSERT INTO order_fingerprints (purchase_order_id, content_hash) VALUES (?, ?)
+        ON CONFLICT(purchase_order_id) DO UPDATE SET content_hash = excluded.content_hash
+    ''', fingerprints.items())
+
+
+class _Write:
+    """A write waiting for the writer thread: a prepared order batch, or fn(conn) run in its own transaction"""
+
+    def __init__(self, batch=None, fn=None):
+        self.batch = batch
+        self.fn = fn
+        self.future = Future()
+        self.queued_at = time.perf_counter()
+
+
+class OrderStore:
+    """SQLite store holding orders, sync state and worker bookkeeping.
+
+    Every write goes through one writer thread per process, fed by a queue:
+    callers block until their write is committed, and order-line batches
+    queued back to back (concurrent sessions, several sources) are folded
+    into a single transaction of up to WRITE_COALESCE_ROWS lines. Reads use
+    a small pool of separate read-only connections, so with WAL they never
+    wait on a commit. The schema is brought up to SCHEMA_VERSION when the
+    store is opened.
+    """
+
+    def __init__(self, path=DB_PATH):
+        self.path = path
+        self._lock = threading.RLock()
+        self.conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT, check_same_thread=False, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        for pragma in PRAGMAS:
+            self.conn.execute(pragma)
+        self.migrate()
+
+        self._readers = queue.LifoQueue()
+        self._writes = collections.deque()
+        self._writes_ready = threading.Condition()
+        self._writer = None
+        self._stats_lock = threading.Lock()
+        # Also tells the query cache this process may have changed the data version
+        self.commits = 0
+        self.coalesced_batches = 0
+        self.max_queue_depth = 0
+        self.commit_seconds = 0.0
+        self.last_commit_seconds = 0.0
+
+    def close(self):
+        with self._writes_ready:
+            writer = self._writer
+            if writer is not None:
+                self._writes.append(None)
+                self._writes_ready.notify()
+        if writer is not None:
+            writer.join()
+        while True:
+            try:
+                self._readers.get_nowait().close()
+            except queue.Empty:
+                break
+        with self._lock:
+            self.conn.close()
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Run a block of statements as one write transaction on the writer connection"""
+        with self._lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield self.conn
+            except BaseException:
+                self.conn.execute('ROLLBACK')
+                raise
+            self.conn.execute('COMMIT')
+
+    def migrate(self):
+        """Apply any migrations newer than the database's user_version"""
+        with self.transaction() as conn:
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+            for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+                logger.info("Migrating %s to schema version %d", self.path, number)
+                migration(conn)
+                conn.execute(f'PRAGMA user_version = {number}')
+
+    def schema_version(self):
+        return self.query_one('PRAGMA user_version')[0]
+
+    # Reads
+
+    @contextlib.contextmanager
+    def _reader(self):
+        """Check a read-only connection out of the pool, opening one if none is idle"""
+        try:
+            conn = self._readers.get_nowait()
+        except queue.Empty:
+            conn = sqlite3.connect(
+                read_only_uri(self.path), uri=True, timeout=BUSY_TIMEOUT, check_same_thread=False
+            )
+            conn.row_factory = sqlite3.Row
+            for pragma in READER_PRAGMAS:
+                conn.execute(pragma)
+        try:
+            yield conn
+        finally:
+            if self._readers.qsize() < READER_POOL_SIZE:
+                self._readers.put(conn)
+            else:
+                conn.close()
+
+    def query(self, sql, params=()):
+        with self._reader() as conn:
+            return conn.execute(sql, params).fetchall()
+
+    def query_one(self, sql, params=()):
+        with self._reader() as conn:
+            return conn.execute(sql, params).fetchone()
+
+    def read_frame(self, sql, params=(), parse_dates=None):
+        """Run a SELECT and return the result as a DataFrame"""
+        with self._reader() as conn:
+            return pd.read_sql_query(sql, conn, params=params, parse_dates=parse_dates)
+
+    # Writes
+
+    def _submit(self, write):
+        """Queue a write for the writer thread, starting it if needed, and wait for the commit"""
+        if threading.current_thread() is self._writer:
+            # A write issued from inside another write joins its transaction rather than wait on itself
+            if write.batch is not None:
+                return _write_order_batches(self.conn, [write.batch])[0]
+            return write.fn(self.conn)
+        with self._writes_ready:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._run_writer, name="order-store-writer", daemon=True)
+                self._writer.start()
+            self._writes.append(write)
+            depth = len(self._writes)
+            self._writes_ready.notify()
+        with self._stats_lock:
+            self.max_queue_depth = max(self.max_queue_depth, depth)
+        return write.future.result()
+
+    def _write(self, fn):
+        """Run fn(conn) in a write transaction on the writer thread and return its result"""
+        return self._submit(_Write(fn=fn))
+
+    def _run_writer(self):
+        while True:
+            with self._writes_ready:
+                while not self._writes:
+                    self._writes_ready.wait()
+                write = self._writes.popleft()
+                if write is None:
+                    return
+                group = [write]
+                if write.batch is not None:
+                    # Fold the order batches queued right behind this one into the same transaction
+                    rows = len(write.batch.rows)
+                    while (self._writes and self._writes[0] is not None and self._writes[0].batch is not None
+                           and rows < WRITE_COALESCE_ROWS):
+                        group.append(self._writes.popleft())
+                        rows += len(group[-1].batch.rows)
+            self._commit(group)
+
+    def _commit(self, group):
+        """Run a group of queued writes as one transaction and resolve their futures"""
+        started = time.perf_counter()
+        try:
+            with self.transaction() as conn:
+                if group[0].batch is not None:
+                    results = _write_order_batches(conn, [write.batch for write in group])
+                else:
+                    results = [group[0].fn(conn)]
+        except Exception as e:
+            if len(group) > 1:
+                # One bad batch must not fail the batches it was coalesced with
+                for write in group:
+                    self._commit([write])
+                return
+            group[0].future.set_exception(e)
+            return
+        elapsed = time.perf_counter() - started
+        metrics.observe("walmart_commit_seconds", elapsed)
+        with self._stats_lock:
+            self.commits += 1
+            if len(group) > 1:
+                self.coalesced_batches += len(group)
+            self.commit_seconds += elapsed
+            self.last_commit_seconds = elapsed
+        for write, result in zip(group, results):
+            metrics.observe("walmart_write_queue_seconds", started - write.queued_at)
+            write.future.set_result(result)
+
+    def writer_stats(self):
+        """Write queue depth and commit latency of this process's writer"""
+        with self._writes_ready:
+            depth = len(self._writes)
+        with self._stats_lock:
+            return {
+                "queue_depth": depth,
+                "max_queue_depth": self.max_queue_depth,
+                "commits": self.commits,
+                "coalesced_batches": self.coalesced_batches,
+                "avg_commit_ms": self.commit_seconds / self.commits * 1000 if self.commits else 0.0,
+                "last_commit_ms": self.last_commit_seconds * 1000,
+            }
+
+    # Order lines
+
+    def upsert_order_lines(self, order_lines, fingerprints=None, ship_node=None):
+        """Write a normalize_orders() DataFrame and wait for the commit; returns the number of lines changed.
+
+        Lines identical to their stored copy are skipped; for the rest the
+        daily rollups, the SKU dimension and the status history are updated in
+        the same transaction and the data version is bumped (see
+        _write_order_batches). ship_node, if given, is stored on every line.
+        fingerprints, a {purchase_order_id: content_hash} dict for the orders
+        the lines came from, is recorded as well. The batch may share its
+        transaction with other batches queued at the same time.
+        """
+        if order_lines.empty and not fingerprints:
+            return 0
+        return self._submit(_Write(batch=_prepare_order_lines(order_lines, ship_node, fingerprints)))
+
+    def clear_order_lines(self):
+        """Delete every order line and everything derived from them, e.g. before a full replay"""
+        def write(conn):
+            for table in ("orders", "daily_sku_rollup", "daily_rollup", "skus", "order_fingerprints",
+                          "order_status_history"):
+                conn.execute(f'DELETE FROM {table}')
+            conn.execute('UPDATE data_version SET version = version + 1')
+        self._write(write)
+
+    def unchanged_orders(self, fingerprints):
+        """Return the purchase order ids whose stored content hash matches the given one"""
+        unchanged = set()
+        items = list(fingerprints.items())
+        with self._reader() as conn:
+            for offset in range(0, len(items), 500):
+                chunk = items[offset:offset + 500]
+                rows = conn.execute(f'''
+                    SELECT purchase_order_id, content_hash FROM order_fingerprints
+                    WHERE purchase_order_id IN ({", ".join("?" for _ in chunk)})
+                ''', [po_id for po_id, _ in chunk]).fetchall()
+                unchanged.update(row[0] for row in rows if fingerprints[row[0]] == row[1])
+        return unchanged
+
+    def data_version(self):
+        """Counter that changes whenever order lines are written, by any process"""
+        return self.query_one('SELECT version FROM data_version')[0]
+
+    def status_history(self, purchase_order_id=None, limit=100):
+        """Recorded status changes, newest first, of one purchase order or of all of them"""
+        where, params = ("WHERE purchase_order_id = ?", [purchase_order_id]) if purchase_order_id else ("", [])
+        rows = self.query(f'''
+            SELECT purchase_order_id, line_number, ship_node, previous_status, status, observed_at
+            FROM order_status_history {where}
+            ORDER BY id DESC LIMIT ?
+        ''', params + [limit])
+        return [dict(row) for row in rows]
+
+    # Sync state
+
+    def get_sync_state(self, ship_node):
+        """Return the sync_state row for a ship node as a dict, or None if it was never synced"""
+        row = self.query_one('SELECT * FROM sync_state WHERE ship_node = ?', (ship_node,))
+        return dict(row) if row else None
+
+    def list_sync_state(self):
+        """Return the sync_state rows of every ship node"""
+        return [dict(row) for row in self.query('SELECT * FROM sync_state ORDER BY ship_node')]
+
+    def update_sync_state(self, ship_node, high_water_mark, synced_through, mode, status, order_count, synced_at,
+                          modified_through=None):
+        """Record a sync run; the marks only ever move forward"""
+        self._write(lambda conn: conn.execute('''
+                INSERT INTO sync_state
+                (ship_node, high_water_mark, synced_through, last_sync_at, last_sync_mode, last_sync_status,
+                 last_sync_orders, modified_through)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(ship_node) DO UPDATE SET
+                    high_water_mark = NULLIF(MAX(COALESCE(high_water_mark, ''), COALESCE(excluded.high_water_mark, '')), ''),
+                    synced_through = NULLIF(MAX(COALESCE(synced_through, ''), COALESCE(excluded.synced_through, '')), ''),
+                    modified_through = NULLIF(
+                        MAX(COALESCE(modified_through, ''), COALESCE(excluded.modified_through, '')), ''
+                    ),
+                    last_sync_at = excluded.last_sync_at,
+                    last_sync_mode = excluded.last_sync_mode,
+                    last_sync_status = excluded.last_sync_status,
+                    last_sync_orders = excluded.last_sync_orders
+            ''', (ship_node, high_water_mark, synced_through, synced_at, mode, status, order_count, modified_through)))
+
+    # Worker bookkeeping
+
+    def record_heartbeat(self, worker_id, state, now):
+        """Mark a worker as alive"""
+        self._write(lambda conn: conn.execute('''
+                INSERT INTO worker_status (worker_id, state, last_heartbeat) VALUES (?, ?, ?)
+                ON CONFLICT(worker_id) DO UPDATE SET state = excluded.state, last_heartbeat = excluded.last_heartbeat
+            ''', (worker_id, state, now)))
+
+    def latest_heartbeat(self):
+        """Return the most recent worker heartbeat as a dict, or None if no worker ever ran"""
+        row = self.query_one('SELECT * FROM worker_status ORDER BY last_heartbeat DESC LIMIT 1')
+        return dict(row) if row else None
+
+    def request_sync(self, mode, start_date, end_date, now):
+        """Queue a sync for the worker; an identical pending request is reused"""
+        def write(conn):
+            row = conn.execute('''
+                SELECT id FROM sync_requests
+                WHERE claimed_at IS NULL AND mode = ? AND start_date IS ? AND end_date IS ?
+            ''', (mode, start_date, end_date)).fetchone()
+            if row:
+                return row[0]
+            cursor = conn.execute(
+                'INSERT INTO sync_requests (mode, start_date, end_date, requested_at) VALUES (?, ?, ?, ?)',
+                (mode, start_date, end_date, now)
+            )
+            return cursor.lastrowid
+        return self._write(write)
+
+    def claim_sync_request(self, worker_id, now, stale_before):
+        """Claim the oldest unfinished sync request no live worker holds and return it, or None.
+
+        Requests are claimed one at a time, right before they run. A claim
+        whose worker has not sent a heartbeat since stale_before (it died
+        mid-sync) is taken over.
+        """
+        def write(conn):
+            row = conn.execute('''
+                SELECT * FROM sync_requests
+                WHERE finished_at IS NULL AND (claimed_at IS NULL OR NOT EXISTS (
+                    SELECT 1 FROM worker_status
+                    WHERE worker_id = sync_requests.claimed_by AND last_heartbeat >= ?
+                ))
+                ORDER BY id LIMIT 1
+            ''', (stale_before,)).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                'UPDATE sync_requests SET claimed_at = ?, claimed_by = ? WHERE id = ?', (now, worker_id, row['id'])
+            )
+            return dict(row)
+        return self._write(write)
+
+    def finish_sync_request(self, request_id, status, now):
+        self._write(lambda conn: conn.execute(
+            'UPDATE sync_requests SET finished_at = ?, status = ? WHERE id = ?', (now, status, request_id)
+        ))
+
+    def pending_sync_requests(self):
+        """Return the number of sync requests the worker has not finished yet"""
+        return self.query_one('SELECT COUNT(*) FROM sync_requests WHERE finished_at IS NULL')[0]
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(path=None):
+    """Return the process-wide OrderStore for a database file, opening it once"""
+    path = path or DB_PATH
+    with _stores_lock:
+        store = _stores.get(path)
+        if store is None:
+            store = OrderStore(path)
+            _stores[path] = store
+        return store
@@ -0,0 +1,124 @@
+import copy
+import datetime
+import sqlite3
+import zlib
+
+from archive import PageArchive, encode_page
+from ingest import backfill, replay
+from mock_server import MockWalmartServer, SyntheticOrders
+from storage import OrderStore
+from walmart_auth import TokenManager
+from walmart_http import WalmartHttpClient
+from walmart_orders import CREATED, LAST_MODIFIED, OrderFetcher, Page
+
+
+def _fetcher(base_url):
+    http_client = WalmartHttpClient()
+    token_manager = TokenManager("client", "secret", f"{base_url}/v3/token", http_client=http_client)
+    return OrderFetcher(token_manager, f"{base_url}/v3/orders", "node", http_client=http_client)
+
+
+def test_syncs_over_the_same_range_do_not_grow_the_archive(tmp_path):
+    start = datetime.datetime(2024, 1, 1)
+    store = OrderStore(str(tmp_path / "orders.db"))
+    archive = PageArchive(str(tmp_path / "archive.db"))
+    with MockWalmartServer(SyntheticOrders(3000, start, days=3)) as server:
+        fetcher = _fetcher(server.base_url)
+        backfill(fetcher, start, datetime.datetime(2024, 1, 4), store=store, archive=archive)
+        first = archive.stats()
+        # Shifted windows, like an incremental sync re-fetching its overlap from a mark minus two hours
+        overlap_start = start + datetime.timedelta(hours=2, microseconds=1)
+        backfill(fetcher, overlap_start, datetime.datetime(2024, 1, 4, 0, 0, 0, 1), store=store, archive=archive)
+        second = archive.stats()
+
+    # Only pages still holding the latest copy of some order survive: one per shifted window boundary
+    assert second["orders"] <= first["orders"] + 3 * 100
+    assert second["pages"] <= first["pages"] + 3
+
+    lines = store.query_one('SELECT COUNT(*) FROM orders')[0]
+    store.clear_order_lines()
+    replay(store=store, archive=archive)
+    assert store.query_one('SELECT COUNT(*) FROM orders')[0] == lines
+    archive.close()
+    store.close()
+
+
+def _pages(source, first, count, seed=0):
+    return [source.order(index, seed) for index in range(first, first + count)]
+
+
+def test_change_feed_pages_are_kept_apart_and_replayed_by_creation_date(tmp_path):
+    january = datetime.datetime(2024, 1, 1)
+    december = datetime.datetime(2023, 12, 1)
+    created = _pages(SyntheticOrders(40, january, days=1), 0, 10)
+    # Orders created in December and modified on January 1st
+    modified = _pages(SyntheticOrders(40, december, days=1, seed=1), 0, 10, seed=1)
+    day = datetime.timedelta(days=1)
+
+    store = OrderStore(str(tmp_path / "orders.db"))
+    archive = PageArchive(str(tmp_path / "archive.db"))
+    archive.put_page(Page("node", january, january + day, None, created, CREATED), None)
+    archive.put_page(Page("node", january, january + day, None, modified, LAST_MODIFIED), None)
+    assert archive.stats()["pages"] == 2
+    assert len(list(archive.iter_pages(date_filter=LAST_MODIFIED))) == 1
+
+    def replayed(start, end):
+        store.clear_order_lines()
+        replay(start=start, end=end, store=store, archive=archive)
+        return {row[0] for row in store.query('SELECT DISTINCT purchase_order_id FROM orders')}
+
+    created_ids = {order["purchaseOrderId"] for order in created}
+    modified_ids = {order["purchaseOrderId"] for order in modified}
+    assert replayed(january, january + day) == created_ids
+    assert replayed(december, december + day) == modified_ids
+    assert replayed(None, None) == created_ids | modified_ids
+    archive.close()
+    store.close()
+
+
+def test_archives_from_before_date_filters_keep_their_pages(tmp_path):
+    path = str(tmp_path / "archive.db")
+    orders = _pages(SyntheticOrders(40, datetime.datetime(2024, 1, 1), days=1), 0, 10)
+    content, content_hash = encode_page(orders)
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE blobs (content_hash TEXT PRIMARY KEY, payload BLOB NOT NULL, '
+                 'raw_size INTEGER NOT NULL, order_count INTEGER NOT NULL)')
+    conn.execute('CREATE TABLE pages (ship_node TEXT NOT NULL, window_start TEXT NOT NULL, window_end TEXT NOT NULL, '
+                 'cursor TEXT NOT NULL, content_hash TEXT NOT NULL, fetched_at TIMESTAMP, '
+                 'PRIMARY KEY (ship_node, window_start, window_end, cursor))')
+    conn.execute('INSERT INTO blobs VALUES (?, ?, ?, ?)', (content_hash, zlib.compress(content), len(content), 10))
+    conn.execute("INSERT INTO pages (rowid, ship_node, window_start, window_end, cursor, content_hash) "
+                 "VALUES (7, 'node', '2024-01-01 00:00:00', '2024-01-02 00:00:00', '', ?)", (content_hash,))
+    conn.commit()
+    conn.close()
+
+    archive = PageArchive(path)
+    assert archive.conn.execute('SELECT rowid, date_filter FROM pages').fetchall() == [(7, CREATED)]
+    assert archive.conn.execute('SELECT COUNT(*) FROM page_orders WHERE page_id = 7').fetchone()[0] == 10
+    assert list(archive.iter_pages(date_filter=CREATED)) == [("node", orders)]
+    archive.close()
+
+
+def _with_status(order, status):
+    order = copy.deepcopy(order)
+    for line in order["orderLines"]["orderLine"]:
+        line["orderLineStatuses"]["orderLineStatus"][-1]["status"] = status
+    return order
+
+
+def test_a_refetched_page_is_replayed_after_the_pages_fetched_before_it(tmp_path):
+    january = datetime.datetime(2024, 1, 1)
+    day = datetime.timedelta(days=1)
+    order, other = _pages(SyntheticOrders(10, january, days=1), 0, 2)
+    store = OrderStore(str(tmp_path / "orders.db"))
+    archive = PageArchive(str(tmp_path / "archive.db"))
+    archive.put_page(Page("node", january, january + day, None, [_with_status(order, "Created"), other]), None)
+    archive.put_page(Page("node", january, january + 2 * day, None, [_with_status(order, "Shipped")]), None)
+    # The first window again: the order is delivered by now
+    archive.put_page(Page("node", january, january + day, None, [_with_status(order, "Delivered"), other]), None)
+
+    replay(store=store, archive=archive)
+    statuses = store.query('SELECT DISTINCT status FROM orders WHERE purchase_order_id = ?', (order["purchaseOrderId"],))
+    assert [row[0] for row in statuses] == ["Delivered"]
+    archive.close()
+    store.close()
@@ -0,0 +1,113 @@
+import copy
+import datetime
+import os
+
+import pytest
+
+from archive import PageArchive
+from export import _month_bounds, export_from_archive, export_from_store, history_dataset, history_filter, read_history
+from mock_server import SyntheticOrders
+from normalize import normalize_orders
+from storage import OrderStore
+from walmart_orders import Page
+
+pytest.importorskip("pyarrow")
+
+START = datetime.datetime(2024, 1, 20)
+
+
+def _partitions(root):
+    return sorted(
+        os.path.relpath(os.path.join(directory, name), root)
+        for directory, _, names in os.walk(root) for name in names
+    )
+
+
+def test_month_bounds_cover_whole_months():
+    assert _month_bounds() == (None, None)
+    assert _month_bounds("2024-02", "2024-03") == ("2024-02-01 00:00:00", "2024-04-01 00:00:00")
+    assert _month_bounds(end_month="2024-12") == (None, "2025-01-01 00:00:00")
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = OrderStore(str(tmp_path / "orders.db"))
+    orders = SyntheticOrders(2000, START, days=50)
+    # Every other order has no ship node, like lines stored before ship nodes were recorded
+    store.upsert_order_lines(normalize_orders([orders.order(index) for index in range(0, orders.count, 2)]),
+                             ship_node="a")
+    store.upsert_order_lines(normalize_orders([orders.order(index) for index in range(1, orders.count, 2)]))
+    yield store
+    store.close()
+
+
+def test_store_export_writes_every_line_once_per_ship_node_and_month(tmp_path, store):
+    root = str(tmp_path / "history")
+    # Small chunks, so months are finished while the stream moves on
+    rows, partitions = export_from_store(root, store=store, chunk_rows=97)
+    assert rows == store.query_one('SELECT COUNT(*) FROM orders')[0]
+    assert partitions == 6
+    assert _partitions(root) == [
+        os.path.join(f"ship_node={ship_node}", f"month={month}", "part-0.parquet")
+        for ship_node in ("a", "unknown") for month in ("2024-01", "2024-02", "2024-03")
+    ]
+    history = read_history(root)
+    assert len(history) == rows
+    assert not history.duplicated(["purchase_order_id", "line_number"]).any()
+
+    rows, partitions = export_from_store(root, "2024-02", "2024-02", store=store)
+    assert rows == store.query_one('''
+        SELECT COUNT(*) FROM orders WHERE order_date >= '2024-02-01' AND order_date < '2024-03-01'
+    ''')[0]
+    assert partitions == 2
+
+
+def test_history_filters_prune_partitions_and_row_groups(tmp_path, store):
+    root = str(tmp_path / "history")
+    export_from_store(root, store=store, chunk_rows=97)
+    day = datetime.date(2024, 2, 10)
+    dataset = history_dataset(root)
+    expression = history_filter("a", start_date=day, end_date=day)
+
+    fragments = list(dataset.get_fragments(filter=expression))
+    assert len(fragments) == 1
+    assert "ship_node=a" in fragments[0].path and "month=2024-02" in fragments[0].path
+    # Lines were written in date order, one row group per chunk, so a single day skips most of them
+    row_groups = fragments[0].split_by_row_group(expression, schema=dataset.schema)
+    assert 0 < len(row_groups) < fragments[0].metadata.num_row_groups
+
+    history = read_history(root, ship_node="a", start_date=day, end_date=day)
+    expected = store.query('''
+        SELECT COUNT(*) FROM orders WHERE ship_node = 'a' AND order_date >= '2024-02-10' AND order_date < '2024-02-11'
+    ''')[0][0]
+    assert len(history) == expected > 0
+    sku = history["sku"].iloc[0]
+    assert set(read_history(root, sku=sku)["sku"]) == {sku}
+
+
+def _with_status(order, status):
+    order = copy.deepcopy(order)
+    for line in order["orderLines"]["orderLine"]:
+        line["orderLineStatuses"]["orderLineStatus"][-1]["status"] = status
+    return order
+
+
+def test_archive_export_writes_the_latest_copy_of_each_order(tmp_path):
+    orders = SyntheticOrders(200, START, days=2)
+    first = [orders.order(index) for index in range(orders.count)]
+    refetched = [_with_status(order, "Shipped") for order in first[:10]]
+    archive = PageArchive(str(tmp_path / "archive.db"))
+    day = datetime.timedelta(days=1)
+    archive.put_page(Page("a", START, START + 2 * day, None, first), None)
+    archive.put_page(Page("a", START, START + day, None, refetched), None)
+
+    root = str(tmp_path / "history")
+    rows, partitions = export_from_archive(root, archive=archive)
+    expected = normalize_orders(refetched + first[10:])
+    assert (rows, partitions) == (len(expected), 1)
+    history = read_history(root).sort_values(["purchase_order_id", "line_number"])
+    expected = expected.sort_values(["purchase_order_id", "line_number"])
+    assert history["purchase_order_id"].tolist() == expected["purchase_order_id"].tolist()
+    assert history["status"].tolist() == expected["status"].tolist()
+    assert set(history["ship_node"]) == {"a"}
+    archive.close()
@@ -0,0 +1,63 @@
+import datetime
+
+from archive import PageArchive
+from ingest import TIMESTAMP_FORMAT, backfill, incremental_start, incremental_sync, utc_now
+from mock_server import MockWalmartServer, SyntheticOrders
+from storage import OrderStore
+from synthetic import make_orders
+from walmart_auth import TokenManager
+from walmart_http import WalmartHttpClient
+from walmart_orders import FetchError, OrderFetcher, Page, date_range_bounds
+
+
+def _fetcher(base_url):
+    http_client = WalmartHttpClient()
+    token_manager = TokenManager("client", "secret", f"{base_url}/v3/token", http_client=http_client)
+    return OrderFetcher(token_manager, f"{base_url}/v3/orders", "node", http_client=http_client)
+
+
+class _FailingFetcher:
+    """Yields one page of orders, then reports a window that could not be walked"""
+
+    ship_node = "node"
+
+    def __init__(self, orders):
+        self.orders = orders
+
+    def iter_pages(self, start, end, result, progress=None, date_filter=None):
+        result.pages += 1
+        yield Page(self.ship_node, start, end, None, self.orders)
+        result.errors.append(FetchError("window failed"))
+
+
+def test_backfill_through_today_leaves_the_rest_of_today_to_incremental_syncs(tmp_path):
+    store = OrderStore(str(tmp_path / "orders.db"))
+    archive = PageArchive(str(tmp_path / "archive.db"))
+    today = datetime.date.today()
+    start, end = date_range_bounds(today - datetime.timedelta(days=2), today)
+    with MockWalmartServer(SyntheticOrders(2000, start, days=3)) as server:
+        fetcher = _fetcher(server.base_url)
+        began = utc_now()
+        assert backfill(fetcher, start, end, store=store, archive=archive).complete
+
+        synced_through = datetime.datetime.strptime(store.get_sync_state("node")["synced_through"], TIMESTAMP_FORMAT)
+        assert synced_through <= utc_now() < end
+        assert incremental_start("node", store=store) <= began
+        assert incremental_sync(fetcher, store=store, archive=archive).pages > 0
+    archive.close()
+    store.close()
+
+
+def test_incomplete_fetch_advances_no_mark(tmp_path):
+    store = OrderStore(str(tmp_path / "orders.db"))
+    archive = PageArchive(str(tmp_path / "archive.db"))
+    start = datetime.datetime(2024, 1, 1)
+    result = backfill(_FailingFetcher(make_orders(50, start, days=5)), start, start + datetime.timedelta(days=5),
+                      store=store, archive=archive)
+
+    assert not result.complete and result.row_count == 50
+    state = store.get_sync_state("node")
+    assert state["high_water_mark"] is None and state["synced_through"] is None
+    assert state["last_sync_status"] == "incomplete"
+    archive.close()
+    store.close()
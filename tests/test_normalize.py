@@ -0,0 +1,88 @@
+import datetime
+import json
+
+from bench_normalize import flatten_orders_loop
+from normalize import ORDER_LINE_COLUMNS, normalize_orders
+from synthetic import make_orders
+
+# 2024-03-01 12:30:00 UTC
+ORDER_DATE_MS = 1709296200000
+
+
+def _charge(charge_type, amount, tax=None):
+    return {
+        "chargeType": charge_type,
+        "chargeAmount": {"currency": "USD", "amount": amount},
+        "tax": {"taxName": "Tax1", "taxAmount": {"currency": "USD", "amount": tax}} if tax is not None else None,
+    }
+
+
+def _line(charges, line_number=None, quantity="2", statuses=("Created",)):
+    line = {
+        "item": {"productName": "Widget", "sku": "W-1"},
+        "charges": {"charge": charges},
+        "orderLineQuantity": {"unitOfMeasurement": "EACH", "amount": quantity},
+        "orderLineStatuses": {"orderLineStatus": [{"status": status} for status in statuses]},
+    }
+    if line_number is not None:
+        line["lineNumber"] = line_number
+    return line
+
+
+def _order(lines, purchase_order_id="PO-1"):
+    return {"purchaseOrderId": purchase_order_id, "orderDate": ORDER_DATE_MS, "orderLines": {"orderLine": lines}}
+
+
+def test_charges_are_totalled_per_type_and_unit_price_prefers_the_product_charge():
+    frame = normalize_orders([_order([
+        _line([_charge("SHIPPING", "5.99"), _charge("PRODUCT", "20.00", "1.40"), _charge("PRODUCT", "2.50", "0.10")]),
+        _line([_charge("SHIPPING", "4.00", "0.28")]),
+        _line([]),
+    ])])
+
+    assert frame["unit_price"].tolist() == [22.5, 4.0, 0.0]
+    assert frame["product_amount"].tolist() == [22.5, 0.0, 0.0]
+    assert frame["shipping_amount"].tolist() == [5.99, 4.0, 0.0]
+    assert frame["tax_amount"].round(2).tolist() == [1.5, 0.28, 0.0]
+    assert frame["charge_count"].tolist() == [3, 1, 0]
+
+
+def test_line_numbers_fall_back_to_the_position_in_the_order():
+    frame = normalize_orders([
+        _order([_line([], "7"), _line([]), _line([])]),
+        _order([_line([])], purchase_order_id="PO-2"),
+    ])
+    assert frame["line_number"].tolist() == [7, 2, 3, 1]
+
+
+def test_order_dates_are_naive_utc_and_statuses_are_the_latest():
+    frame = normalize_orders([_order([_line([], "1", statuses=("Created", "Shipped"))])])
+    assert frame["order_date"].tolist() == [datetime.datetime(2024, 3, 1, 12, 30)]
+    assert frame["status"].tolist() == ["Shipped"]
+
+
+def test_malformed_orders_and_lines_get_defaults_instead_of_failing_the_batch():
+    frame = normalize_orders([
+        "not an order",
+        {"purchaseOrderId": "PO-3", "orderLines": {"orderLine": ["not a line", {"charges": {"charge": None}}]}},
+        _order([_line([_charge("PRODUCT", "x")], "1", quantity="0")]),
+    ])
+    assert list(frame.columns) == ORDER_LINE_COLUMNS
+    assert frame["purchase_order_id"].tolist() == ["PO-3", "PO-1"]
+    assert frame["sku"].tolist() == ["N/A", "W-1"]
+    assert frame["quantity"].tolist() == [1.0, 1.0]
+    assert frame["unit_price"].tolist() == [0.0, 0.0]
+    assert frame["status"].isna().tolist() == [True, False]
+    assert normalize_orders([]).columns.tolist() == ORDER_LINE_COLUMNS
+
+
+def test_matches_the_per_line_loop_on_synthetic_orders():
+    orders = json.loads(json.dumps(make_orders(500)))
+    frame = normalize_orders(orders)
+    expected = flatten_orders_loop(orders)
+    assert frame["purchase_order_id"].tolist() == [row["Purchase Order ID"] for row in expected]
+    assert frame["sku"].tolist() == [row["SKU"] for row in expected]
+    assert frame["item_name"].tolist() == [row["Item Name"] for row in expected]
+    assert frame["quantity"].tolist() == [row["Quantity"] for row in expected]
+    # Synthetic lines list their PRODUCT charge first, so both pick the same price
+    assert frame["unit_price"].tolist() == [row["Unit Price ($)"] for row in expected]
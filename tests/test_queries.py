@@ -0,0 +1,72 @@
+import datetime
+import sqlite3
+
+import pytest
+
+from normalize import normalize_orders
+from queries import _page_query, query_orders
+from storage import OrderStore
+from synthetic import make_orders
+
+START = datetime.date(2024, 1, 1)
+END = datetime.date(2024, 1, 30)
+
+
+@pytest.fixture(scope="module")
+def store(tmp_path_factory):
+    store = OrderStore(str(tmp_path_factory.mktemp("queries") / "orders.db"))
+    orders = make_orders(30000, datetime.datetime(2024, 1, 1), days=30)
+    for offset in range(0, len(orders), 1000):
+        store.upsert_order_lines(normalize_orders(orders[offset:offset + 1000]), ship_node="node")
+    yield store
+    store.close()
+
+
+def _all_keys(store, sort):
+    direction = "DESC" if sort == "Newest first" else "ASC"
+    rows = store.query(f'''
+        SELECT order_date, purchase_order_id, line_number FROM orders
+        WHERE order_date >= ? AND order_date < ?
+        ORDER BY order_date {direction}, purchase_order_id {direction}, line_number {direction}
+    ''', (f"{START} 00:00:00", f"{END + datetime.timedelta(days=1)} 00:00:00"))
+    return [tuple(row) for row in rows]
+
+
+@pytest.mark.parametrize("sort", ["Newest first", "Oldest first"])
+def test_pages_cover_every_line_once_in_order(store, sort):
+    expected = _all_keys(store, sort)
+    boundaries, lines, after = [], 0, None
+    while True:
+        frame, after = query_orders(store, None, START, END, sort, after=after, limit=997)
+        lines += len(frame)
+        if after is None:
+            break
+        boundaries.append(after)
+    assert lines == len(expected)
+    # Each next-page key is the last row of its page, 997 rows apart in sort order
+    assert boundaries == [expected[index * 997 + 996] for index in range(len(boundaries))]
+
+
+def _page_cost(store, sort, after):
+    """SQLite VM instructions (in thousands) spent producing one page"""
+    sql, params = _page_query(None, START, END, sort, after, 500, None)
+    conn = sqlite3.connect(f"file:{store.path}?mode=ro", uri=True)
+    steps = [0]
+
+    def count():
+        steps[0] += 1
+        return 0
+
+    conn.set_progress_handler(count, 1000)
+    conn.execute(sql, params).fetchall()
+    conn.close()
+    return steps[0]
+
+
+@pytest.mark.parametrize("sort", ["Newest first", "Oldest first"])
+def test_deep_pages_cost_the_same_as_the_first(store, sort):
+    keys = _all_keys(store, sort)
+    first = _page_cost(store, sort, None)
+    deep = _page_cost(store, sort, keys[int(len(keys) * 0.9)])
+    # An OFFSET-like skip would visit ~27000 extra rows and cost tens of times more
+    assert deep <= max(first * 2, first + 5)
@@ -0,0 +1,18 @@
+import datetime
+
+from normalize import normalize_orders
+from queries import order_summary
+from query_cache import QueryCache
+from storage import OrderStore
+from synthetic import make_orders
+
+
+def test_own_writes_are_visible_within_the_version_ttl(tmp_path):
+    store = OrderStore(str(tmp_path / "orders.db"))
+    cache = QueryCache(version_ttl=3600)
+    start, end = datetime.date(2024, 1, 1), datetime.date(2024, 1, 31)
+    assert cache.cached_query(order_summary, store, None, start, end)["line_count"] == 0
+
+    store.upsert_order_lines(normalize_orders(make_orders(100, datetime.datetime(2024, 1, 1), days=30)))
+    assert cache.cached_query(order_summary, store, None, start, end)["line_count"] == 100
+    store.close()
@@ -0,0 +1,49 @@
+import time
+
+import pytest
+
+from rate_limit import RateLimitGovernor, parse_rate_limit_headers
+
+
+@pytest.fixture
+def governor(tmp_path):
+    governor = RateLimitGovernor(str(tmp_path / "ratelimit.db"), rate=20, capacity=2)
+    yield governor
+    governor.close()
+
+
+@pytest.mark.parametrize("headers, expected", [
+    ({"x-current-token-count": "5", "x-next-replenish-time": "1709296200123"}, (5.0, 1709296200.123)),
+    ({"x-current-token-count": "0", "x-next-replenish-time": "1709296200"}, (0.0, 1709296200.0)),
+    ({"x-current-token-count": "", "x-next-replenish-time": "soon"}, (None, None)),
+    ({}, (None, None)),
+])
+def test_replenish_times_are_read_in_milliseconds_or_seconds(headers, expected):
+    assert parse_rate_limit_headers(headers) == expected
+
+
+def test_an_empty_bucket_waits_for_the_refill(governor):
+    assert governor.acquire("orders") == 0
+    assert governor.acquire("orders") == 0
+    # 20 tokens a second: the third request waits about 50 ms
+    assert 0.02 < governor.acquire("orders") < 0.5
+    # Other buckets are not affected
+    assert governor.acquire("token") == 0
+
+
+def test_a_429_empties_the_bucket_until_retry_after(governor):
+    governor.throttled("orders", 0.3)
+    assert governor.snapshot()[0]["tokens"] == 0
+    started = time.monotonic()
+    governor.acquire("orders")
+    assert time.monotonic() - started >= 0.25
+    # After the wait the bucket was refilled to its capacity
+    assert governor.acquire("orders") == 0
+
+
+def test_the_api_token_count_lowers_the_bucket_and_sets_its_replenish_time(governor):
+    replenish_at = time.time() + 0.3
+    governor.observe("orders", {"x-current-token-count": "0", "x-next-replenish-time": str(int(replenish_at * 1000))})
+    bucket = governor.snapshot()[0]
+    assert bucket["tokens"] == 0 and 0 < bucket["replenish_in"] <= 0.3
+    assert governor.acquire("orders") > 0.1
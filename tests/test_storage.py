@@ -0,0 +1,134 @@
+import copy
+import datetime
+import os
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from normalize import normalize_orders
+from storage import OrderStore
+from synthetic import make_orders
+
+
+def test_status_history_holds_transitions_only(tmp_path):
+    store = OrderStore(str(tmp_path / "orders.db"))
+    orders = make_orders(200, datetime.datetime(2024, 1, 1), days=10)
+    store.upsert_order_lines(normalize_orders(orders))
+    assert store.query_one('SELECT COUNT(*) FROM order_status_history')[0] == 0
+
+    shipped = copy.deepcopy(orders[:5])
+    for order in shipped:
+        order["orderDate"] += 3 * 24 * 3600 * 1000
+        for line in order["orderLines"]["orderLine"]:
+            line["orderLineStatuses"]["orderLineStatus"][-1]["status"] = "Shipped"
+    lines = sum(len(order["orderLines"]["orderLine"]) for order in shipped)
+    assert store.upsert_order_lines(normalize_orders(shipped)) == lines
+    assert store.upsert_order_lines(normalize_orders(shipped)) == 0
+    history = store.query('SELECT previous_status, status, COUNT(*) FROM order_status_history GROUP BY 1, 2')
+    assert [tuple(row) for row in history] == [("Created", "Shipped", lines)]
+
+    # The shipped orders moved three days on, so their old rollup keys must have been taken off
+    aggregates = "SUM(quantity), SUM(quantity * unit_price), COUNT(*), COUNT(DISTINCT purchase_order_id)"
+    recomputed = store.query(f'''
+        SELECT substr(order_date, 1, 10), COALESCE(ship_node, ''), {aggregates} FROM orders GROUP BY 1, 2
+    ''')
+    rollup = store.query('SELECT day, ship_node, units, revenue, order_lines, orders FROM daily_rollup ORDER BY 1, 2')
+    assert [tuple(row[:2]) + (round(row[2], 6), round(row[3], 6)) + tuple(row[4:]) for row in rollup] == [
+        tuple(row[:2]) + (round(row[2], 6), round(row[3], 6)) + tuple(row[4:]) for row in recomputed
+    ]
+    store.close()
+
+
+def test_sync_requests_are_claimed_one_at_a_time_and_taken_over_from_dead_workers(tmp_path):
+    store = OrderStore(str(tmp_path / "orders.db"))
+    first = store.request_sync("incremental", None, None, "2024-01-01 00:00:00")
+    assert store.request_sync("incremental", None, None, "2024-01-01 00:00:01") == first
+    second = store.request_sync("backfill", "2024-01-01", "2024-01-02", "2024-01-01 00:00:02")
+
+    store.record_heartbeat("a", "idle", "2024-01-01 00:01:00")
+    assert store.claim_sync_request("a", "2024-01-01 00:01:00", "2024-01-01 00:00:00")["id"] == first
+    # a is alive, so b only gets the request a has not claimed yet
+    store.record_heartbeat("b", "idle", "2024-01-01 00:01:30")
+    assert store.claim_sync_request("b", "2024-01-01 00:01:30", "2024-01-01 00:00:30")["id"] == second
+    assert store.claim_sync_request("b", "2024-01-01 00:01:30", "2024-01-01 00:00:30") is None
+
+    # a died mid-sync: once its heartbeat is stale its claim is taken over
+    store.record_heartbeat("b", "backfill sync", "2024-01-01 00:05:00")
+    assert store.claim_sync_request("b", "2024-01-01 00:05:00", "2024-01-01 00:04:00")["id"] == first
+    store.finish_sync_request(first, "ok", "2024-01-01 00:06:00")
+    store.finish_sync_request(second, "ok", "2024-01-01 00:06:00")
+    assert store.pending_sync_requests() == 0
+    assert store.claim_sync_request("b", "2024-01-01 00:07:00", "2024-01-01 00:06:00") is None
+    store.close()
+
+
+
+def _queue_behind_a_busy_writer(store, calls):
+    """Run calls on threads while another write holds the writer, so they queue up, then release it"""
+    started = threading.Event()
+    release = threading.Event()
+
+    def hold(conn):
+        started.set()
+        release.wait(5)
+
+    blocker = threading.Thread(target=store._write, args=(hold,))
+    blocker.start()
+    started.wait(5)
+    results = [None] * len(calls)
+
+    def run(index):
+        try:
+            results[index] = calls[index]()
+        except Exception as e:
+            results[index] = e
+
+    threads = [threading.Thread(target=run, args=(index,)) for index in range(len(calls))]
+    for thread in threads:
+        thread.start()
+    deadline = time.monotonic() + 5
+    while store.writer_stats()["queue_depth"] < len(calls) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    release.set()
+    for thread in [blocker] + threads:
+        thread.join(timeout=5)
+    return results
+
+
+def test_queued_batches_share_a_commit_and_a_failing_batch_fails_alone(tmp_path):
+    store = OrderStore(str(tmp_path / "orders.db"))
+    frames = [normalize_orders(make_orders(100, datetime.datetime(2024, 1, 1), days=5, seed=seed)) for seed in range(4)]
+
+    results = _queue_behind_a_busy_writer(
+        store, [lambda frame=frame: store.upsert_order_lines(frame) for frame in frames[:3]]
+    )
+    assert results == [len(frame) for frame in frames[:3]]
+    stats = store.writer_stats()
+    # The blocking write, then the three batches in one transaction
+    assert stats["commits"] == 2 and stats["coalesced_batches"] == 3
+    assert stats["max_queue_depth"] >= 3 and stats["queue_depth"] == 0
+    assert stats["avg_commit_ms"] > 0
+
+    # A fingerprint SQLite cannot bind fails the coalesced transaction; each batch is then retried alone
+    results = _queue_behind_a_busy_writer(store, [
+        lambda: store.upsert_order_lines(frames[3]),
+        lambda: store.upsert_order_lines(frames[3].iloc[:0], fingerprints={"PO-1": ["not", "a", "hash"]}),
+    ])
+    assert results[0] == len(frames[3])
+    assert isinstance(results[1], sqlite3.Error)
+    assert store.query_one('SELECT COUNT(*) FROM orders')[0] == sum(len(frame) for frame in frames)
+    store.close()
+
+
+def test_readers_are_read_only_and_paths_may_hold_uri_characters(tmp_path):
+    path = str(tmp_path / "orders?#%20.db")
+    store = OrderStore(path)
+    frame = normalize_orders(make_orders(50, datetime.datetime(2024, 1, 1), days=2))
+    store.upsert_order_lines(frame)
+    assert store.query_one('SELECT COUNT(*) FROM orders')[0] == len(frame)
+    with pytest.raises(sqlite3.OperationalError, match="readonly"):
+        store.query("DELETE FROM orders")
+    assert all(name.startswith("orders?#%20.db") for name in os.listdir(tmp_path))
+    store.close()
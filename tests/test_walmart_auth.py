@@ -0,0 +1,93 @@
+import threading
+import time
+
+import pytest
+
+from walmart_auth import TokenError, TokenManager
+
+
+class _Response:
+    def __init__(self, status_code, payload=None, text=""):
+        self.status_code = status_code
+        self.payload = payload
+        self.text = text
+
+    def json(self):
+        if self.payload is None:
+            raise ValueError("No JSON object could be decoded")
+        return self.payload
+
+
+class _TokenEndpoint:
+    """Stand-in HTTP client whose token endpoint takes `delay` seconds per mint"""
+
+    def __init__(self, expires_in=900, delay=0.0, response=None):
+        self.expires_in = expires_in
+        self.delay = delay
+        self.response = response
+        self.mints = 0
+        self._lock = threading.Lock()
+
+    def post(self, url, headers=None, data=None):
+        time.sleep(self.delay)
+        with self._lock:
+            self.mints += 1
+            mint = self.mints
+        if self.response is not None:
+            return self.response
+        return _Response(200, {"access_token": f"token-{mint}", "expires_in": self.expires_in})
+
+
+def _get_tokens_concurrently(manager, callers=8):
+    results = [None] * callers
+
+    def call(index):
+        try:
+            results[index] = manager.get_token()
+        except Exception as e:
+            results[index] = e
+
+    threads = [threading.Thread(target=call, args=(index,)) for index in range(callers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=5)
+    assert not any(thread.is_alive() for thread in threads)
+    return results
+
+
+def test_short_lived_tokens_are_served_from_the_cache():
+    endpoint = _TokenEndpoint(expires_in=30)
+    manager = TokenManager("client", "secret", "http://token", http_client=endpoint)
+    assert len({manager.get_token() for _ in range(5)}) == 1
+    assert endpoint.mints == 1
+    assert manager.stats()["hits"] == 4
+
+
+def test_concurrent_callers_share_one_mint():
+    endpoint = _TokenEndpoint(delay=0.2)
+    manager = TokenManager("client", "secret", "http://token", http_client=endpoint)
+    assert _get_tokens_concurrently(manager) == ["token-1"] * 8
+    assert endpoint.mints == 1
+
+
+@pytest.mark.parametrize("response", [_Response(500, text="unavailable"), _Response(200, text="<html>")])
+def test_a_failed_mint_releases_every_waiter(response):
+    endpoint = _TokenEndpoint(delay=0.2, response=response)
+    manager = TokenManager("client", "secret", "http://token", http_client=endpoint)
+    results = _get_tokens_concurrently(manager)
+    assert all(isinstance(result, TokenError) for result in results)
+
+    endpoint.response = None
+    assert manager.get_token().startswith("token-")
+
+
+def test_background_refresh_finishes_before_the_token_stops_being_served():
+    # A 4 s token is served for 3 s; the background refresh starts after 2 s
+    endpoint = _TokenEndpoint(expires_in=4, delay=0.1)
+    manager = TokenManager("client", "secret", "http://token", http_client=endpoint)
+    assert manager.get_token() == "token-1"
+    time.sleep(2.5)
+    assert manager.get_token() == "token-2"
+    stats = manager.stats()
+    assert stats["background_refreshes"] == 1 and stats["misses"] == 1
@@ -0,0 +1,38 @@
+import datetime
+
+from mock_server import MockWalmartServer, SyntheticOrders
+from walmart_auth import TokenManager
+from walmart_http import WalmartHttpClient
+from walmart_orders import FetchResult, OrderFetcher
+
+START = datetime.datetime(2024, 1, 1)
+
+
+def _fetcher(base_url, orders_path="/v3/orders", **kwargs):
+    http_client = WalmartHttpClient()
+    token_manager = TokenManager("client", "secret", f"{base_url}/v3/token", http_client=http_client)
+    return OrderFetcher(token_manager, f"{base_url}{orders_path}", "node", http_client=http_client, **kwargs)
+
+
+def test_closing_the_page_iterator_stops_the_window_walks():
+    # One window of about 30 pages, walked by a single worker
+    with MockWalmartServer(SyntheticOrders(5000, START, days=1), latency_ms=10) as server:
+        fetcher = _fetcher(server.base_url, max_workers=1, split_threshold=None)
+        pages = fetcher.iter_pages(START, START + datetime.timedelta(days=1))
+        next(pages)
+        pages.close()
+        requests = server.stats()["requests"]
+    assert requests < 10
+
+
+def test_empty_windows_are_complete_but_unknown_urls_are_errors():
+    with MockWalmartServer(SyntheticOrders(500, START, days=1)) as server:
+        empty = FetchResult()
+        later = START + datetime.timedelta(days=10)
+        assert list(_fetcher(server.base_url).iter_pages(later, later + datetime.timedelta(days=2), empty)) == []
+        assert empty.complete and empty.windows == 2
+
+        wrong = FetchResult()
+        fetcher = _fetcher(server.base_url, "/v3/order")
+        assert list(fetcher.iter_pages(START, START + datetime.timedelta(days=1), wrong)) == []
+        assert not wrong.complete
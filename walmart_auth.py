@@ -0,0 +1,215 @@
+import base64
+import threading
+import time
+import uuid
+
+import requests
+
+import metrics
+from walmart_http import get_http_client
+
+# Refresh the token this many seconds before Walmart says it expires
+DEFAULT_REFRESH_MARGIN = 60
+
+# Short-lived tokens use at most this fraction of their lifetime as the margin
+MAX_MARGIN_FRACTION = 0.25
+
+# Used when the token response does not include expires_in (Walmart issues 15 minute tokens)
+DEFAULT_EXPIRES_IN = 900
+
+
+class TokenError(Exception):
+    """Raised when the token endpoint does not return a usable access token"""
+
+    def __init__(self, message, status_code=None, response_text=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.response_text = response_text
+
+
+class TokenManager:
+    """Process-wide cache for a Walmart OAuth access token.
+
+    The token is kept together with its expiry time and is served until
+    refresh_margin seconds before it expires (at most MAX_MARGIN_FRACTION of
+    its lifetime). A background refresh starts one margin before that
+    cutoff, so callers keep getting the old token while the new one is
+    minted. Concurrent callers that find no valid token wait on a single
+    in-flight refresh instead of each minting their own.
+    """
+
+    def __init__(self, client_id, client_secret, token_url, refresh_margin=DEFAULT_REFRESH_MARGIN,
+                 http_client=None):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.token_url = token_url
+        self.refresh_margin = refresh_margin
+        self.http_client = http_client or get_http_client()
+
+        self._lock = threading.Lock()
+        self._refreshed = threading.Condition(self._lock)
+        self._refreshing = False
+        self._token = None
+        self._expires_at = 0.0
+        self._margin = 0.0
+        self._last_error = None
+        self._timer = None
+
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.failures = 0
+        self.background_refreshes = 0
+
+    def _headers(self):
+        credentials = f"{self.client_id}:{self.client_secret}"
+        encoded_credentials = base64.b64encode(credentials.encode()).decode()
+        return {
+            "Accept": "application/json",
+            "Content-Type": "application/x-www-form-urlencoded",
+            "Authorization": f"Basic {encoded_credentials}",
+            "WM_QOS.CORRELATION_ID": str(uuid.uuid4()),
+            "WM_SVC.NAME": "Walmart Marketplace"
+        }
+
+    def _mint(self):
+        """POST to the token endpoint and return (access_token, expires_in)"""
+        try:
+            response = self.http_client.post(
+                self.token_url,
+                headers=self._headers(),
+                data="grant_type=client_credentials"
+            )
+        except requests.RequestException as e:
+            raise TokenError(f"Failed to get Walmart API token: {e}") from e
+
+        if response.status_code != 200:
+            raise TokenError(
+                f"Token request failed with status {response.status_code}",
+                status_code=response.status_code,
+                response_text=response.text
+            )
+
+        try:
+            token_data = response.json()
+            access_token = token_data.get("access_token")
+            expires_in = float(token_data.get("expires_in") or DEFAULT_EXPIRES_IN)
+        except (ValueError, TypeError, AttributeError) as e:
+            raise TokenError(
+                f"Unreadable token response: {e}",
+                status_code=response.status_code,
+                response_text=response.text
+            ) from e
+        if not access_token:
+            raise TokenError(
+                f"No access token received. Full response: {token_data}",
+                status_code=response.status_code,
+                response_text=response.text
+            )
+        return access_token, expires_in
+
+    def _is_valid(self, now):
+        return self._token is not None and now < self._expires_at - self._margin
+
+    def _refresh(self):
+        """Mint a new token; only one thread runs this at a time"""
+        try:
+            with metrics.span("token_mint"):
+                access_token, expires_in = self._mint()
+        except Exception as e:
+            # Whatever went wrong, waiting callers must be released or they would wait forever
+            with self._lock:
+                self.failures += 1
+                self._last_error = e
+                self._refreshing = False
+                self._refreshed.notify_all()
+            raise
+
+        with self._lock:
+            self.refreshes += 1
+            self._token = access_token
+            self._expires_at = time.time() + expires_in
+            self._margin = min(self.refresh_margin, expires_in * MAX_MARGIN_FRACTION)
+            self._last_error = None
+            self._refreshing = False
+            self._refreshed.notify_all()
+            self._schedule_background_refresh(expires_in)
+        return access_token
+
+    def _schedule_background_refresh(self, expires_in):
+        # Called with the lock held; fires one margin before the token stops being served
+        if self._timer is not None:
+            self._timer.cancel()
+        delay = max(expires_in - 2 * self._margin, 0)
+        self._timer = threading.Timer(delay, self._background_refresh)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _background_refresh(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+            self.background_refreshes += 1
+        try:
+            self._refresh()
+        except Exception:
+            # The next foreground call will retry and surface the error
+            pass
+
+    def get_token(self, force_refresh=False):
+        """Return a valid access token, minting one only when needed"""
+        with self._lock:
+            now = time.time()
+            if not force_refresh and self._is_valid(now):
+                self.hits += 1
+                return self._token
+
+            self.misses += 1
+            if self._refreshing:
+                # Another caller is already minting - wait for its result
+                while self._refreshing:
+                    self._refreshed.wait()
+                if self._is_valid(time.time()):
+                    return self._token
+                if self._last_error is not None:
+                    raise self._last_error
+            self._refreshing = True
+
+        return self._refresh()
+
+    def invalidate(self):
+        """Drop the cached token, e.g. after the API rejects it with a 401"""
+        with self._lock:
+            self._token = None
+            self._expires_at = 0.0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "refreshes": self.refreshes,
+                "background_refreshes": self.background_refreshes,
+                "failures": self.failures,
+                "has_token": self._token is not None,
+                "expires_in": max(self._expires_at - time.time(), 0) if self._token else 0,
+            }
+
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+
+def get_token_manager(client_id, client_secret, token_url):
+    """Return the shared TokenManager for these credentials, creating it once per process.
+
+    Token calls go through the account's HTTP client, like its order calls.
+    """
+    key = (client_id, client_secret, token_url)
+    with _managers_lock:
+        manager = _managers.get(key)
+        if manager is None:
+            manager = TokenManager(client_id, client_secret, token_url, http_client=get_http_client(client_id))
+            _managers[key] = manager
+        return manager
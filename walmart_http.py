@@ -0,0 +1,172 @@
+import email.utils
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+from rate_limit import get_governor
+
+# (connect, read) timeouts in seconds for every Walmart call
+DEFAULT_TIMEOUT = (5, 30)
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class WalmartHttpClient:
+    """Pooled transport that every Walmart API call goes through.
+
+    Keeps one requests.Session with keep-alive connections, applies connect and
+    read timeouts, and retries 429/5xx responses and connection errors with
+    exponential backoff plus jitter, honoring Retry-After when the API sends it.
+    Retries and throttled time are counted separately from successful requests.
+
+    With a governor (see rate_limit.py), every attempt first takes a token
+    from the (account, endpoint) bucket shared by all processes, and every
+    response's rate-limit headers are fed back into it.
+    """
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT, max_retries=5, backoff_base=0.5,
+                 backoff_max=30.0, pool_size=16, governor=None, account=None):
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.governor = governor
+        self.account = account or "default"
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.retries = 0
+        self.throttled = 0
+        self.throttled_seconds = 0.0
+        self.rate_limited_seconds = 0.0
+        self.server_errors = 0
+        self.connection_errors = 0
+
+    def _retry_after(self, response):
+        """Seconds to wait according to the Retry-After header, or None"""
+        value = response.headers.get("Retry-After")
+        if not value:
+            return None
+        try:
+            return max(float(value), 0.0)
+        except ValueError:
+            pass
+        try:
+            retry_at = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        return max(retry_at.timestamp() - time.time(), 0.0)
+
+    def _backoff(self, attempt):
+        # Full jitter: sleep somewhere between 0 and the exponential ceiling
+        ceiling = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        return random.uniform(0, ceiling)
+
+    def _count(self, call_stats, **increments):
+        with self._lock:
+            for name, value in increments.items():
+                setattr(self, name, getattr(self, name) + value)
+        if call_stats is not None:
+            for name, value in increments.items():
+                call_stats[name] = call_stats.get(name, 0) + value
+
+    def request(self, method, url, call_stats=None, **kwargs):
+        """Send a request, retrying throttled and failed attempts; returns the final response.
+
+        Pass a dict as call_stats to also accumulate this call's counters there,
+        since the process-wide totals are shared by every session.
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        endpoint = url.rstrip("/").rsplit("/", 1)[-1]
+        bucket = f"{self.account}:{endpoint}"
+        attempt = 0
+        while True:
+            if self.governor is not None:
+                waited = self.governor.acquire(bucket)
+                if waited:
+                    metrics.inc("walmart_rate_limit_wait_seconds_total", waited, endpoint=endpoint)
+                    self._count(call_stats, rate_limited_seconds=waited)
+            started = time.perf_counter()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                metrics.inc("walmart_http_requests_total", endpoint=endpoint, status="error")
+                self._count(call_stats, connection_errors=1)
+                if attempt >= self.max_retries:
+                    raise
+                metrics.inc("walmart_http_retries_total", reason="connection_error")
+                self._count(call_stats, retries=1)
+                time.sleep(self._backoff(attempt))
+                attempt += 1
+                continue
+            metrics.observe("walmart_http_request_seconds", time.perf_counter() - started, endpoint=endpoint)
+            metrics.inc("walmart_http_requests_total", endpoint=endpoint, status=str(response.status_code))
+            if self.governor is not None:
+                self.governor.observe(bucket, response.headers)
+
+            if response.status_code not in RETRY_STATUSES or attempt >= self.max_retries:
+                self._count(call_stats, requests=1)
+                return response
+
+            delay = self._retry_after(response)
+            if delay is None:
+                delay = self._backoff(attempt)
+            delay = min(delay, self.backoff_max)
+            if response.status_code == 429:
+                if self.governor is not None:
+                    # Hold back every process using this bucket, not just this thread
+                    self.governor.throttled(bucket, delay)
+                metrics.inc("walmart_http_retries_total", reason="throttled")
+                metrics.inc("walmart_http_throttled_seconds_total", delay)
+                self._count(call_stats, retries=1, throttled=1, throttled_seconds=delay)
+            else:
+                metrics.inc("walmart_http_retries_total", reason="server_error")
+                self._count(call_stats, retries=1, server_errors=1)
+            response.close()
+            time.sleep(delay)
+            attempt += 1
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "retries": self.retries,
+                "throttled": self.throttled,
+                "throttled_seconds": self.throttled_seconds,
+                "rate_limited_seconds": self.rate_limited_seconds,
+                "server_errors": self.server_errors,
+                "connection_errors": self.connection_errors,
+            }
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_http_client(account=None):
+    """Return the process-wide WalmartHttpClient of a seller account (or the shared one).
+
+    Walmart throttles each seller account separately, so every account gets
+    its own connection pool, retry counters and rate-limit buckets.
+    """
+    with _clients_lock:
+        client = _clients.get(account)
+        if client is None:
+            client = WalmartHttpClient(governor=get_governor(), account=account)
+            _clients[account] = client
+        return client
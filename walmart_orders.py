@@ -0,0 +1,276 @@
+import datetime
+import os
+import queue
+import threading
+import uuid
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from walmart_http import get_http_client
+
+DEFAULT_WORKERS = int(os.getenv("WALMART_FETCH_WORKERS", "4"))
+DEFAULT_WINDOW = datetime.timedelta(days=1)
+PAGE_SIZE = 100
+
+# A window whose first page reports more orders than this is split in half
+# before its cursor chain is walked, down to MIN_WINDOW
+SPLIT_THRESHOLD = 1000
+MIN_WINDOW = datetime.timedelta(hours=1)
+
+# Date filters of the orders endpoint: by creation time, or by last modification
+# (status transitions, cancellations, refunds and quantity changes)
+CREATED = "created"
+LAST_MODIFIED = "lastModified"
+
+
+# One page of orders as returned by the API. cursor is the nextCursor used to
+# request it (None for the first page of a window), and date_filter says whether
+# the window selected orders by creation or by last modification.
+Page = namedtuple(
+    "Page", ["ship_node", "window_start", "window_end", "cursor", "orders", "date_filter"], defaults=(CREATED,)
+)
+
+
+class FetchError(Exception):
+    """Raised when a window's cursor chain cannot be walked to the end"""
+
+
+class _FetchStopped(Exception):
+    """Raised inside a window walk once the consumer of iter_pages has gone away"""
+
+
+class FetchResult:
+    """Counters for one fetch; `orders` is only filled in by OrderFetcher.fetch"""
+
+    def __init__(self):
+        self.orders = []
+        self.pages = 0
+        self.windows = 0
+        self.splits = 0
+        self.errors = []
+        self.call_stats = {}
+
+    @property
+    def complete(self):
+        return not self.errors
+
+
+def format_api_time(value):
+    """Format a naive UTC datetime the way the orders endpoint expects"""
+    return value.strftime('%Y-%m-%dT%H:%M:%S.') + f"{value.microsecond // 1000:03d}Z"
+
+
+def split_windows(start, end, window=DEFAULT_WINDOW):
+    """Split the half-open range [start, end) into consecutive sub-windows"""
+    windows = []
+    cursor = start
+    while cursor < end:
+        window_end = min(cursor + window, end)
+        windows.append((cursor, window_end))
+        cursor = window_end
+    return windows
+
+
+def date_range_bounds(start_date, end_date):
+    """Turn an inclusive pair of dates into a half-open datetime range"""
+    start = datetime.datetime.combine(start_date, datetime.time.min)
+    end = datetime.datetime.combine(end_date + datetime.timedelta(days=1), datetime.time.min)
+    return start, end
+
+
+class OrderFetcher:
+    """Fetch every order in a date range by walking date-sharded cursor chains concurrently.
+
+    The range is split into sub-windows (one day by default). Each window's
+    nextCursor chain is followed to the end on a worker thread, busy windows
+    are split further, and the results are merged and de-duplicated on
+    purchaseOrderId.
+    """
+
+    def __init__(self, token_manager, orders_url, ship_node, http_client=None,
+                 max_workers=DEFAULT_WORKERS, window=DEFAULT_WINDOW,
+                 split_threshold=SPLIT_THRESHOLD, min_window=MIN_WINDOW, page_size=PAGE_SIZE):
+        self.token_manager = token_manager
+        self.orders_url = orders_url
+        self.ship_node = ship_node
+        self.http_client = http_client or get_http_client()
+        self.max_workers = max(int(max_workers), 1)
+        self.window = window
+        self.split_threshold = split_threshold
+        self.min_window = min_window
+        self.page_size = page_size
+        self._stats_lock = threading.Lock()
+
+    def _headers(self, token):
+        return {
+            "Authorization": f"Bearer {token}",
+            "Accept": "application/json",
+            "WM_QOS.CORRELATION_ID": str(uuid.uuid4()),
+            "WM_SVC.NAME": "Walmart Marketplace",
+            "WM_SEC.ACCESS_TOKEN": token
+        }
+
+    def _get_page(self, params, call_stats):
+        """GET one page of orders, re-minting the token once if it was rejected"""
+        with metrics.span("page_fetch"):
+            token = self.token_manager.get_token()
+            response = self.http_client.get(
+                self.orders_url, headers=self._headers(token), params=params, call_stats=call_stats
+            )
+            if response.status_code == 401:
+                self.token_manager.invalidate()
+                token = self.token_manager.get_token()
+                response = self.http_client.get(
+                    self.orders_url, headers=self._headers(token), params=params, call_stats=call_stats
+                )
+        if response.status_code == 404 and "CONTENT_NOT_FOUND" in response.text:
+            # The orders endpoint answers 404 with this error code when a window holds no
+            # orders; any other 404 (a wrong URL, say) is an error like the rest
+            return {}
+        response.raise_for_status()
+        with metrics.span("json_parse"):
+            return response.json()
+
+    def _walk_window(self, window_start, window_end, allow_split, emit, date_filter=CREATED):
+        """Follow one window's cursor chain, handing each page to emit() as it arrives.
+
+        Returns ("split", halves, call_stats) when the window is too busy and
+        should be sharded further, otherwise ("done", pages, call_stats). An
+        exception raised by emit() abandons the walk.
+        """
+        call_stats = {}
+        params = {
+            "shipNode": self.ship_node,
+            "limit": self.page_size,
+            f"{date_filter}StartDate": format_api_time(window_start),
+            # The API treats the end date as inclusive
+            f"{date_filter}EndDate": format_api_time(window_end - datetime.timedelta(milliseconds=1))
+        }
+        pages = 0
+        cursor = None
+        while True:
+            payload = self._get_page(params, call_stats)
+            pages += 1
+            metrics.inc("walmart_pages_total")
+            order_list = payload.get("list", {}).get("elements", {}).get("order", [])
+            meta = payload.get("list", {}).get("meta", {})
+
+            if pages == 1 and allow_split:
+                total_count = meta.get("totalCount") or 0
+                if total_count > self.split_threshold and window_end - window_start > self.min_window:
+                    middle = window_start + (window_end - window_start) / 2
+                    return "split", [(window_start, middle), (middle, window_end)], call_stats
+
+            orders = [order for order in order_list if isinstance(order, dict)]
+            metrics.inc("walmart_orders_fetched_total", len(orders))
+            if orders:
+                emit(Page(self.ship_node, window_start, window_end, cursor, orders, date_filter))
+            next_cursor = meta.get("nextCursor")
+            if not order_list or not next_cursor:
+                return "done", pages, call_stats
+            cursor = next_cursor
+            params["nextCursor"] = next_cursor
+
+    def iter_pages(self, start, end, result=None, progress=None, date_filter=CREATED):
+        """Yield Pages of orders created in [start, end) (naive UTC datetimes) as they arrive.
+
+        With date_filter=LAST_MODIFIED the range selects orders last modified
+        in it instead, which is the change feed of status and line updates.
+
+        Windows are walked concurrently; at most a few pages per worker are
+        buffered, so memory stays bounded by the page size no matter how large
+        the range is. Counters and window errors are recorded on `result` (a
+        FetchResult). progress, if given, is called as
+        progress(windows_done, windows_known) from the consuming thread.
+        Closing the generator early stops every window at its next page.
+        """
+        if result is None:
+            result = FetchResult()
+        allow_split = self.split_threshold is not None
+        events = queue.Queue(maxsize=self.max_workers * 2)
+        stop = threading.Event()
+
+        def put(event):
+            # Block while the consumer is behind; once it has gone away, stop the walk that is emitting
+            while not stop.is_set():
+                try:
+                    events.put(event, timeout=0.5)
+                    return
+                except queue.Full:
+                    continue
+            raise _FetchStopped()
+
+        def run(window_start, window_end):
+            try:
+                status, value, call_stats = self._walk_window(
+                    window_start, window_end, allow_split, lambda page: put(("page", page)), date_filter
+                )
+                event = (status, (value, call_stats))
+            except _FetchStopped:
+                return
+            except Exception as e:
+                event = ("error", FetchError(f"{format_api_time(window_start)}..{format_api_time(window_end)}: {e}"))
+            try:
+                put(event)
+            except _FetchStopped:
+                pass
+
+        windows = split_windows(start, end, self.window)
+        known = len(windows)
+        outstanding = len(windows)
+        done = 0
+
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        try:
+            for window_start, window_end in windows:
+                executor.submit(run, window_start, window_end)
+
+            while outstanding:
+                kind, value = events.get()
+                if kind == "page":
+                    result.pages += 1
+                    yield value
+                    continue
+
+                if kind == "error":
+                    result.errors.append(value)
+                    outstanding -= 1
+                    done += 1
+                elif kind == "split":
+                    halves, call_stats = value
+                    self._merge_stats(result, call_stats)
+                    result.splits += 1
+                    known += len(halves) - 1
+                    outstanding += len(halves) - 1
+                    for half_start, half_end in halves:
+                        executor.submit(run, half_start, half_end)
+                else:
+                    _, call_stats = value
+                    self._merge_stats(result, call_stats)
+                    result.windows += 1
+                    outstanding -= 1
+                    done += 1
+                if progress is not None:
+                    progress(done, known)
+        finally:
+            stop.set()
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def _merge_stats(self, result, call_stats):
+        with self._stats_lock:
+            for name, value in call_stats.items():
+                result.call_stats[name] = result.call_stats.get(name, 0) + value
+
+    def fetch(self, start, end, progress=None):
+        """Fetch all orders created in [start, end) into memory, de-duplicated and newest first.
+
+        Prefer iter_pages for large ranges; this keeps every order in memory.
+        """
+        result = FetchResult()
+        unique_orders = {}
+        for page in self.iter_pages(start, end, result, progress):
+            for order in page.orders:
+                unique_orders[order.get("purchaseOrderId")] = order
+        result.orders = sorted(unique_orders.values(), key=lambda x: x.get("orderDate") or 0, reverse=True)
+        return result